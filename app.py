@@ -1,8 +1,11 @@
 # app.py
-from flask import Flask
+from flask import Flask, Response
 from flask_cors import CORS
-from routes.chat_routes import chat_routes
+from routes.chat_routes import chat_routes, get_graph_service
 from routes.upload_routes import chat_routes as upload_routes
+from utils.clients import clients
+from utils.config import client_config
+from utils.metrics import registry
 import logging
 
 # Set up logging
@@ -13,15 +16,29 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def warm_up():
+    """Creates the upstream clients and shared services up front instead of on the first request"""
+    clients.warm_up()
+    get_graph_service().create_graph()
+
+
 def create_app():
     """Create and configure the Flask application"""
     app = Flask(__name__)
     CORS(app)
 
+    if client_config.warm_up:
+        warm_up()
+
     # Register blueprints
     app.register_blueprint(chat_routes, url_prefix='/api')
     app.register_blueprint(upload_routes, url_prefix='/api')
 
+    @app.route('/api/metrics')
+    def metrics():
+        """Latency, token, cost, cache and upstream error metrics in the Prometheus text format"""
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
     # Error handlers
     @app.errorhandler(404)
     def not_found(e):
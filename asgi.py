@@ -0,0 +1,189 @@
+# asgi.py
+"""
+ASGI serving mode: one long-lived event loop per worker process.
+
+    uvicorn asgi:app --workers 4
+    python asgi.py
+
+/api/chat, /api/chat/stream and /api/chat/batch are served natively on the worker's loop, so thousands
+of requests waiting on upstream I/O share one thread and the pooled async clients
+instead of each holding a thread and a throwaway loop. Every other route runs through
+the Flask app in a thread pool, with the same contract as under WSGI; its async views
+run on the worker's loop too.
+"""
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from asgiref.sync import SyncToAsync
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import create_app
+from routes.chat_routes import (STREAM_HEADERS, answer_batch, answer_chat, batch_request_error, chat_deadline,
+                                chat_request_error, get_graph_service, stream_format)
+from utils.config import server_config
+from utils.streaming import to_ndjson
+
+logger = logging.getLogger(__name__)
+
+_wsgi_threads = ThreadPoolExecutor(server_config.wsgi_threads, thread_name_prefix="wsgi")
+
+
+class _ThreadedWsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs every WSGI request in one shared thread, one at a time; use a pool instead
+    run_wsgi_app = SyncToAsync(WsgiToAsgiInstance.__dict__["run_wsgi_app"].func, thread_sensitive=False,
+                               executor=_wsgi_threads)
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """WsgiToAsgi that serves WSGI requests concurrently from a thread pool."""
+
+    async def __call__(self, scope, receive, send):
+        await _ThreadedWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+class AsgiApp:
+    """ASGI application serving the chat routes natively and delegating the rest to Flask."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = ThreadedWsgiToAsgi(flask_app)
+        self.routes = {
+            ("POST", "/api/chat"): self.chat,
+            ("POST", "/api/chat/stream"): self.chat_stream,
+            ("POST", "/api/chat/batch"): self.chat_batch,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        handler = self.routes.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if handler is None:
+            await self.wsgi(scope, receive, send)
+        else:
+            await handler(scope, receive, send)
+
+    @staticmethod
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def chat(self, scope, receive, send):
+        data = await _read_json(receive)
+        error = chat_request_error(data)
+        if error:
+            await self._send_json(scope, send, {'error': error}, 400)
+            return
+        try:
+            response = await answer_chat(data)
+        except Exception as e:
+            logger.error(f"Error processing chat request: {str(e)}")
+            await self._send_json(scope, send, {'error': f'Error processing request: {str(e)}'}, 500)
+            return
+        await self._send_json(scope, send, response, 200)
+
+    async def chat_stream(self, scope, receive, send):
+        data = await _read_json(receive)
+        error = chat_request_error(data)
+        if error:
+            await self._send_json(scope, send, {'error': error}, 400)
+            return
+        logger.info(f"Received streaming chat request: {data['message']}")
+
+        headers = _headers(scope)
+        serialize, mimetype = stream_format(parse_accept_header(headers.get("accept"), MIMEAccept).best)
+        response_headers = [("content-type", _content_type(mimetype)),
+                            *((name.lower(), value) for name, value in STREAM_HEADERS.items())]
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": _encode(response_headers + _cors(headers))})
+
+        events = get_graph_service().stream_query(data['message'], session_id=data.get('session_id'),
+                                                  deadline=chat_deadline(data))
+        await self._stream_body(send, events, serialize)
+
+    async def chat_batch(self, scope, receive, send):
+        data = await _read_json(receive)
+        error = batch_request_error(data)
+        if error:
+            await self._send_json(scope, send, {'error': error}, 400)
+            return
+
+        response_headers = [("content-type", "application/x-ndjson"),
+                            *((name.lower(), value) for name, value in STREAM_HEADERS.items())]
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": _encode(response_headers + _cors(_headers(scope)))})
+        await self._stream_body(send, answer_batch(data['messages']), to_ndjson)
+
+    @staticmethod
+    async def _stream_body(send, events, serialize) -> None:
+        try:
+            async for event in events:
+                await send({"type": "http.response.body", "body": serialize(event).encode("utf-8"),
+                            "more_body": True})
+        finally:
+            # Also stops the graph runs when the client goes away
+            await events.aclose()
+        await send({"type": "http.response.body", "body": b""})
+
+    async def _send_json(self, scope, send, body: Any, status: int) -> None:
+        # Same serialization as jsonify outside debug mode
+        payload = (self.flask_app.json.dumps(body, separators=(",", ":")) + "\n").encode("utf-8")
+        headers = [("content-type", "application/json"), ("content-length", str(len(payload)))]
+        await send({"type": "http.response.start", "status": status,
+                    "headers": _encode(headers + _cors(_headers(scope)))})
+        await send({"type": "http.response.body", "body": payload})
+
+
+async def _read_json(receive) -> Optional[Any]:
+    """The request body parsed as JSON, or None if it isn't valid JSON."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(b"".join(chunks))
+    except ValueError:
+        return None
+
+
+def _headers(scope) -> Dict[str, str]:
+    return {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+
+
+def _cors(request_headers: Dict[str, str]) -> List[Tuple[str, str]]:
+    # Matches flask_cors' defaults for the routes served through Flask
+    return [("access-control-allow-origin", "*")] if "origin" in request_headers else []
+
+
+def _content_type(mimetype: str) -> str:
+    return f"{mimetype}; charset=utf-8" if mimetype.startswith("text/") else mimetype
+
+
+def _encode(headers: List[Tuple[str, str]]) -> List[Tuple[bytes, bytes]]:
+    return [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+def create_asgi_app(flask_app=None) -> AsgiApp:
+    """Wraps ``create_app()`` for ASGI servers."""
+    return AsgiApp(flask_app or create_app())
+
+
+app = create_asgi_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", host=server_config.host, port=server_config.port, workers=server_config.workers)
@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from utils.tokens import count_tokens
+
+# Query keywords the fake supervisor routes on; anything else goes to the first bound tool
+DEFAULT_TOOL_KEYWORDS: Dict[str, List[str]] = {
+    "search_google": ["news", "latest", "weather", "today", "price"],
+    "frontend_agent_tool": ["react", "css", "flexbox", "component"],
+    "backend_agent_tool": ["api", "database", "sql", "server"],
+    "designer_agent_tool": ["design", "color", "font", "layout"],
+    "legal_expert": ["contract", "clause", "liable", "law"],
+    "finance_expert": ["revenue", "budget", "invoice", "expense"],
+}
+
+
+def keyword_tool_script(keywords: Dict[str, List[str]] = DEFAULT_TOOL_KEYWORDS) -> Callable[[str, List[str]], List[str]]:
+    """Tool-call script picking every bound tool whose keywords appear in the query."""
+
+    def script(query: str, tools: List[str]) -> List[str]:
+        words = set(re.findall(r"\w+", query.lower()))
+        chosen = [name for name in tools if words & set(keywords.get(name, []))]
+        return chosen or tools[:1]
+
+    return script
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic stand-in for ChatOpenAI with configurable latency.
+
+    Without bound tools it answers with ``answer_words`` words. With tools bound it
+    acts as the supervisor: on the first turn it calls the tools chosen by
+    ``tool_script(query, tool_names)``, afterwards it answers. Latency is
+    ``latency`` seconds to the first token plus ``token_latency`` per streamed token.
+    """
+
+    model_name: str = "fake-chat"
+    latency: float = 0.5
+    token_latency: float = 0.0
+    answer_words: int = 40
+    tool_names: List[str] = []
+    tool_script: Optional[Callable[[str, List[str]], List[str]]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def bind_tools(self, tools, **kwargs) -> "FakeChatModel":
+        return self.model_copy(update={"tool_names": [tool.name for tool in tools]})
+
+    def _respond(self, messages: List[BaseMessage]) -> AIMessage:
+        query = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        prompt_tokens = sum(count_tokens(str(m.content)) for m in messages)
+        if self.tool_names and isinstance(messages[-1], HumanMessage):
+            script = self.tool_script or keyword_tool_script()
+            tool_calls = [
+                {"name": name, "args": {"query": query}, "id": f"call_{i}_{hashlib.md5(query.encode()).hexdigest()[:8]}"}
+                for i, name in enumerate(script(query, self.tool_names))
+            ]
+            content = ""
+        else:
+            tool_calls = []
+            seed = hashlib.md5(query.encode()).hexdigest()
+            content = " ".join(f"w{seed[i % len(seed)]}{i}" for i in range(self.answer_words))
+        completion_tokens = count_tokens(content) + 10 * len(tool_calls)
+        return AIMessage(content=content, tool_calls=tool_calls, usage_metadata={
+            "input_tokens": prompt_tokens,
+            "output_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        })
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._respond(messages)
+        time.sleep(self.latency + self.token_latency * self.answer_words * bool(message.content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = self._respond(messages)
+        await asyncio.sleep(self.latency + self.token_latency * self.answer_words * bool(message.content))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._respond(messages)
+        await asyncio.sleep(self.latency)
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="",
+                tool_call_chunks=[
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                    for i, call in enumerate(message.tool_calls)
+                ],
+                usage_metadata=message.usage_metadata,
+            ))
+            return
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=message.usage_metadata))
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic feature-hashing embeddings with configurable latency per call.
+
+    Texts sharing words get similar vectors, so retrieval and similarity caches
+    behave plausibly without a model.
+    """
+
+    def __init__(self, size: int = 1536, latency: float = 0.05, model: str = "fake-embedding"):
+        self.size = size
+        self.latency = latency
+        self.model = model
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = int(hashlib.md5(word.encode()).hexdigest(), 16)
+            vector[digest % self.size] += 1.0 if (digest >> 64) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if not norm:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class InMemoryIndex:
+    """
+    Thread-safe in-memory stand-in for a Pinecone index.
+
+    Supports the ``upsert``/``query``/``delete``/``fetch`` calls the app makes, with metadata
+    filters of the form ``{"field": value}`` or ``{"field": {"$eq": value}}``.
+    """
+
+    def __init__(self, latency: float = 0.02):
+        self.latency = latency
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._metadata: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors, namespace: Optional[str] = None, **kwargs) -> Dict[str, int]:
+        time.sleep(self.latency)
+        with self._lock:
+            for vector in vectors:
+                self._vectors[vector["id"]] = np.asarray(vector["values"], dtype=np.float32)
+                self._metadata[vector["id"]] = dict(vector.get("metadata") or {})
+        return {"upserted_count": len(vectors)}
+
+    def delete(self, ids=None, namespace: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        time.sleep(self.latency)
+        with self._lock:
+            for vector_id in ids or []:
+                self._vectors.pop(vector_id, None)
+                self._metadata.pop(vector_id, None)
+        return {}
+
+    def query(self, vector, top_k: int = 10, include_metadata: bool = False, filter: Optional[Dict] = None,
+              namespace: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        time.sleep(self.latency)
+        with self._lock:
+            ids = [vector_id for vector_id, metadata in self._metadata.items() if _matches(metadata, filter)]
+            if not ids:
+                return {"matches": []}
+            matrix = np.stack([self._vectors[vector_id] for vector_id in ids])
+            metadata = [dict(self._metadata[vector_id]) for vector_id in ids]
+        query = np.asarray(vector, dtype=np.float32)
+        scores = matrix @ query / np.maximum(np.linalg.norm(matrix, axis=1) * np.linalg.norm(query), 1e-12)
+        top = np.argsort(scores)[::-1][:top_k]
+        return {"matches": [
+            {"id": ids[i], "score": float(scores[i]), **({"metadata": metadata[i]} if include_metadata else {})}
+            for i in top
+        ]}
+
+    def fetch(self, ids, namespace: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        time.sleep(self.latency)
+        with self._lock:
+            return {"vectors": {
+                vector_id: {"id": vector_id, "values": self._vectors[vector_id].tolist(),
+                            "metadata": dict(self._metadata[vector_id])}
+                for vector_id in ids if vector_id in self._vectors
+            }}
+
+    def describe_index_stats(self, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            return {"total_vector_count": len(self._vectors)}
+
+
+def _matches(metadata: Dict[str, Any], filter: Optional[Dict]) -> bool:
+    for field, condition in (filter or {}).items():
+        expected = condition.get("$eq") if isinstance(condition, dict) else condition
+        if metadata.get(field) != expected:
+            return False
+    return True
+
+
+class FakePinecone:
+    """Pinecone client stand-in handing out one shared InMemoryIndex per index name."""
+
+    indexes: Dict[str, InMemoryIndex] = {}
+    latency: float = 0.02
+
+    def __init__(self, api_key: Optional[str] = None, **kwargs):
+        pass
+
+    def Index(self, name: str = None, **kwargs) -> InMemoryIndex:
+        return self.indexes.setdefault(name, InMemoryIndex(self.latency))
+
+
+def fake_google_search(latency: float = 0.3) -> Callable[[str], Any]:
+    async def google_search(query: str) -> str:
+        await asyncio.sleep(latency)
+        return f"Result snippets for {query}"
+
+    return google_search
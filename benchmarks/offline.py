@@ -0,0 +1,88 @@
+"""
+Swaps the OpenAI, Pinecone and Google clients for the local stand-ins in benchmarks.fakes.
+
+The stand-ins are injected into the shared client registry, so ``install`` must run
+before the first request but can run after the app modules are imported.
+"""
+import os
+import tempfile
+from dataclasses import dataclass
+from typing import List
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings, FakePinecone, fake_google_search
+from utils.clients import clients
+from utils.config import checkpoint_config, client_config, ingestion_config, retrieval_config, vector_config
+
+
+@dataclass
+class FakeLatencies:
+    """Simulated upstream latencies in seconds."""
+    chat: float = 0.5
+    chat_token: float = 0.0
+    small_chat: float = 0.2
+    embedding: float = 0.05
+    pinecone: float = 0.02
+    google: float = 0.3
+
+
+def install(latencies: FakeLatencies = FakeLatencies(), answer_words: int = 40,
+            vector_backend: str = "pinecone") -> None:
+    """
+    Injects the stand-in clients and points file-backed state at a temporary directory.
+
+    With ``vector_backend="local"`` the knowledge base uses the real in-process index
+    instead of the fake Pinecone, and its latency setting is ignored.
+    """
+    state_dir = tempfile.mkdtemp(prefix="bench-")
+    ingestion_config.manifest_path = os.path.join(state_dir, "manifest.db")
+    checkpoint_config.path = os.path.join(state_dir, "checkpoints.db")
+    retrieval_config.lexical_index_path = os.path.join(state_dir, "lexical_index.db")
+    vector_config.path = os.path.join(state_dir, "kb_vectors.db")
+    vector_config.backend = vector_backend
+    FakePinecone.latency = latencies.pinecone
+    clients.override("chat_model", FakeChatModel(
+        model_name=client_config.agent_model,
+        latency=latencies.chat,
+        token_latency=latencies.chat_token,
+        answer_words=answer_words,
+    ))
+    clients.override("small_chat_model", FakeChatModel(
+        model_name=client_config.small_agent_model,
+        latency=latencies.small_chat,
+        token_latency=latencies.chat_token,
+        answer_words=answer_words,
+    ))
+    clients.override("openai_embeddings", FakeEmbeddings(latency=latencies.embedding,
+                                                         model=client_config.embedding_model))
+    clients.override("pinecone", FakePinecone())
+
+    import utils.tools
+    utils.tools.google_search = fake_google_search(latencies.google)
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Builds a minimal single-font PDF with one text line per page, enough for pypdf to extract."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in pages:
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1", "replace")
+        stream = b"BT /F1 10 Tf 20 800 Td (" + escaped + b") Tj ET"
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % len(objects)
+        )
+        page_ids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
@@ -0,0 +1,266 @@
+"""
+Offline load tests for the chat graph and the HTTP endpoints.
+
+OpenAI, Pinecone and Google are replaced by deterministic local fakes with
+configurable latency (see benchmarks/offline.py), so runs are repeatable and free.
+Each scenario reports p50/p95/p99 latency, throughput and peak memory.
+
+Usage, from the repository root:
+    python -m benchmarks.run --scenario all --requests 200 --concurrency 20
+    python -m benchmarks.run --scenario upload --requests 10 --pages 50 --json results.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import resource
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from benchmarks import offline
+
+QUERIES = [
+    "What was our revenue last quarter?",
+    "Which law governs this contract clause?",
+    "How do I center a React component with flexbox?",
+    "How should I design the database schema for the API server?",
+    "What color palette and font work for this layout?",
+    "What is the latest news about electric cars today?",
+    "How is the budget split and what are the invoice terms?",
+    "Summarize the expense policy and the contract termination clause.",
+]
+
+
+@dataclass
+class BenchmarkResult:
+    scenario: str
+    requests: int
+    concurrency: int
+    errors: int
+    seconds: float
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    peak_traced_mb: float
+    max_rss_mb: float
+    extra: dict = field(default_factory=dict)
+
+    def summary(self) -> str:
+        return (
+            f"{self.scenario:<8} n={self.requests:<5} c={self.concurrency:<4} err={self.errors:<4} "
+            f"p50={self.p50 * 1000:8.1f}ms p95={self.p95 * 1000:8.1f}ms p99={self.p99 * 1000:8.1f}ms "
+            f"{self.throughput:8.2f} req/s  peak={self.peak_traced_mb:7.1f}MB rss={self.max_rss_mb:7.1f}MB"
+        )
+
+
+def _result(scenario: str, latencies: List[float], errors: int, seconds: float, concurrency: int,
+            **extra) -> BenchmarkResult:
+    _, peak = tracemalloc.get_traced_memory()
+    values = np.asarray(latencies) if latencies else np.zeros(1)
+    return BenchmarkResult(
+        scenario=scenario,
+        requests=len(latencies),
+        concurrency=concurrency,
+        errors=errors,
+        seconds=seconds,
+        throughput=len(latencies) / seconds if seconds else 0.0,
+        p50=float(np.percentile(values, 50)),
+        p95=float(np.percentile(values, 95)),
+        p99=float(np.percentile(values, 99)),
+        peak_traced_mb=peak / 2 ** 20,
+        # ru_maxrss is in KiB on Linux
+        max_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        extra=extra,
+    )
+
+
+def run_threaded(scenario: str, call: Callable[[int], bool], requests: int, concurrency: int,
+                 **extra) -> BenchmarkResult:
+    """Runs ``call(i)`` for every request from a pool of client threads; it returns False on an error."""
+    latencies, errors = [], 0
+
+    def timed(i: int):
+        started = time.perf_counter()
+        ok = call(i)
+        return time.perf_counter() - started, ok
+
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for latency, ok in pool.map(timed, range(requests)):
+            latencies.append(latency)
+            errors += not ok
+    return _result(scenario, latencies, errors, time.perf_counter() - started, concurrency, **extra)
+
+
+def bench_graph(requests: int, concurrency: int, unique: bool) -> BenchmarkResult:
+    """Calls GraphService.process_query directly, ``concurrency`` at a time on one event loop."""
+    from routes.chat_routes import get_graph_service
+    graph_service = get_graph_service()
+
+    async def run() -> BenchmarkResult:
+        slots = asyncio.Semaphore(concurrency)
+        latencies, errors = [], 0
+
+        async def one(i: int):
+            nonlocal errors
+            async with slots:
+                started = time.perf_counter()
+                response = await graph_service.process_query(_query(i, unique))
+                latencies.append(time.perf_counter() - started)
+                errors += not isinstance(response, dict)
+
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        return _result("graph", latencies, errors, time.perf_counter() - started, concurrency)
+
+    return asyncio.run(run())
+
+
+def bench_chat(requests: int, concurrency: int, unique: bool, stream: bool = False) -> BenchmarkResult:
+    """Posts to /api/chat (or /api/chat/stream) through the Flask test client."""
+    from app import create_app
+
+    app = create_app()
+    path = '/api/chat/stream' if stream else '/api/chat'
+
+    def call(i: int) -> bool:
+        with app.test_client() as client:
+            response = client.post(path, json={'message': _query(i, unique)})
+            body = response.get_data()
+            return response.status_code == 200 and b'error' not in body[-200:]
+
+    return run_threaded("stream" if stream else "chat", call, requests, concurrency)
+
+
+def bench_batch(requests: int, unique: bool) -> BenchmarkResult:
+    """
+    Posts every query in one /api/chat/batch request; latency is each answer's arrival time.
+    Concurrency is the server's BATCH_CONCURRENCY.
+    """
+    from app import create_app
+    from utils.clients import clients
+    from utils.config import batch_config
+
+    app = create_app()
+    embeddings = clients.get("openai_embeddings")
+    embedding_calls = embeddings.calls
+    latencies, errors = [], 0
+
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    with app.test_client() as client:
+        response = client.post('/api/chat/batch', json={'messages': [_query(i, unique) for i in range(requests)]},
+                               buffered=False)
+        for line in response.response:
+            latencies.append(time.perf_counter() - started)
+            errors += 'error' in json.loads(line)
+        errors += response.status_code != 200
+    return _result("batch", latencies, errors, time.perf_counter() - started, batch_config.concurrency,
+                   embedding_calls=embeddings.calls - embedding_calls)
+
+
+def bench_upload(requests: int, concurrency: int, pages: int, words_per_page: int,
+                 timeout: float = 600) -> BenchmarkResult:
+    """Uploads generated PDFs to /api/upload and waits for each ingestion job to finish."""
+    from app import create_app
+
+    app = create_app()
+
+    def call(i: int) -> bool:
+        pdf = offline.make_pdf([
+            " ".join(f"doc{i}page{p}word{w}" for w in range(words_per_page)) for p in range(pages)
+        ])
+        with app.test_client() as client:
+            response = client.post('/api/upload', data={
+                'type': 'finance',
+                'files': (io.BytesIO(pdf), f'bench-{i}.pdf'),
+            }, content_type='multipart/form-data')
+            if response.status_code != 202:
+                return False
+            status_url = '/api' + response.get_json()['status_url'].removeprefix('/api')
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                job = client.get(status_url).get_json()
+                if job['status'] not in ('queued', 'running'):
+                    return job['status'] == 'completed'
+                time.sleep(0.05)
+        return False
+
+    return run_threaded("upload", call, requests, concurrency, pages=pages, words_per_page=words_per_page)
+
+
+def _query(i: int, unique: bool) -> str:
+    query = QUERIES[i % len(QUERIES)]
+    return f"{query} (request {i})" if unique else query
+
+
+def main(argv: Optional[List[str]] = None) -> List[BenchmarkResult]:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', choices=['graph', 'chat', 'stream', 'batch', 'upload', 'all'], default='all')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--unique', action='store_true', help='make every query distinct, defeating caches')
+    parser.add_argument('--chat-latency', type=float, default=0.5, help='seconds per chat model call')
+    parser.add_argument('--small-chat-latency', type=float, default=0.2,
+                        help='seconds per small-tier chat model call')
+    parser.add_argument('--model-tiering', action='store_true',
+                        help='try the small model first, escalating to the large one when needed')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='seconds per streamed token')
+    parser.add_argument('--embed-latency', type=float, default=0.05, help='seconds per embeddings call')
+    parser.add_argument('--pinecone-latency', type=float, default=0.02, help='seconds per index call')
+    parser.add_argument('--google-latency', type=float, default=0.3, help='seconds per Google search')
+    parser.add_argument('--vector-backend', choices=['pinecone', 'local'], default='pinecone',
+                        help='fake Pinecone, or the real in-process index')
+    parser.add_argument('--pages', type=int, default=20, help='pages per uploaded PDF')
+    parser.add_argument('--words-per-page', type=int, default=400)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    offline.install(offline.FakeLatencies(
+        chat=args.chat_latency,
+        chat_token=args.token_latency,
+        small_chat=args.small_chat_latency,
+        embedding=args.embed_latency,
+        pinecone=args.pinecone_latency,
+        google=args.google_latency,
+    ), vector_backend=args.vector_backend)
+    if args.model_tiering:
+        from services.model_tiers import ModelTierPolicy
+        from utils.clients import clients
+        clients.override("model_tiers", ModelTierPolicy(enabled=True))
+    # The app configures INFO logging on import; keep the output to the results
+    logging.getLogger().setLevel(logging.WARNING)
+
+    tracemalloc.start()
+    scenarios = ['graph', 'chat', 'stream', 'batch', 'upload'] if args.scenario == 'all' else [args.scenario]
+    results = []
+    for scenario in scenarios:
+        if scenario == 'graph':
+            result = bench_graph(args.requests, args.concurrency, args.unique)
+        elif scenario in ('chat', 'stream'):
+            result = bench_chat(args.requests, args.concurrency, args.unique, stream=scenario == 'stream')
+        elif scenario == 'batch':
+            result = bench_batch(args.requests, args.unique)
+        else:
+            result = bench_upload(max(1, args.requests // 10), args.concurrency, args.pages, args.words_per_page)
+        print(result.summary(), flush=True)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,18 @@
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 from services.graph import GraphService
+from services.pre_router import PreRouter
+from services.response_cache import SemanticResponseCache
+from utils.clients import clients
+from utils.metrics import export_stats
+from utils.request_context import request_deadline
+from utils.config import batch_config, response_cache_config, pre_router_config, speculation_config
+from utils.speculation import Speculator
+from utils.streaming import iterate_async, to_ndjson, to_sse
 from utils.tools import (frontend_agent_tool, backend_agent_tool, designer_agent_tool, search_google, legal_expert,
-                         finance_expert)
+                         finance_expert, KB_TOOL_TYPES, speculative_retrievals)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -12,17 +21,101 @@ logger = logging.getLogger(__name__)
 chat_routes = Blueprint('chat', __name__)
 
 
-def get_graph_service() -> GraphService:
+def create_graph_service() -> GraphService:
     try:
         tools = [frontend_agent_tool, backend_agent_tool, designer_agent_tool, search_google, legal_expert,
                  finance_expert]
-        return GraphService(tools)
+        embeddings = clients.get("embeddings")
+        response_cache = SemanticResponseCache(embeddings, KB_TOOL_TYPES) if response_cache_config.enabled else None
+        pre_router = PreRouter(embeddings, tools) if pre_router_config.enabled else None
+        speculator = Speculator(speculative_retrievals, embeddings) if speculation_config.enabled else None
+        export_stats([("cache", "responses", response_cache), ("pre_router", "supervisor", pre_router),
+                      ("speculation", "retrieval", speculator)])
+        return GraphService(tools, response_cache=response_cache, pre_router=pre_router, speculator=speculator)
     except Exception as e:
         logger.error(f"Error initializing graph service: {str(e)}")
         raise
 
 
-graph_service = get_graph_service()
+# Built on first use so importing the routes stays cheap
+clients.register("graph_service", create_graph_service)
+
+
+def get_graph_service() -> GraphService:
+    return clients.get("graph_service")
+
+
+# Keeps proxies from buffering streamed responses
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def chat_request_error(data: Any) -> Optional[str]:
+    """Why a /chat or /chat/stream request body is invalid, or None if it is valid."""
+    if not data or 'message' not in data:
+        return 'Missing message in request body'
+    session_id = data.get('session_id')
+    if session_id is not None and not isinstance(session_id, str):
+        return 'session_id must be a string'
+    timeout = data.get('timeout')
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+        return 'timeout must be a positive number of seconds'
+    return None
+
+
+def chat_deadline(data: Dict[str, Any]) -> Optional[float]:
+    """When a /chat or /chat/stream request must be answered: its ``timeout``, capped by REQUEST_TIMEOUT."""
+    return request_deadline(data.get('timeout'))
+
+
+async def answer_chat(data: Dict[str, Any]) -> Any:
+    """
+    Answers a validated /chat request; shared by the Flask view and the ASGI handler.
+
+    Args:
+        data: Request body with ``message`` and an optional ``session_id`` and ``timeout``
+
+    Returns:
+        The response body
+    """
+    session_id = data.get('session_id')
+    logger.info(f"Received chat request: {data['message']}")
+    # With a session_id the conversation continues from its stored checkpoint, on any worker
+    response = await get_graph_service().process_query(data['message'], session_id=session_id,
+                                                       deadline=chat_deadline(data))
+    if session_id is not None and isinstance(response, dict):
+        response = {**response, 'session_id': session_id}
+    return response
+
+
+def batch_request_error(data: Any) -> Optional[str]:
+    """Why a /chat/batch request body is invalid, or None if it is valid."""
+    if not isinstance(data, dict) or not data.get('messages'):
+        return 'Missing messages in request body'
+    messages = data['messages']
+    if not isinstance(messages, list) or not all(isinstance(message, str) for message in messages):
+        return 'messages must be a list of strings'
+    if len(messages) > batch_config.max_items:
+        return f'A batch holds at most {batch_config.max_items} messages'
+    return None
+
+
+async def answer_batch(messages: List[str]) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Answers a validated /chat/batch request; shared by the Flask view and the ASGI handler.
+
+    Yields one result per message, in completion order, tagged with the message's ``index``.
+    """
+    logger.info(f"Received batch chat request with {len(messages)} messages")
+    async for positions, result in get_graph_service().process_batch(messages):
+        for index in positions:
+            yield {'index': index, **result}
+
+
+def stream_format(best_accepted: Optional[str]) -> Tuple[Callable[[Dict[str, Any]], str], str]:
+    """Serializer and mimetype of /chat/stream: SSE if that is the client's preferred type, else NDJSON."""
+    if best_accepted == 'text/event-stream':
+        return to_sse, 'text/event-stream'
+    return to_ndjson, 'application/x-ndjson'
 
 
 @chat_routes.route('/chat', methods=['POST'])
@@ -30,14 +123,13 @@ async def chat() -> tuple[Response, int] | Response:
     try:
         # Get request data
         data = request.get_json()
-        if not data or 'message' not in data:
+        error = chat_request_error(data)
+        if error:
             return jsonify({
-                'error': 'Missing message in request body'
+                'error': error
             }), 400
-        logger.info(f"Received chat request: {data['message']}")
-        response = await graph_service.process_query(data['message'])
 
-        return jsonify(response)
+        return jsonify(await answer_chat(data))
 
     except Exception as e:
         # Log error
@@ -47,3 +139,69 @@ async def chat() -> tuple[Response, int] | Response:
         }), 500
 
 
+@chat_routes.route('/chat/stream', methods=['POST'])
+def chat_stream() -> tuple[Response, int] | Response:
+    """
+    Streaming variant of /chat.
+
+    Emits supervisor tokens, tool start/end events and answer tokens as they arrive,
+    ending with a ``final`` event that carries ``final_answer`` and ``used_tools``.
+    Responds with NDJSON by default, or Server-Sent Events when the client accepts
+    ``text/event-stream``. Accepts the same optional ``session_id`` and ``timeout`` as /chat.
+    """
+    data = request.get_json(silent=True)
+    error = chat_request_error(data)
+    if error:
+        return jsonify({
+            'error': error
+        }), 400
+    session_id = data.get('session_id')
+    logger.info(f"Received streaming chat request: {data['message']}")
+
+    serialize, mimetype = stream_format(request.accept_mimetypes.best)
+    deadline = chat_deadline(data)
+
+    def generate():
+        events = get_graph_service().stream_query(data['message'], session_id=session_id, deadline=deadline)
+        for event in iterate_async(events):
+            yield serialize(event)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=mimetype,
+        headers=STREAM_HEADERS,
+    )
+
+
+@chat_routes.route('/chat/batch', methods=['POST'])
+def chat_batch() -> tuple[Response, int] | Response:
+    """
+    Answers many independent messages in one request.
+
+    Takes ``{"messages": [...]}`` and responds with NDJSON as answers complete, one
+    line per message: its ``index`` in the request plus ``final_answer`` and
+    ``used_tools`` (and ``partial`` if it ran out of time), or ``error`` if that
+    message failed. Identical messages are answered once, and at most
+    BATCH_CONCURRENCY distinct messages run at a time, each within REQUEST_TIMEOUT.
+
+    Meant for ASGI mode (asgi.py), where batches share the worker's event loop,
+    connection pools and query embedding batcher. Under WSGI each batch runs on
+    its own throwaway loop, so only the messages within one batch are batched
+    together and every batch opens fresh upstream connections.
+    """
+    data = request.get_json(silent=True)
+    error = batch_request_error(data)
+    if error:
+        return jsonify({
+            'error': error
+        }), 400
+
+    def generate():
+        for result in iterate_async(answer_batch(data['messages'])):
+            yield to_ndjson(result)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers=STREAM_HEADERS,
+    )
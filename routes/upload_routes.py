@@ -1,84 +1,29 @@
 from flask import Blueprint, jsonify, Response, request
 import logging
 import os
-import uuid
-from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from pinecone import Pinecone
-from utils.config import pinecone_config
+import shutil
+import tempfile
+from services.ingestion_jobs import IngestionJobManager
+from services.ingestion_service import IngestionService
+from utils.clients import clients
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 chat_routes = Blueprint('upload', __name__)
 
-# Initialize Pinecone
-pc = Pinecone(api_key=pinecone_config.api_key)
-index = pc.Index("kb")
 
+# Built on first use; uploads use the registry's index and embeddings clients
+clients.register("ingestion_jobs", lambda: IngestionJobManager(IngestionService()))
 
-def process_file_based_on_mime(file_path, kb_type, doc_name):
-    if file_path.lower().endswith('.pdf'):
-        upload_pdf(kb_type, doc_name, os.path.dirname(file_path))
-    else:
-        logger.warning(f"Unsupported file type: {file_path}")
 
-
-def upload_pdf(kb_type, doc_name, directory_path):
-    try:
-        # use the directory path for DirectoryLoader
-        loader = PyPDFDirectoryLoader(directory_path, glob="*.pdf")
-        docs = loader.load()
-        print("docs", docs)
-        upload_documents(docs, kb_type, doc_name)
-    except Exception as e:
-        logger.error(f"Error uploading PDF: {str(e)}")
-        raise
-
-
-def upload_documents(docs, kb_type, doc_name):
-    try:
-        for doc in docs:
-            filename_with_extension = os.path.basename(doc.metadata["source"])
-            docName, _ = os.path.splitext(filename_with_extension)
-            text = doc.page_content
-
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=768)
-            chunks = text_splitter.create_documents([text])
-
-            embeddings_model = OpenAIEmbeddings()
-            embeddings_arrays = embeddings_model.embed_documents(
-                [chunk.page_content.replace("\n", " ") for chunk in chunks]
-            )
-
-            batch_size = 100
-            batch = []
-
-            for idx in range(len(chunks)):
-                chunk = chunks[idx]
-                metadata = {
-                    "text": chunk.page_content,
-                    "type": kb_type,
-                    "doc_link": str(doc_name),
-                }
-                vector = {
-                    "id": str(uuid.uuid4()),
-                    "values": embeddings_arrays[idx],
-                    "metadata": metadata,
-                }
-                batch.append(vector)
-
-                if len(batch) == batch_size or idx == len(chunks) - 1:
-                    index.upsert(vectors=batch)
-                    batch = []
-    except Exception as e:
-        logger.error(f"Error processing documents: {str(e)}")
-        raise
+def get_ingestion_jobs() -> IngestionJobManager:
+    return clients.get("ingestion_jobs")
 
 
 @chat_routes.route('/upload', methods=['POST'])
-async def upload() -> tuple[Response, int] | Response:
+def upload() -> tuple[Response, int] | Response:
+    """Accepts files for ingestion and returns a job ID to poll for progress."""
     try:
         if request.method != 'POST':
             return jsonify(error='Method not allowed'), 405
@@ -91,30 +36,31 @@ async def upload() -> tuple[Response, int] | Response:
         if not uploaded_files:
             return jsonify(error='No files part in the request'), 400
 
-        files_path = []
+        # Every request gets its own directory so concurrent uploads never see each other's files
+        upload_folder = tempfile.mkdtemp(prefix='upload-')
         try:
-            # Ensure the upload directory exists
-            upload_folder = os.path.join(os.getcwd(), 'uploads')
-            os.makedirs(upload_folder, exist_ok=True)
-
-            for f in uploaded_files:
-                # Define the path for each file
-                upload_path = os.path.join(upload_folder, f.filename)
+            files = []
+            for i, f in enumerate(uploaded_files):
+                # Define the path for each file; the index keeps files sharing a name apart
+                upload_path = os.path.join(upload_folder, f"{i}-{os.path.basename(f.filename)}")
                 # Save the file
                 f.save(upload_path)
+                files.append({"path": upload_path, "name": f.filename})
 
-                files_path.append({"path": upload_path, "name": f.filename})
-                process_file_based_on_mime(upload_path, kb_type, f.filename)
-                os.remove(upload_path)
-
-            return jsonify(message='Files uploaded and processed successfully.')
+            # The job owns the directory from here on and removes it when done
+            job = get_ingestion_jobs().submit(files, kb_type, upload_folder)
 
-        except Exception as e:
+        except Exception:
             # Clean up any files that were saved before the error occurred
-            for file in files_path:
-                if os.path.exists(file["path"]):
-                    os.remove(file["path"])
-            raise e
+            shutil.rmtree(upload_folder, ignore_errors=True)
+            raise
+
+        return jsonify(
+            message='Files accepted for processing.',
+            job_id=job.id,
+            status=job.status,
+            status_url=f'{request.path}/{job.id}',
+        ), 202
 
     except Exception as e:
         # Log error
@@ -122,3 +68,12 @@ async def upload() -> tuple[Response, int] | Response:
         return jsonify({
             'error': f'Error processing request: {str(e)}'
         }), 500
+
+
+@chat_routes.route('/upload/<job_id>', methods=['GET'])
+def upload_status(job_id: str) -> tuple[Response, int] | Response:
+    """Reports the progress of an ingestion job."""
+    job = get_ingestion_jobs().get(job_id)
+    if job is None:
+        return jsonify(error='Job not found'), 404
+    return jsonify(job.to_dict())
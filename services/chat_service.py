@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from typing import Optional, Dict, Any, List
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from langchain_core.messages import HumanMessage, AIMessage
+from services.memory import ConversationMemory
 import logging
 import json
 
@@ -17,16 +18,22 @@ class ChatResponse:
     error: Optional[str] = None
 
 
+SYSTEM_PROMPT = """You are a helpful assistant with access to multiple tools
+                including Google Search and a knowledge base. You will help users by providing accurate and 
+                relevant information."""
+
+
 class ChatService:
-    def __init__(self, graph):
+    def __init__(self, graph, memory: Optional[ConversationMemory] = None):
         """
         Initialize ChatService with a LangGraph instance
 
         Args:
             graph: Compiled LangGraph instance
+            memory: Conversation memory shared by the sessions; bounded per session and overall
         """
         self.graph = graph
-        self.conversation_history: Dict[str, List] = {}
+        self.memory = memory or ConversationMemory()
 
     def process_query(self, query: str, session_id: str = "default") -> ChatResponse:
         """
@@ -42,15 +49,8 @@ class ChatService:
         try:
             logger.info(f"Processing query for session {session_id}: {query}")
 
-            # Get conversation history for this session
-            history = self.conversation_history.get(session_id, [])
-
-            # Create system message if this is a new conversation
-            if not history:
-                system_msg = SystemMessage(content="""You are a helpful assistant with access to multiple tools
-                including Google Search and a knowledge base. You will help users by providing accurate and 
-                relevant information.""")
-                history.append(system_msg)
+            # Recent turns within the session's token budget, preceded by a summary of older ones
+            history = self.memory.context(session_id, SYSTEM_PROMPT)
 
             # Add user query to history
             user_msg = HumanMessage(content=query)
@@ -69,14 +69,13 @@ class ChatService:
             ai_response = result["messages"][-1]
 
             # Update conversation history
-            history.append(ai_response)
-            self.conversation_history[session_id] = history
+            self.memory.append(session_id, user_msg, ai_response)
 
             # Create metadata
             metadata = {
                 "session_id": session_id,
-                "turn_number": len(history) // 2,  # Counting turns based on user messages
-                "total_messages": len(history)
+                "turn_number": self.memory.turns(session_id),
+                "total_messages": len(history) + 1
             }
 
             return ChatResponse(
@@ -181,9 +180,9 @@ class ChatService:
             session_id: Unique identifier for the conversation session
 
         Returns:
-            List of conversation messages
+            List of conversation messages still kept verbatim; older ones live on in the summary
         """
-        return self.conversation_history.get(session_id, [])
+        return self.memory.messages(session_id)
 
     def clear_history(self, session_id: str = "default"):
         """
@@ -192,6 +191,5 @@ class ChatService:
         Args:
             session_id: Unique identifier for the conversation session
         """
-        if session_id in self.conversation_history:
-            del self.conversation_history[session_id]
+        if self.memory.clear(session_id):
             logger.info(f"Cleared conversation history for session {session_id}")
@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def chunk_id(text: str, kb_type: str, doc_link: str) -> str:
+    """Deterministic vector ID: identical chunks of the same document always map to the same vector."""
+    return hashlib.sha256(f"{kb_type}\x00{doc_link}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class ChunkManifest:
+    """
+    Local SQLite record of the chunks already embedded and upserted into the index.
+
+    Lets ingestion skip unchanged chunks and find the stale ones to delete when a
+    document is uploaded again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id TEXT PRIMARY KEY,
+                    kb_type TEXT NOT NULL,
+                    doc_link TEXT NOT NULL,
+                    indexed_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (kb_type, doc_link)")
+
+    @contextmanager
+    def _connect(self):
+        with self._lock:
+            conn = sqlite3.connect(self.path)
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+
+    def chunk_ids(self, kb_type: str, doc_link: str) -> Set[str]:
+        """Returns the IDs of the chunks currently indexed for a document."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT chunk_id FROM chunks WHERE kb_type = ? AND doc_link = ?",
+                (kb_type, doc_link),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def add(self, chunks: Iterable[Tuple[str, str, str]]) -> None:
+        """Records upserted chunks given as (chunk_id, kb_type, doc_link) tuples."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, kb_type, doc_link, indexed_at) VALUES (?, ?, ?, ?)",
+                [(cid, kb_type, doc_link, now) for cid, kb_type, doc_link in chunks],
+            )
+
+    def all_chunk_ids(self) -> Set[str]:
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute("SELECT chunk_id FROM chunks")}
+
+    def remove(self, ids: Iterable[str]) -> None:
+        """Forgets chunks that were deleted from the index."""
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(cid,) for cid in ids])
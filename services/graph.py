@@ -1,14 +1,47 @@
-from typing import Dict, Any, List
+import asyncio
+import contextlib
+import time
+import uuid
+from typing import Dict, Any, List, AsyncIterator, Optional, Tuple
 
-from langchain_openai import ChatOpenAI
+from langgraph.errors import GraphRecursionError
 from langgraph.graph import StateGraph, START, END, MessagesState
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, trim_messages
 from langgraph.prebuilt import ToolNode
 
+from services.memory import message_tokens
+from services.model_tiers import SMALL
+from utils.clients import clients
+from utils.config import batch_config, checkpoint_config, graph_config
+from utils.metrics import MetricsCallbackHandler, request_prompt_tokens_saved
+from utils.prompt_budget import budget_tool_outputs
+from utils.request_context import (RequestContext, get_request_context, request_deadline, reset_request_context,
+                                   set_request_context, within_deadline)
+from utils.speculation import Speculation
+
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Shared by every run; records node, tool and model latency and token usage
+metrics_handler = MetricsCallbackHandler()
+
+# Answer of a request that ran out of time before any tool finished
+PARTIAL_NO_ANSWER = "Sorry, no answer could be prepared in time. Please try again."
+
+
+SUPERVISOR_PROMPT = """You are a supervisor tasked with managing a conversation between four workers:
+
+- researcher: For finding information and facts using Google search
+- backend: For backend related information and queries
+- frontend: For frontend related information and queries
+- designer: For design related information and queries
+- legal: For legal queries
+- finance: For finance related queries
+
+Important: Check the conversation history - if an agent has already provided their part,
+move to the next needed agent or FINISH if all tasks are complete."""
+
 
 class State(MessagesState):
     """State object for the graph."""
@@ -16,48 +49,98 @@ class State(MessagesState):
 
 
 class GraphService:
-    def __init__(self, Tools=None):
+    def __init__(self, Tools=None, response_cache=None, pre_router=None, speculator=None, chat_model=None,
+                 checkpointer=None, small_chat_model=None, model_tiers=None):
         self.graph = None
+        # Same graph compiled with the checkpointer, for queries that belong to a session
+        self.session_graph = None
+        self._builder = None
         self.tools = Tools
-        AGENT_MODEL = "gpt-4o"
-        self._tools_llm = ChatOpenAI(
-            model=AGENT_MODEL,
-            temperature=0,
-        ).bind_tools(Tools)
+        # Optional SemanticResponseCache consulted before running the graph
+        self.response_cache = response_cache
+        # Optional PreRouter that dispatches clear-cut queries without the supervisor LLM
+        self.pre_router = pre_router
+        # Optional Speculator that starts retrieval while the supervisor is deciding
+        self.speculator = speculator
+        # Supervisor model; defaults to the shared chat model, bound to the tools on first use
+        self.chat_model = chat_model
+        self._tools_llm = None
+        # Small supervisor model tried first when the model tier policy allows; both default to the shared ones
+        self.small_chat_model = small_chat_model
+        self._small_tools_llm = None
+        self.model_tiers = model_tiers
+        # Session store; defaults to the shared checkpointer, created on the first session query
+        self.checkpointer = checkpointer
+
+    @property
+    def tools_llm(self):
+        if self._tools_llm is None:
+            self._tools_llm = (self.chat_model or clients.get("chat_model")).bind_tools(self.tools)
+        return self._tools_llm
+
+    @property
+    def small_tools_llm(self):
+        if self._small_tools_llm is None:
+            self._small_tools_llm = (self.small_chat_model or clients.get("small_chat_model")).bind_tools(self.tools)
+        return self._small_tools_llm
+
+    @property
+    def tier_policy(self):
+        return self.model_tiers or clients.get("model_tiers")
 
     @staticmethod
     def route_next_step(state: State):
         result = state["messages"][-1]
         if len(result.tool_calls) != 0:
-            print("result.tool_calls", result.tool_calls)
+            logger.debug(f"Supervisor tool calls: {result.tool_calls}")
             return "invoke_tools"
         return END
 
+    @staticmethod
+    def route_after_pre_route(state: State):
+        last_message = state["messages"][-1]
+        if isinstance(last_message, AIMessage) and last_message.tool_calls:
+            return "invoke_tools"
+        return "call_tools_llm"
+
+    async def pre_route(self, state: State):
+        """Dispatches straight to a tool when the local router is confident, skipping the supervisor."""
+        query = state["messages"][-1].content
+        try:
+            decision = await self.pre_router.route(query)
+        except Exception as e:
+            logger.error(f"Pre-routing failed, falling back to the supervisor: {str(e)}")
+            return {}
+        if decision is None:
+            return {}
+        tool_call = {"name": decision.tool, "args": {"query": query}, "id": f"pre_route_{uuid.uuid4().hex}"}
+        return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
     async def call_tools_llm(self, state: State):
         try:
             messages = state["messages"]
 
-            system_prompt = """You are a supervisor tasked with managing a conversation between four workers:
-        
-            - researcher: For finding information and facts using Google search
-            - backend: For backend related information and queries
-            - frontend: For frontend related information and queries
-            - designer: For design related information and queries
-            - legal: For legal queries
-            - finance: For finance related queries
-        
-            
-            Important: Check the conversation history - if an agent has already provided their part,
-            move to the next needed agent or FINISH if all tasks are complete."""
+            context = get_request_context()
+            if context and context.speculation and isinstance(messages[-1], HumanMessage):
+                context.speculation.start(messages[-1].content)
 
-            messages_with_system = [SystemMessage(content=system_prompt)] + messages
+            # The constant system prompt and the bound tool schemas form a byte-identical prefix on every
+            # call, so the provider's prompt cache can serve it; only the budgeted history varies. Trimming
+            # first keeps the budgeting work, and the savings it records, to the messages actually sent
+            history = budget_tool_outputs(self.recent_history(messages))
+            messages_with_system = [SystemMessage(content=SUPERVISOR_PROMPT)] + history
 
-            message = await self._tools_llm.ainvoke(messages_with_system)
+            policy = self.tier_policy
+            message = await policy.ainvoke(
+                "supervisor", current_turn(messages)[0].content, messages_with_system,
+                self.small_tools_llm if policy.enabled else None, self.tools_llm,
+                tool_names=[tool.name for tool in self.tools],
+            )
 
             return {"messages": [message]}
 
         except Exception as e:
-            print("error in call tools llm", e)
+            logger.error(f"Error in supervisor call: {str(e)}")
             raise e
 
     def create_graph(self):
@@ -69,52 +152,354 @@ class GraphService:
             builder.add_node("call_tools_llm", self.call_tools_llm)
             builder.add_node("invoke_tools", ToolNode(self.tools))
 
-            builder.set_entry_point("call_tools_llm")
+            if self.pre_router:
+                builder.add_node("pre_route", self.pre_route)
+                builder.set_entry_point("pre_route")
+                builder.add_conditional_edges("pre_route", self.route_after_pre_route)
+            else:
+                builder.set_entry_point("call_tools_llm")
 
             builder.add_conditional_edges("call_tools_llm", self.route_next_step)
 
             # Compile the graph with tracing disabled
             self.graph = builder.compile()
+            self._builder = builder
 
         except Exception as e:
             logger.error(f"Error creating graph: {str(e)}")
             raise
 
-    async def process_query(self, query: str) -> dict[str, str | list[Any] | Any] | str:
-        """Process a query through the graph."""
+    def get_graph(self, session_id: Optional[str] = None):
+        """The compiled graph, checkpointed per session when a session id is given."""
+        if not self.graph:
+            logger.info("Creating new graph...")
+            self.create_graph()
+        if session_id is None:
+            return self.graph
+        if self.session_graph is None:
+            self.session_graph = self._builder.compile(checkpointer=self.checkpointer or clients.get("checkpointer"))
+        return self.session_graph
+
+    @staticmethod
+    def run_config(session_id: Optional[str] = None) -> Dict[str, Any]:
+        config = {"callbacks": [metrics_handler], "recursion_limit": graph_config.recursion_limit}
+        if session_id is not None:
+            config["configurable"] = {"thread_id": session_id}
+        return config
+
+    @staticmethod
+    def recent_history(messages: List, max_tokens: int = checkpoint_config.history_tokens) -> List:
+        """The latest whole turns of a session within ``max_tokens``; the current turn is always kept."""
+        trimmed = trim_messages(messages, max_tokens=max_tokens, strategy="last", start_on="human",
+                                token_counter=lambda batch: sum(message_tokens(message) for message in batch))
+        return trimmed or current_turn(messages)
+
+    def new_request_context(self, deadline: Optional[float] = None) -> RequestContext:
+        """A context for a request due by ``deadline``, or within REQUEST_TIMEOUT when not given."""
+        return RequestContext(speculation=Speculation(self.speculator) if self.speculator else None,
+                              deadline=deadline if deadline is not None else request_deadline())
+
+    async def process_query(self, query: str, session_id: Optional[str] = None,
+                            deadline: Optional[float] = None) -> dict[str, str | list[Any] | Any] | str:
+        """
+        Process a query through the graph.
+
+        Args:
+            query: The user's question
+            session_id: Conversation to continue; its history is loaded from and saved to the checkpointer
+            deadline: ``time.monotonic()`` by which to answer; defaults to REQUEST_TIMEOUT from now
+
+        Returns:
+            The final answer and the tools used for this query, with ``partial`` set if
+            time ran out and the answer was assembled from the tools that finished
+        """
         try:
-            if not self.graph:
-                logger.info("Creating new graph...")
-                self.create_graph()
+            return await self._answer(query, session_id, deadline)
+        except Exception as e:
+            logger.error(f"Error processing query: {str(e)}")
+            return f"Error processing request: {str(e)}"
 
-            # Initialize state with query
+    async def _answer(self, query: str, session_id: Optional[str] = None,
+                      deadline: Optional[float] = None) -> dict[str, str | list[Any] | Any]:
+        context = self.new_request_context(deadline)
+        context_token = set_request_context(context)
+        try:
+            started_at = time.time()
+            # Cached answers don't know the session's history
+            response_cache = self.response_cache if session_id is None else None
+            if response_cache:
+                cached = await response_cache.lookup(query)
+                if cached:
+                    return cached
+
+            graph = self.get_graph(session_id)
+
+            # Only the new message; a session's earlier messages come from its checkpoint
             state = {"messages": [HumanMessage(content=query)]}
-            logger.info(f"Initial state created with query: {query}")
+            logger.debug(f"Initial state created with query: {query}")
 
             # Process through graph
-            final_state = await self.graph.ainvoke(state)
-            logger.info(f"Graph processing complete")
+            final_state, finished = await self._run_graph(graph, state, self.run_config(session_id))
+            logger.debug(f"Graph processing complete")
+            if not finished or context.timed_out:
+                return self.partial_response(context)
 
             # Extract final answer
-            messages = final_state["messages"]
-            print("messages final state:", messages)
+            messages = current_turn(final_state["messages"])
+            logger.debug(f"Final state messages: {messages}")
+
+            response = self.summarize_messages(messages)
+            # An answer built around a tool's error would outlive the error
+            if response_cache and not context.tool_errors:
+                await response_cache.store(query, response, started_at)
+            return response
+        finally:
+            if context.speculation:
+                context.speculation.finish()
+            request_prompt_tokens_saved.observe(context.tokens_saved)
+            reset_request_context(context_token)
+
+    @staticmethod
+    async def _run_graph(graph, state: Dict[str, Any], config: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Runs the graph until it finishes, the request's deadline passes or it takes too many steps.
+
+        Returns:
+            The latest state, and whether the graph finished
+        """
+        latest = state
+
+        async def run():
+            nonlocal latest
+            async for latest in graph.astream(state, config=config, stream_mode="values"):
+                pass
 
-            messages = final_state['messages']
+        try:
+            await within_deadline(run())
+        except asyncio.TimeoutError:
+            logger.warning("Request deadline reached, answering with the tool results so far")
+            return latest, False
+        except GraphRecursionError:
+            logger.warning(f"Graph step limit of {config['recursion_limit']} reached, answering with the tool "
+                           f"results so far")
+            return latest, False
+        return latest, True
+
+    @staticmethod
+    def partial_response(context: RequestContext) -> Dict[str, Any]:
+        """The best answer assembled from the tool calls that finished in time, flagged as partial."""
+        return {
+            'final_answer': "\n\n".join(output for _, output in context.tool_outputs) or PARTIAL_NO_ANSWER,
+            'used_tools': list(dict.fromkeys(tool for tool, _ in context.tool_outputs)),
+            'partial': True,
+        }
+
+    async def process_batch(self, queries: List[str], concurrency: int = batch_config.concurrency
+                            ) -> AsyncIterator[Tuple[List[int], Dict[str, Any]]]:
+        """
+        Process many independent queries through the graph, yielding results as they complete.
+
+        Identical queries run once and share their result. The query embeddings the
+        runs need are fetched in bulk calls: the raw queries all at once up front, the
+        tools' retrieval queries grouped as they are issued.
+
+        Args:
+            queries: The user's questions; none of them belongs to a session
+            concurrency: Distinct queries processed at the same time; each gets REQUEST_TIMEOUT
+
+        Yields:
+            The positions in ``queries`` that share a result, and the result: the same
+            response as ``process_query``, or ``{'error': ...}`` if that query failed
+        """
+        positions: Dict[str, List[int]] = {}
+        for position, query in enumerate(queries):
+            positions.setdefault(query, []).append(position)
+        embeddings = clients.get("embeddings")
+        slots = asyncio.Semaphore(concurrency)
+
+        async def run(query: str) -> Tuple[str, Dict[str, Any]]:
+            async with slots:
+                try:
+                    return query, await self._answer(query)
+                except Exception as e:
+                    logger.error(f"Error processing batch query: {str(e)}")
+                    return query, {'error': f'Error processing request: {str(e)}'}
+
+        if self.response_cache or self.pre_router or self.speculator:
+            # Each of these embeds the raw query first
+            try:
+                await embeddings.aembed_queries(list(positions))
+            except Exception as e:
+                logger.error(f"Error embedding batch queries, embedding them one by one: {str(e)}")
 
-            final_answer = messages[-1].content if messages else "No response generated"
+        with embeddings.batching():
+            tasks = [asyncio.create_task(run(query)) for query in positions]
+        try:
+            for completed in asyncio.as_completed(tasks):
+                query, result = await completed
+                yield positions[query], result
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def summarize_messages(messages: List) -> dict[str, str | list[Any]]:
+        """Builds the final answer and the list of used tools from the graph messages."""
+        final_answer = messages[-1].content if messages else "No response generated"
+
+        used_tools = []
+        for msg in messages:
+            if hasattr(msg, 'tool_calls') and msg.tool_calls:
+                for tool_call in msg.tool_calls:
+                    if tool_call['name'] not in used_tools:
+                        used_tools.append(tool_call['name'])
+
+        return {
+            'final_answer': final_answer,
+            'used_tools': used_tools
+        }
 
-            used_tools = []
-            for msg in messages:
-                if hasattr(msg, 'tool_calls') and msg.tool_calls:
-                    for tool_call in msg.tool_calls:
-                        if tool_call['name'] not in used_tools:
-                            used_tools.append(tool_call['name'])
+    async def stream_query(self, query: str, session_id: Optional[str] = None,
+                           deadline: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a query through the graph, yielding events as they arrive.
+        With a ``session_id`` the query continues that conversation and ``deadline`` bounds
+        it, as in ``process_query``.
 
-            return {
-                'final_answer': final_answer,
-                'used_tools': used_tools
-            }
+        Yields dicts with an ``event`` key:
+            - supervisor_token: tool-call deltas produced by the supervisor
+            - answer_token: answer tokens from the supervisor or from an expert tool
+            - tool_start / tool_end: tool invocations and their outputs
+            - final: the same ``final_answer``/``used_tools``/``partial`` summary as ``process_query``
+            - error: processing failed, no further events follow
+        """
+        # Run the graph in its own task so the request context stays bound to it no
+        # matter how the caller drives this generator.
+        events: asyncio.Queue = asyncio.Queue()
+
+        async def produce():
+            context = self.new_request_context(deadline)
+            set_request_context(context)
+
+            async def pump():
+                async for event in self._stream_events(query, session_id):
+                    if event["event"] == "final" and context.timed_out:
+                        event = {"event": "final", **self.partial_response(context)}
+                    await events.put(event)
+
+            try:
+                await within_deadline(pump())
+            except asyncio.TimeoutError:
+                logger.warning("Request deadline reached, answering with the tool results so far")
+                await events.put({"event": "final", **self.partial_response(context)})
+            finally:
+                if context.speculation:
+                    context.speculation.finish()
+                request_prompt_tokens_saved.observe(context.tokens_saved)
+                await events.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while (event := await events.get()) is not None:
+                yield event
+        finally:
+            producer.cancel()
+            # Let its cleanup run before the caller's loop can close
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
+
+    async def _stream_events(self, query: str, session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            started_at = time.time()
+            response_cache = self.response_cache if session_id is None else None
+            if response_cache:
+                cached = await response_cache.lookup(query)
+                if cached:
+                    yield {"event": "final", **cached}
+                    return
+
+            graph = self.get_graph(session_id)
+            state = {"messages": [HumanMessage(content=query)]}
+            final_state = None
+            # Tokens of small tier calls, held until the call ends so an escalated reply is never shown
+            held: Dict[str, List[Dict[str, Any]]] = {}
+
+            async for event in graph.astream_events(state, config=self.run_config(session_id), version="v2"):
+                kind = event["event"]
+                node = event.get("metadata", {}).get("langgraph_node")
+
+                if kind == "on_chat_model_stream":
+                    chunk = event["data"]["chunk"]
+                    tokens = [
+                        {
+                            "event": "supervisor_token",
+                            "tool": tool_call_chunk.get("name"),
+                            "data": tool_call_chunk.get("args") or "",
+                        }
+                        for tool_call_chunk in getattr(chunk, "tool_call_chunks", None) or []
+                    ]
+                    if chunk.content:
+                        token = {"event": "answer_token", "data": chunk.content}
+                        if node == "invoke_tools":
+                            token["run_id"] = event["parent_ids"][-1] if event.get("parent_ids") else None
+                        tokens.append(token)
+                    if event.get("metadata", {}).get("model_tier") == SMALL:
+                        held.setdefault(event["run_id"], []).extend(tokens)
+                    else:
+                        for token in tokens:
+                            yield token
+
+                elif kind == "on_chat_model_end" and event["run_id"] in held:
+                    tokens = held.pop(event["run_id"])
+                    output = event["data"].get("output")
+                    tool_names = [tool.name for tool in self.tools] if node == "call_tools_llm" else None
+                    if output is None or self.tier_policy.uncertainty(output, tool_names) is None:
+                        for token in tokens:
+                            yield token
+
+                elif kind == "on_tool_start":
+                    yield {
+                        "event": "tool_start",
+                        "tool": event["name"],
+                        "run_id": event["run_id"],
+                        "input": event["data"].get("input"),
+                    }
+
+                elif kind == "on_tool_end":
+                    output = event["data"].get("output")
+                    yield {
+                        "event": "tool_end",
+                        "tool": event["name"],
+                        "run_id": event["run_id"],
+                        "output": getattr(output, "content", output),
+                    }
+
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    final_state = event["data"].get("output")
+
+            messages = final_state.get("messages", []) if isinstance(final_state, dict) else []
+            response = self.summarize_messages(current_turn(messages))
+            context = get_request_context()
+            # A partial answer replaces this one in stream_query and must not be cached, nor one built
+            # around a tool's error
+            if response_cache and not (context and (context.timed_out or context.tool_errors)):
+                await response_cache.store(query, response, started_at)
+            yield {"event": "final", **response}
+
+        except GraphRecursionError:
+            logger.warning(f"Graph step limit of {graph_config.recursion_limit} reached, answering with the tool "
+                           f"results so far")
+            yield {"event": "final", **self.partial_response(get_request_context() or RequestContext())}
 
         except Exception as e:
-            logger.error(f"Error processing query: {str(e)}")
-            return f"Error processing request: {str(e)}"
+            logger.error(f"Error streaming query: {str(e)}")
+            yield {"event": "error", "error": f"Error processing request: {str(e)}"}
+
+
+def current_turn(messages: List) -> List:
+    """The messages from the latest user message on."""
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return messages[i:]
+    return messages
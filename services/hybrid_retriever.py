@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set
+
+from services.chunk_manifest import chunk_id
+from services.lexical_index import QUERY_TERM, LexicalIndex
+from utils.clients import clients
+from utils.config import retrieval_config, vector_config
+from utils.metrics import track_upstream
+
+logger = logging.getLogger(__name__)
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it my of on or our the this to was we what when "
+    "where which who why will with you your".split()
+)
+
+
+@dataclass
+class Candidate:
+    """A knowledge base chunk found by vector search, keyword search or both."""
+    id: str
+    text: str
+    doc_link: str
+    fused_score: float = 0.0
+    sources: Set[str] = field(default_factory=set)
+
+
+class LexicalReranker:
+    """
+    Fast CPU reranker scoring how completely and exactly a chunk covers the query terms.
+
+    Terms with digits or punctuation (clause numbers, amounts, section references)
+    weigh more than plain words, and a chunk containing the whole query verbatim
+    gets a bonus.
+    """
+
+    def score(self, query: str, texts: Sequence[str]) -> List[float]:
+        terms = [term for term in dict.fromkeys(t.lower() for t in QUERY_TERM.findall(query))
+                 if term not in STOPWORDS]
+        if not terms:
+            return [0.0] * len(texts)
+        weights = [2.0 if re.search(r"[\d.\-/()§]", term) else 1.0 for term in terms]
+        phrase = " ".join(query.lower().split())
+        scores = []
+        for text in texts:
+            lowered = text.lower()
+            words = set(re.findall(r"\w+", lowered))
+            covered = sum(
+                weight for term, weight in zip(terms, weights)
+                if (term in words if term.isalnum() else term in lowered)
+            )
+            score = covered / sum(weights)
+            if len(terms) > 1 and phrase in " ".join(lowered.split()):
+                score += 0.5
+            scores.append(score)
+        return scores
+
+
+class CrossEncoderReranker:
+    """Reranks with a small cross-encoder on the CPU; needs the optional sentence-transformers package."""
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+        self._lock = threading.Lock()
+
+    def score(self, query: str, texts: Sequence[str]) -> List[float]:
+        with self._lock:
+            return [float(score) for score in self.model.predict([(query, text) for text in texts])]
+
+
+def create_reranker(model_name: str = retrieval_config.rerank_model):
+    """The cross-encoder named by RERANK_MODEL, or the lexical reranker when none is set or it can't load."""
+    if model_name:
+        try:
+            return CrossEncoderReranker(model_name)
+        except Exception as e:
+            logger.error(f"Error loading reranker {model_name}, using the lexical reranker: {str(e)}")
+    return LexicalReranker()
+
+
+class HybridRetriever:
+    """
+    Knowledge base retrieval fusing vector search with BM25 keyword search.
+
+    Both searches run concurrently and return a wider candidate set than is
+    finally used. Candidates are fused by reciprocal rank, the best are rescored
+    by the reranker and only the top ``k`` are passed on, so precision improves
+    without growing the expert prompt. Without a lexical index or a reranker it
+    is plain vector search.
+    """
+
+    def __init__(self, lexical: Optional[LexicalIndex] = None, reranker=None,
+                 candidates: int = retrieval_config.candidates,
+                 rerank_candidates: int = retrieval_config.rerank_candidates,
+                 rrf_k: int = retrieval_config.rrf_k):
+        """
+        Args:
+            lexical: BM25 index of the chunk texts; None for vector search only
+            reranker: Object whose ``score(query, texts)`` rescores the fused candidates
+            candidates: Results taken from each search
+            rerank_candidates: Fused candidates passed to the reranker
+            rrf_k: Reciprocal rank fusion constant; higher values flatten the rank weights
+        """
+        self.lexical = lexical
+        self.reranker = reranker
+        self.candidates = candidates
+        self.rerank_candidates = rerank_candidates
+        self.rrf_k = rrf_k
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.results = {"vector": 0, "lexical": 0, "both": 0}
+
+    async def retrieve(self, query: str, kb_type: str, k: int) -> List[Candidate]:
+        """The ``k`` best chunks of the given knowledge base type for the query."""
+        if self.lexical is None and self.reranker is None:
+            return (await self._vector_search(query, kb_type, k))[:k]
+
+        vector_hits, lexical_hits = await asyncio.gather(
+            self._vector_search(query, kb_type, self.candidates),
+            self._lexical_search(query, kb_type),
+        )
+        fused: Dict[str, Candidate] = {}
+        for source, hits in (("vector", vector_hits), ("lexical", lexical_hits)):
+            for rank, hit in enumerate(hits):
+                candidate = fused.setdefault(hit.id, hit)
+                candidate.fused_score += 1 / (self.rrf_k + rank + 1)
+                candidate.sources.add(source)
+
+        top = sorted(fused.values(), key=lambda c: c.fused_score, reverse=True)[:self.rerank_candidates]
+        if self.reranker is not None and len(top) > 1:
+            scores = await asyncio.to_thread(self.reranker.score, query, [candidate.text for candidate in top])
+            top = [candidate for _, candidate in sorted(
+                zip(scores, top), key=lambda pair: (pair[0], pair[1].fused_score), reverse=True
+            )]
+        self._count(top[:k])
+        return top[:k]
+
+    async def _vector_search(self, query: str, kb_type: str, k: int) -> List[Candidate]:
+        query_embedding = await clients.get("embeddings").aembed_query(query)
+        async with track_upstream(vector_config.backend, "query"):
+            # PineconeVectorStore (over Pinecone or the local index) only implements the scored variant
+            store = clients.get("kb_store")
+            results = await asyncio.to_thread(
+                store.similarity_search_by_vector_with_score, query_embedding, k=k, filter={"type": kb_type}
+            )
+        candidates = []
+        for doc, _ in results:
+            doc_link = str(doc.metadata.get("doc_link", ""))
+            candidates.append(Candidate(
+                id=doc.id or chunk_id(doc.page_content, kb_type, doc_link),
+                text=doc.page_content,
+                doc_link=doc_link,
+            ))
+        return candidates
+
+    async def _lexical_search(self, query: str, kb_type: str) -> List[Candidate]:
+        if self.lexical is None:
+            return []
+        try:
+            hits = await asyncio.to_thread(self.lexical.search, query, kb_type, self.candidates)
+        except Exception as e:
+            logger.error(f"Keyword search failed, using vector results only: {str(e)}")
+            return []
+        return [Candidate(id=cid, text=text, doc_link=doc_link) for cid, text, doc_link, _ in hits]
+
+    def _count(self, results: List[Candidate]) -> None:
+        with self._lock:
+            self.queries += 1
+            for candidate in results:
+                source = "both" if len(candidate.sources) > 1 else next(iter(candidate.sources), "vector")
+                self.results[source] += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"queries": self.queries, **{f"results_{source}": n for source, n in self.results.items()}}
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional
+
+from utils.config import ingestion_config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FileProgress:
+    """Progress of one uploaded file through the ingestion pipeline."""
+    name: str
+    # Name the file was saved under, unique within its job
+    saved_as: str = ""
+    status: str = "queued"
+    pages_parsed: int = 0
+    chunks_total: int = 0
+    chunks_skipped: int = 0
+    chunks_embedded: int = 0
+    vectors_upserted: int = 0
+    vectors_deleted: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def fail(self, error: str) -> None:
+        self.status = "failed"
+        self.errors.append(error)
+
+
+@dataclass
+class IngestionJob:
+    """An upload request being ingested in the background."""
+    id: str
+    kb_type: str
+    files: List[FileProgress]
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    def file(self, path: str) -> FileProgress:
+        """The progress of the file saved at ``path``."""
+        return next(progress for progress in self.files if progress.saved_as == os.path.basename(path))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class IngestionJobManager:
+    """
+    Runs uploads on a background worker pool and keeps their progress for polling.
+
+    Each job runs on its own event loop in a worker thread, so ingestion never holds
+    up the request threads serving chat. Jobs live in process memory: status must be
+    polled from the worker that accepted the upload.
+    """
+
+    def __init__(self, ingestion_service, max_workers: int = ingestion_config.job_workers,
+                 history: int = ingestion_config.job_history):
+        self.ingestion_service = ingestion_service
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, files: List[Dict[str, str]], kb_type: str, workdir: str) -> IngestionJob:
+        """
+        Queues saved files for ingestion.
+
+        Args:
+            files: Dicts with the saved file ``path``, unique within the job, and the document ``name``
+            kb_type: Knowledge base type stored with every chunk
+            workdir: Directory holding the saved files, removed once the job finishes
+        """
+        job = IngestionJob(
+            id=uuid.uuid4().hex,
+            kb_type=kb_type,
+            files=[FileProgress(name=file["name"], saved_as=os.path.basename(file["path"])) for file in files],
+        )
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job, files, workdir)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        """Drops the oldest finished jobs beyond the history limit."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(self._jobs) - self.history)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: IngestionJob, files: List[Dict[str, str]], workdir: str) -> None:
+        job.status = "running"
+        try:
+            asyncio.run(self.ingestion_service.process_files(files, job.kb_type, job=job))
+            failed = [progress for progress in job.files if progress.errors]
+            job.status = "completed_with_errors" if failed else "completed"
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} failed: {str(e)}")
+            job.status = "failed"
+            for progress in job.files:
+                if progress.status != "done":
+                    progress.fail(str(e))
+        finally:
+            job.finished_at = time.time()
+            shutil.rmtree(workdir, ignore_errors=True)
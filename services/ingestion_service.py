@@ -0,0 +1,338 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+
+from services.chunk_manifest import ChunkManifest, chunk_id
+from services.ingestion_jobs import FileProgress
+from utils.clients import clients
+from utils.config import ingestion_config, retrieval_config, vector_config
+from utils.kb_versions import invalidate_kb_type
+from utils.metrics import embedding_tokens, ingestion_items, ingestion_stage_seconds, record_cost, track_upstream
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Chunk:
+    """A piece of a document waiting to be embedded and upserted."""
+    id: str
+    text: str
+    tokens: int
+    metadata: Dict[str, Any]
+    progress: Optional[FileProgress] = None
+
+
+def count_pdf_pages(file_path: str) -> int:
+    return len(PdfReader(file_path).pages)
+
+
+def split_pdf_pages(file_path: str, start: int, stop: int, chunk_size: int) -> List[str]:
+    """
+    Extracts pages [start, stop) of a PDF and splits them into chunk texts.
+
+    Kept at module level so it can run in a worker process. Only the requested
+    pages are extracted, so memory is bounded by the window size, not the document.
+    """
+    reader = PdfReader(file_path)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size)
+    pieces = []
+    for page_number in range(start, stop):
+        pieces.extend(text_splitter.split_text(reader.pages[page_number].extract_text().strip()))
+    return pieces
+
+
+class EmbeddingPipeline:
+    """
+    Streams chunks through embedding and upserting with bounded memory.
+
+    Chunks are packed into token-bounded embedding batches as they are added. Each
+    full batch is embedded in the background and its vectors upserted as soon as they
+    arrive. ``add`` waits whenever more than ``max_inflight_chunks`` chunks are queued
+    or being processed, which applies backpressure to the parser.
+    """
+
+    def __init__(self, service: "IngestionService"):
+        self.service = service
+        self.config = service.config
+        self.max_batch_size = min(self.config.embed_batch_size, self.config.max_inflight_chunks)
+        self.embed_slots = asyncio.Semaphore(self.config.embed_concurrency)
+        self.upsert_slots = asyncio.Semaphore(self.config.upsert_concurrency)
+        self.batch: List[Chunk] = []
+        self.batch_tokens = 0
+        self.tasks: Set[asyncio.Task] = set()
+        self.inflight = 0
+        self.upserted = 0
+        self.errors: List[Exception] = []
+
+    async def add(self, chunk: Chunk) -> None:
+        if self.batch and (self.batch_tokens + chunk.tokens > self.config.embed_batch_tokens
+                           or len(self.batch) >= self.max_batch_size):
+            await self._flush()
+        self.batch.append(chunk)
+        self.batch_tokens += chunk.tokens
+
+    async def close(self) -> int:
+        """Waits for every queued chunk. Returns the number of vectors upserted."""
+        if self.batch:
+            await self._flush()
+        if self.tasks:
+            await asyncio.wait(self.tasks)
+        if self.errors:
+            raise self.errors[0]
+        return self.upserted
+
+    async def _flush(self) -> None:
+        batch = self.batch
+        self.batch, self.batch_tokens = [], 0
+        while self.tasks and self.inflight + len(batch) > self.config.max_inflight_chunks:
+            await asyncio.wait(self.tasks, return_when=asyncio.FIRST_COMPLETED)
+        self.inflight += len(batch)
+        task = asyncio.create_task(self._embed_batch(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _upsert(self, batch: List[Chunk], vectors) -> None:
+        async with self.upsert_slots:
+            with ingestion_stage_seconds.time(stage="upsert"):
+                async with track_upstream(vector_config.backend, "upsert"):
+                    await asyncio.to_thread(self.service.index.upsert, vectors=vectors)
+        ingestion_items.inc(len(vectors), kind="vectors_upserted")
+        # Only record chunks once they are in the index, so a failed upload is retried in full
+        self.service.manifest.add(
+            (vector["id"], vector["metadata"]["type"], vector["metadata"]["doc_link"])
+            for vector in vectors
+        )
+        if self.service.lexical:
+            self.service.lexical.add(
+                (chunk.id, chunk.metadata["type"], chunk.metadata["doc_link"], chunk.text) for chunk in batch
+            )
+        self.upserted += len(vectors)
+        for chunk in batch:
+            if chunk.progress:
+                chunk.progress.vectors_upserted += 1
+
+    async def _embed_batch(self, batch: List[Chunk]) -> None:
+        try:
+            async with self.embed_slots:
+                with ingestion_stage_seconds.time(stage="embed"):
+                    async with track_upstream("openai", "embed_documents"):
+                        embeddings_arrays = await self.service.embeddings.aembed_documents(
+                            [chunk.text.replace("\n", " ") for chunk in batch]
+                        )
+            tokens = sum(chunk.tokens for chunk in batch)
+            model = getattr(self.service.embeddings, "model", "")
+            embedding_tokens.inc(tokens, model=model)
+            record_cost(model, tokens)
+            ingestion_items.inc(len(batch), kind="chunks_embedded")
+            for chunk in batch:
+                if chunk.progress:
+                    chunk.progress.chunks_embedded += 1
+
+            vectors = [
+                {
+                    "id": chunk.id,
+                    "values": values,
+                    "metadata": chunk.metadata,
+                }
+                for chunk, values in zip(batch, embeddings_arrays)
+            ]
+            del embeddings_arrays
+            size = self.config.upsert_batch_size
+            await asyncio.gather(*(
+                self._upsert(batch[i:i + size], vectors[i:i + size]) for i in range(0, len(vectors), size)
+            ))
+
+        except Exception as e:
+            logger.error(f"Error processing documents: {str(e)}")
+            # Chunks without progress tracking belong to a direct caller, which gets the error from close()
+            if any(chunk.progress is None for chunk in batch):
+                self.errors.append(e)
+            for progress in {id(chunk.progress): chunk.progress for chunk in batch if chunk.progress}.values():
+                if progress.status != "failed":
+                    progress.fail(f"Error embedding or upserting chunks: {str(e)}")
+
+        finally:
+            self.inflight -= len(batch)
+
+
+class IngestionService:
+    def __init__(self, index=None, embeddings=None, manifest=None, lexical=None, config=ingestion_config):
+        """
+        Initialize the ingestion pipeline.
+
+        Args:
+            index: Vector index the chunks are upserted into; defaults to the shared knowledge base index
+            embeddings: Embeddings client shared by every embedding request; defaults to the shared client
+            manifest: Record of the chunks already in the index
+            lexical: Keyword index kept in step with the vector index; defaults to the shared one when
+                hybrid retrieval is enabled
+            config: Batching, concurrency and memory settings
+        """
+        self.index = index or clients.get("kb_index")
+        self.embeddings = embeddings or clients.get("openai_embeddings")
+        self.manifest = manifest or ChunkManifest(config.manifest_path)
+        self.lexical = lexical or (clients.get("lexical_index") if retrieval_config.hybrid_enabled else None)
+        self.config = config
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=config.chunk_size)
+        # PDF parsing is CPU bound; a process pool keeps it from competing with request threads for the GIL
+        self._parse_pool = ProcessPoolExecutor(config.parse_processes) if config.parse_processes > 0 else None
+
+    async def process_files(self, files: List[Dict[str, str]], kb_type: str, job=None) -> int:
+        """
+        Ingests uploaded files as one pipeline so chunks from every file share embedding batches.
+
+        Files are parsed a page window at a time and their chunks streamed into the
+        embedding pipeline, so memory stays bounded whatever the size of the documents.
+
+        Args:
+            files: Dicts with the saved file ``path`` and the document ``name``
+            kb_type: Knowledge base type stored with every chunk
+            job: Optional IngestionJob whose per-file progress is updated along the way
+
+        Returns:
+            Number of vectors upserted
+        """
+        pipeline = EmbeddingPipeline(self)
+        pending_deletes = []
+        for file in files:
+            progress = job.file(file["path"]) if job else None
+            if not file["path"].lower().endswith('.pdf'):
+                logger.warning(f"Unsupported file type: {file['path']}")
+                if progress:
+                    progress.fail("Unsupported file type")
+                continue
+
+            try:
+                if progress:
+                    progress.status = "processing"
+                stale_ids = await self.stream_document(
+                    self.iter_pdf_pieces(file["path"], file["name"], progress),
+                    kb_type, file["name"], pipeline, progress,
+                )
+            except Exception as e:
+                logger.error(f"Error uploading PDF: {str(e)}")
+                if progress is None:
+                    raise
+                progress.fail(f"Error parsing file: {str(e)}")
+                continue
+            pending_deletes.append((progress, stale_ids))
+
+        try:
+            upserted = await pipeline.close()
+
+            for progress, stale_ids in pending_deletes:
+                # A partially embedded file keeps its old chunks until it is uploaded again
+                if progress and progress.errors:
+                    continue
+                await self.delete_chunks(stale_ids)
+                if progress:
+                    progress.vectors_deleted = len(stale_ids)
+                    progress.status = "done"
+            return upserted
+        finally:
+            # Cached answers may quote chunks that were just replaced
+            invalidate_kb_type(kb_type)
+
+    async def iter_pdf_pieces(self, file_path: str, doc_name: str,
+                              progress: Optional[FileProgress] = None) -> AsyncIterator[List[str]]:
+        """Parses a single uploaded PDF a window of pages at a time, yielding each window's chunk texts."""
+        pages = await self._run_parser(count_pdf_pages, file_path)
+        logger.info(f"Parsing {pages} pages from {doc_name}")
+        window = self.config.page_window
+        for start in range(0, pages, window):
+            stop = min(start + window, pages)
+            with ingestion_stage_seconds.time(stage="parse"):
+                pieces = await self._run_parser(split_pdf_pages, file_path, start, stop, self.config.chunk_size)
+            ingestion_items.inc(stop - start, kind="pages_parsed")
+            if progress:
+                progress.pages_parsed = stop
+            yield pieces
+
+    async def _run_parser(self, func, *args):
+        if self._parse_pool:
+            return await asyncio.get_running_loop().run_in_executor(self._parse_pool, func, *args)
+        return await asyncio.to_thread(func, *args)
+
+    async def stream_document(self, pieces: AsyncIterator[Iterable[str]], kb_type: str, doc_name: str,
+                              pipeline: EmbeddingPipeline, progress: Optional[FileProgress] = None) -> List[str]:
+        """
+        Feeds a document's new chunks into the pipeline, comparing them with what is already indexed.
+
+        Only chunk IDs are kept for the whole document. Returns the IDs of indexed chunks
+        the document no longer contains.
+        """
+        indexed = self.manifest.chunk_ids(kb_type, str(doc_name))
+        current = set()
+        new_chunks = 0
+        async for window in pieces:
+            for chunk in self.build_chunks(window, kb_type, doc_name, progress):
+                if chunk.id in current:
+                    continue
+                current.add(chunk.id)
+                if progress:
+                    progress.chunks_total += 1
+                if chunk.id in indexed:
+                    if progress:
+                        progress.chunks_skipped += 1
+                    ingestion_items.inc(kind="chunks_skipped")
+                    continue
+                new_chunks += 1
+                await pipeline.add(chunk)
+
+        stale_ids = sorted(indexed - current)
+        logger.info(
+            f"{doc_name}: {new_chunks} new chunks, {len(current) - new_chunks} unchanged, "
+            f"{len(stale_ids)} stale"
+        )
+        return stale_ids
+
+    @staticmethod
+    def build_chunks(pieces: Iterable[str], kb_type: str, doc_name: str,
+                     progress: Optional[FileProgress] = None) -> Iterable[Chunk]:
+        for piece in pieces:
+            yield Chunk(
+                id=chunk_id(piece, kb_type, str(doc_name)),
+                text=piece,
+                tokens=count_tokens(piece),
+                metadata={
+                    "text": piece,
+                    "type": kb_type,
+                    "doc_link": str(doc_name),
+                },
+                progress=progress,
+            )
+
+    async def delete_chunks(self, ids: List[str]) -> None:
+        """Deletes chunks from the index and the manifest."""
+        size = self.config.delete_batch_size
+        for i in range(0, len(ids), size):
+            batch = ids[i:i + size]
+            with ingestion_stage_seconds.time(stage="delete"):
+                async with track_upstream(vector_config.backend, "delete"):
+                    await asyncio.to_thread(self.index.delete, ids=batch)
+            ingestion_items.inc(len(batch), kind="vectors_deleted")
+            self.manifest.remove(batch)
+            if self.lexical:
+                self.lexical.remove(batch)
+
+    async def upload_documents(self, docs, kb_type: str, doc_name: str) -> int:
+        """Splits already loaded documents and brings their chunks in the index up to date."""
+
+        async def pieces():
+            for doc in docs:
+                yield self.text_splitter.split_text(doc.page_content)
+
+        pipeline = EmbeddingPipeline(self)
+        try:
+            stale_ids = await self.stream_document(pieces(), kb_type, doc_name, pipeline)
+            upserted = await pipeline.close()
+            await self.delete_chunks(stale_ids)
+            return upserted
+        finally:
+            invalidate_kb_type(kb_type)
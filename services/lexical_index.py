@@ -0,0 +1,138 @@
+import logging
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Words, numbers and clause references such as 12.3(b) or §4-2
+QUERY_TERM = re.compile(r"[\w§]+(?:[.\-/()][\w]+\)?)*")
+
+
+def fts_query(query: str) -> str:
+    """
+    Turns free text into an FTS5 query matching any of its terms.
+
+    Each term is quoted, so punctuation inside clause numbers is matched as a phrase of
+    adjacent tokens instead of being parsed as FTS5 syntax.
+    """
+    terms = dict.fromkeys(term.lower() for term in QUERY_TERM.findall(query))
+    return " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+class LexicalIndex:
+    """
+    Local BM25 index of knowledge base chunk texts, backed by SQLite FTS5.
+
+    Complements vector search for exact matches such as clause numbers and defined
+    terms. Chunks are keyed by the same ID as their vector, so results of both
+    searches can be fused. The file is shared by the workers of one host.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(
+                    chunk_id UNINDEXED,
+                    kb_type UNINDEXED,
+                    doc_link UNINDEXED,
+                    text,
+                    tokenize = 'unicode61'
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        with self._lock:
+            conn = sqlite3.connect(self.path)
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+
+    def add(self, chunks: Iterable[Tuple[str, str, str, str]]) -> None:
+        """Indexes chunks given as (chunk_id, kb_type, doc_link, text) tuples, replacing existing ones."""
+        chunks = list(chunks)
+        if not chunks:
+            return
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk[0],) for chunk in chunks])
+            conn.executemany(
+                "INSERT INTO chunks (chunk_id, kb_type, doc_link, text) VALUES (?, ?, ?, ?)", chunks
+            )
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(cid,) for cid in ids])
+
+    def missing(self, ids: Iterable[str]) -> List[str]:
+        """The given chunk IDs that are not indexed yet."""
+        ids = list(ids)
+        with self._connect() as conn:
+            indexed = {row[0] for row in conn.execute("SELECT chunk_id FROM chunks")}
+        return [cid for cid in ids if cid not in indexed]
+
+    def search(self, query: str, kb_type: str, k: int) -> List[Tuple[str, str, str, float]]:
+        """
+        Ranks the chunks of a knowledge base type by BM25.
+
+        Args:
+            query: Free text query
+            kb_type: Knowledge base type to search
+            k: Maximum number of results
+
+        Returns:
+            (chunk_id, text, doc_link, score) tuples, best first; higher scores are better
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT chunk_id, text, doc_link, bm25(chunks) AS rank FROM chunks "
+                "WHERE chunks MATCH ? AND kb_type = ? ORDER BY rank LIMIT ?",
+                (match, kb_type, k),
+            ).fetchall()
+        # FTS5 ranks better matches with more negative scores
+        return [(cid, text, doc_link, -rank) for cid, text, doc_link, rank in rows]
+
+    def backfill(self, index, ids: Iterable[str], batch_size: int = 100) -> int:
+        """
+        Indexes chunks that are in the vector index but not here, reading their text from its metadata.
+
+        Args:
+            index: Vector index supporting ``fetch(ids=...)``
+            ids: Chunk IDs known to be in the vector index
+            batch_size: IDs fetched per call
+
+        Returns:
+            Number of chunks added
+        """
+        missing = self.missing(ids)
+        added = 0
+        for i in range(0, len(missing), batch_size):
+            response = index.fetch(ids=missing[i:i + batch_size])
+            vectors = response.vectors if hasattr(response, "vectors") else response["vectors"]
+            chunks = []
+            for cid, vector in vectors.items():
+                metadata = _metadata(vector)
+                if metadata and "text" in metadata:
+                    chunks.append((cid, metadata.get("type", ""), metadata.get("doc_link", ""), metadata["text"]))
+            self.add(chunks)
+            added += len(chunks)
+        if added:
+            logger.info(f"Backfilled {added} chunks into the lexical index")
+        return added
+
+
+def _metadata(vector) -> Optional[dict]:
+    if isinstance(vector, dict):
+        return vector.get("metadata")
+    return getattr(vector, "metadata", None)
@@ -0,0 +1,401 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+import numpy as np
+
+from utils.config import vector_config
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which a process that stopped refreshing no longer holds back tombstone compaction
+READER_TIMEOUT = 300.0
+
+
+class _Partition:
+    """Flat index of the vectors of one knowledge base type, as contiguous rows of a matrix."""
+
+    def __init__(self, dimension: int):
+        self.matrix = np.empty((16, dimension), dtype=np.float32)
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.rows: Dict[str, int] = {}
+
+    def put(self, vector_id: str, vector: np.ndarray, metadata: Dict[str, Any]) -> None:
+        row = self.rows.get(vector_id)
+        if row is None:
+            row = len(self.ids)
+            if row == len(self.matrix):
+                grown = np.empty((2 * len(self.matrix), self.matrix.shape[1]), dtype=np.float32)
+                grown[:row] = self.matrix[:row]
+                self.matrix = grown
+            self.ids.append(vector_id)
+            self.metadata.append(metadata)
+            self.rows[vector_id] = row
+        else:
+            self.metadata[row] = metadata
+        self.matrix[row] = vector
+
+    def remove(self, vector_id: str) -> None:
+        row = self.rows.pop(vector_id, None)
+        if row is None:
+            return
+        # Move the last row into the hole to keep the matrix contiguous
+        last = len(self.ids) - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.ids[row] = self.ids[last]
+            self.metadata[row] = self.metadata[last]
+            self.rows[self.ids[row]] = row
+        self.ids.pop()
+        self.metadata.pop()
+
+    def search(self, query: np.ndarray, k: int, mask: Optional[np.ndarray] = None):
+        """Returns (scores, rows) of the ``k`` nearest rows, best first."""
+        scores = self.matrix[:len(self.ids)] @ query
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+            top = top[np.argsort(-scores[top])]
+        else:
+            top = np.argsort(-scores)
+        if mask is not None:
+            top = top[np.isfinite(scores[top])]
+        return scores[top], top
+
+
+class LocalVectorIndex:
+    """
+    In-process cosine-similarity index with the subset of the Pinecone Index API the app uses.
+
+    Vectors are kept in RAM as one flat numpy matrix per ``type``, so a query filtered
+    on the knowledge base type scans only that type's rows with a single matrix-vector
+    product. Writes are persisted to a local SQLite file and stamped with a sequence
+    number; every process sharing the file picks up the others' writes incrementally,
+    at most ``refresh_interval`` seconds late. Each process records how far it has
+    read, and deletion tombstones every process has applied are compacted away; a
+    process idle for longer than READER_TIMEOUT reloads the whole index instead.
+    """
+
+    def __init__(self, path: str = vector_config.path, refresh_interval: float = vector_config.refresh_interval):
+        """
+        Args:
+            path: SQLite file the vectors are persisted to
+            refresh_interval: Seconds between checks for writes made by other processes
+        """
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.dimension: Optional[int] = None
+        self._partitions: Dict[str, _Partition] = {}
+        # Partition of each vector ID
+        self._types: Dict[str, str] = {}
+        self._seq = 0
+        self._refreshed_at = 0.0
+        self._reader = uuid.uuid4().hex
+        self._lock = threading.RLock()
+        self._db_lock = threading.Lock()
+        self.queries = 0
+        with self._connect() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS vectors (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    seq INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_vectors_seq ON vectors (seq);
+                CREATE TABLE IF NOT EXISTS deleted (id TEXT PRIMARY KEY, seq INTEGER NOT NULL);
+                CREATE INDEX IF NOT EXISTS idx_deleted_seq ON deleted (seq);
+                CREATE TABLE IF NOT EXISTS sequence (id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL);
+                INSERT OR IGNORE INTO sequence (id, value) VALUES (0, 0);
+                CREATE TABLE IF NOT EXISTS readers (reader TEXT PRIMARY KEY, seq INTEGER NOT NULL,
+                                                    seen_at REAL NOT NULL);
+                """
+            )
+            conn.execute("INSERT INTO readers (reader, seq, seen_at) VALUES (?, 0, ?)", (self._reader, time.time()))
+        self.refresh(force=True)
+
+    @contextmanager
+    def _connect(self):
+        with self._db_lock:
+            conn = sqlite3.connect(self.path, timeout=30)
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+
+    def upsert(self, vectors: Iterable[Any], namespace: Optional[str] = None, **kwargs) -> Dict[str, int]:
+        rows = []
+        for vector in vectors:
+            if isinstance(vector, dict):
+                vector_id, values, metadata = vector["id"], vector["values"], vector.get("metadata") or {}
+            else:
+                vector_id, values, metadata = vector[0], vector[1], (vector[2] if len(vector) > 2 else {})
+            embedding = np.asarray(values, dtype=np.float32)
+            rows.append((vector_id, str(metadata.get("type", "")), json.dumps(metadata), embedding.tobytes()))
+        if not rows:
+            return {"upserted_count": 0}
+        with self._connect() as conn:
+            seq = self._next_seq(conn)
+            conn.executemany("DELETE FROM deleted WHERE id = ?", [(row[0],) for row in rows])
+            conn.executemany(
+                "INSERT OR REPLACE INTO vectors (id, type, metadata, embedding, seq) VALUES (?, ?, ?, ?, ?)",
+                [(*row, seq) for row in rows],
+            )
+        self.refresh(force=True)
+        return {"upserted_count": len(rows)}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: Optional[str] = None,
+               **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            ids = list(self._types) if delete_all else list(ids or [])
+        if not ids:
+            return {}
+        with self._connect() as conn:
+            seq = self._next_seq(conn)
+            conn.executemany("DELETE FROM vectors WHERE id = ?", [(vector_id,) for vector_id in ids])
+            conn.executemany(
+                "INSERT OR REPLACE INTO deleted (id, seq) VALUES (?, ?)", [(vector_id, seq) for vector_id in ids]
+            )
+        self.refresh(force=True)
+        return {}
+
+    def query(self, vector: Optional[List[float]] = None, top_k: int = 10, include_metadata: bool = False,
+              include_values: bool = False, filter: Optional[Dict[str, Any]] = None,
+              namespace: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Cosine similarity search; ``filter`` takes ``{"field": value}`` or ``$eq``/``$in`` conditions."""
+        self.refresh()
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        filter = dict(filter or {})
+        type_condition = filter.pop("type", None)
+
+        matches = []
+        with self._lock:
+            self.queries += 1
+            for kb_type in self._filter_types(type_condition):
+                partition = self._partitions[kb_type]
+                mask = None
+                if filter:
+                    mask = np.fromiter((_matches(metadata, filter) for metadata in partition.metadata),
+                                       dtype=bool, count=len(partition.ids))
+                scores, rows = partition.search(query, top_k, mask)
+                for score, row in zip(scores, rows):
+                    match = {"id": partition.ids[row], "score": float(score)}
+                    if include_metadata:
+                        # Callers such as PineconeVectorStore pop fields from the metadata they get
+                        match["metadata"] = dict(partition.metadata[row])
+                    if include_values:
+                        match["values"] = partition.matrix[row].tolist()
+                    matches.append(match)
+        matches.sort(key=lambda match: match["score"], reverse=True)
+        return {"matches": matches[:top_k], "namespace": namespace or ""}
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Stored vectors by ID; values are returned normalized to unit length."""
+        self.refresh()
+        vectors = {}
+        with self._lock:
+            for vector_id in ids:
+                kb_type = self._types.get(vector_id)
+                if kb_type is None:
+                    continue
+                partition = self._partitions[kb_type]
+                row = partition.rows[vector_id]
+                vectors[vector_id] = {"id": vector_id, "values": partition.matrix[row].tolist(),
+                                      "metadata": dict(partition.metadata[row])}
+        return {"vectors": vectors, "namespace": namespace or ""}
+
+    def list(self, prefix: Optional[str] = None, limit: int = 100, **kwargs) -> Iterator[List[str]]:
+        """Pages of vector IDs, like the serverless Pinecone ``list``."""
+        self.refresh()
+        with self._lock:
+            ids = sorted(vector_id for vector_id in self._types if not prefix or vector_id.startswith(prefix))
+        for i in range(0, len(ids), limit):
+            yield ids[i:i + limit]
+
+    def describe_index_stats(self, **kwargs) -> Dict[str, Any]:
+        self.refresh()
+        with self._lock:
+            return {"dimension": self.dimension or 0, "total_vector_count": len(self._types)}
+
+    def refresh(self, force: bool = False) -> None:
+        """Applies writes recorded since the last refresh, including other processes' writes."""
+        now = time.monotonic()
+        if not force and now - self._refreshed_at < self.refresh_interval:
+            return
+        with self._lock:
+            self._refreshed_at = now
+            with self._connect() as conn:
+                registered = conn.execute("UPDATE readers SET seen_at = ? WHERE reader = ?",
+                                          (time.time(), self._reader)).rowcount
+                if not registered:
+                    # Dropped as idle, so tombstones it needed may be gone: start over from the vectors table
+                    logger.warning("Local vector index was idle too long; reloading it")
+                    self._clear()
+                    conn.execute("INSERT INTO readers (reader, seq, seen_at) VALUES (?, 0, ?)",
+                                 (self._reader, time.time()))
+                upserts = conn.execute(
+                    "SELECT id, type, metadata, embedding, seq FROM vectors WHERE seq > ? ORDER BY seq", (self._seq,)
+                ).fetchall()
+                deletes = conn.execute("SELECT id, seq FROM deleted WHERE seq > ?", (self._seq,)).fetchall()
+            for vector_id, kb_type, metadata, embedding, seq in upserts:
+                vector = np.frombuffer(embedding, dtype=np.float32)
+                self._put(vector_id, kb_type, vector / (np.linalg.norm(vector) or 1.0), json.loads(metadata))
+                self._seq = max(self._seq, seq)
+            for vector_id, seq in deletes:
+                self._remove(vector_id)
+                self._seq = max(self._seq, seq)
+            self._compact()
+
+    def _compact(self) -> None:
+        """Records how far this process has read and drops the tombstones every live process has applied."""
+        with self._connect() as conn:
+            conn.execute("UPDATE readers SET seq = ? WHERE reader = ?", (self._seq, self._reader))
+            conn.execute("DELETE FROM readers WHERE seen_at < ?", (time.time() - READER_TIMEOUT,))
+            conn.execute("DELETE FROM deleted WHERE seq <= (SELECT MIN(seq) FROM readers)")
+
+    def _clear(self) -> None:
+        self._partitions.clear()
+        self._types.clear()
+        self._seq = 0
+
+    def _put(self, vector_id: str, kb_type: str, vector: np.ndarray, metadata: Dict[str, Any]) -> None:
+        if self.dimension is None:
+            self.dimension = len(vector)
+        elif len(vector) != self.dimension:
+            logger.error(f"Skipping vector {vector_id}: dimension {len(vector)}, index has {self.dimension}")
+            return
+        previous = self._types.get(vector_id)
+        if previous is not None and previous != kb_type:
+            self._remove(vector_id)
+        if kb_type not in self._partitions:
+            self._partitions[kb_type] = _Partition(self.dimension)
+        self._partitions[kb_type].put(vector_id, vector, metadata)
+        self._types[vector_id] = kb_type
+
+    def _remove(self, vector_id: str) -> None:
+        kb_type = self._types.pop(vector_id, None)
+        if kb_type is not None:
+            self._partitions[kb_type].remove(vector_id)
+
+    def _filter_types(self, condition) -> List[str]:
+        if condition is None:
+            return list(self._partitions)
+        if isinstance(condition, dict):
+            if "$in" in condition:
+                wanted = condition["$in"]
+            elif "$eq" in condition:
+                wanted = [condition["$eq"]]
+            else:
+                raise ValueError(f"Unsupported filter on type: {condition}")
+        else:
+            wanted = [condition]
+        return [str(kb_type) for kb_type in wanted if str(kb_type) in self._partitions]
+
+    @staticmethod
+    def _next_seq(conn: sqlite3.Connection) -> int:
+        conn.execute("UPDATE sequence SET value = value + 1 WHERE id = 0")
+        return conn.execute("SELECT value FROM sequence WHERE id = 0").fetchone()[0]
+
+    def ids(self) -> Set[str]:
+        self.refresh()
+        with self._lock:
+            return set(self._types)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"vectors": len(self._types), "types": len(self._partitions), "queries": self.queries}
+
+
+def _matches(metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    for field, condition in filter.items():
+        value = metadata.get(field)
+        if isinstance(condition, dict):
+            if "$eq" in condition and value != condition["$eq"]:
+                return False
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _field(vector, name: str):
+    if isinstance(vector, dict):
+        return vector.get(name)
+    return getattr(vector, name, None)
+
+
+def sync_from(local: LocalVectorIndex, remote, ids: Optional[Iterable[str]] = None, prune: bool = False,
+              batch_size: int = 100) -> Dict[str, int]:
+    """
+    Copies the vectors the local index is missing from a remote (Pinecone) index.
+
+    Args:
+        local: Index to bring up to date
+        remote: Index supporting ``fetch``, and ``list`` when ``ids`` is not given
+        ids: IDs in the remote index; listed from it when not given
+        prune: Also delete local vectors that are not in the remote index
+        batch_size: IDs fetched per call
+
+    Returns:
+        Counts of the vectors added and deleted
+    """
+    remote_ids = set(ids) if ids is not None else {vector_id for page in remote.list() for vector_id in page}
+    local_ids = local.ids()
+    missing = sorted(remote_ids - local_ids)
+    added = 0
+    for i in range(0, len(missing), batch_size):
+        response = remote.fetch(ids=missing[i:i + batch_size])
+        vectors = response.vectors if hasattr(response, "vectors") else response["vectors"]
+        batch = [
+            {"id": vector_id, "values": list(_field(vector, "values")), "metadata": dict(_field(vector, "metadata") or {})}
+            for vector_id, vector in vectors.items()
+        ]
+        local.upsert(vectors=batch)
+        added += len(batch)
+    stale = sorted(local_ids - remote_ids) if prune else []
+    if stale:
+        local.delete(ids=stale)
+    if added or stale:
+        logger.info(f"Synced local vector index: {added} added, {len(stale)} deleted")
+    return {"added": added, "deleted": len(stale)}
+
+
+def start_background_sync(local: LocalVectorIndex, remote: Callable[[], Any],
+                          ids: Optional[Callable[[], Iterable[str]]] = None,
+                          interval: float = vector_config.sync_interval,
+                          prune: bool = vector_config.sync_prune) -> threading.Thread:
+    """
+    Syncs the local index from the remote one in a daemon thread, once or every ``interval`` seconds.
+
+    Args:
+        local: Index to keep up to date
+        remote: Returns the remote index; called in the thread so it is created off the request path
+        ids: Returns the remote IDs when the remote index can't list them
+        interval: Seconds between syncs; 0 syncs once
+        prune: Also delete local vectors that are not in the remote index
+    """
+    def run():
+        while True:
+            try:
+                sync_from(local, remote(), ids() if ids else None, prune=prune)
+            except Exception as e:
+                logger.error(f"Error syncing the local vector index: {str(e)}")
+            if interval <= 0:
+                return
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="vector-index-sync", daemon=True)
+    thread.start()
+    return thread
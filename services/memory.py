@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from utils.clients import clients
+from utils.config import memory_config
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an assistant.
+Keep facts, decisions, names, numbers and open questions; drop pleasantries. Answer with the summary
+only, in at most {max_tokens} tokens.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}"""
+
+
+def message_tokens(message: BaseMessage) -> int:
+    return count_tokens(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+
+
+def summarize_with_llm(summary: str, messages: List[BaseMessage], max_tokens: int = memory_config.summary_tokens) -> str:
+    """Folds messages into the summary with the shared chat model."""
+    transcript = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    prompt = SUMMARY_PROMPT.format(max_tokens=max_tokens, summary=summary or "(empty)", messages=transcript)
+    # Runs in a summary worker thread; the call goes through the shared rate-limited transport on the
+    # summaries' own long-lived loop, so they reuse one connection pool
+    response = asyncio.run_coroutine_threadsafe(
+        clients.get("chat_model").ainvoke([HumanMessage(content=prompt)]), _summary_loop()
+    ).result()
+    return response.content
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _summary_loop() -> asyncio.AbstractEventLoop:
+    """The event loop summaries run on, started in a daemon thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="memory-summary-loop", daemon=True).start()
+        return _loop
+
+
+def _recent_turns(messages: List[BaseMessage], budget: int) -> List[BaseMessage]:
+    """The latest whole turns of ``messages`` that fit in ``budget`` tokens."""
+    tokens = 0
+    start = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        tokens += message_tokens(messages[i])
+        if tokens > budget:
+            break
+        if isinstance(messages[i], HumanMessage):
+            start = i
+    return messages[start:]
+
+
+@dataclass
+class SessionMemory:
+    """What is remembered of one conversation."""
+    summary: str = ""
+    summary_tokens: int = 0
+    # Recent turns kept verbatim, oldest first
+    messages: List[BaseMessage] = field(default_factory=list)
+    tokens: int = 0
+    # Turns moved out of the verbatim window but not yet in the summary
+    pending: List[BaseMessage] = field(default_factory=list)
+    pending_tokens: int = 0
+    summarizing: bool = False
+    turns: int = 0
+    last_used: float = field(default_factory=time.time)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.summary_tokens + self.tokens + self.pending_tokens
+
+
+class ConversationMemory:
+    """
+    Bounded, token-aware conversation memory shared by all sessions.
+
+    Each session keeps its most recent turns verbatim within ``session_tokens``.
+    Older turns are folded into a rolling summary by a background worker, so a
+    turn never waits for summarization: until the new summary lands, the latest
+    folded turns are still sent verbatim, within the same budget. Sessions idle for longer than ``idle_ttl`` are
+    dropped, and the least recently used sessions are evicted whenever the number
+    of sessions or the tokens held across all of them exceed their caps.
+    """
+
+    def __init__(self, summarizer: Callable[[str, List[BaseMessage]], str] = summarize_with_llm,
+                 session_tokens: int = memory_config.session_tokens,
+                 max_sessions: int = memory_config.max_sessions,
+                 max_total_tokens: int = memory_config.max_total_tokens,
+                 idle_ttl: float = memory_config.idle_ttl,
+                 summary_workers: int = memory_config.summary_workers):
+        """
+        Args:
+            summarizer: Returns the summary updated with the given messages
+            session_tokens: Token budget for the verbatim turns of a session
+            max_sessions: Maximum number of sessions kept
+            max_total_tokens: Maximum tokens kept across all sessions
+            idle_ttl: Seconds after which an unused session is forgotten
+            summary_workers: Threads running summarization
+        """
+        self.summarizer = summarizer
+        self.session_tokens = session_tokens
+        self.max_sessions = max_sessions
+        self.max_total_tokens = max_total_tokens
+        self.idle_ttl = idle_ttl
+        self._sessions: "OrderedDict[str, SessionMemory]" = OrderedDict()
+        self._total_tokens = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(summary_workers, thread_name_prefix="memory-summary")
+        self.evicted = 0
+        self.summaries = 0
+
+    def context(self, session_id: str, system_prompt: Optional[str] = None) -> List[BaseMessage]:
+        """Messages to send ahead of a new query: system prompt, summary, then the recent turns."""
+        with self._lock:
+            session = self._touch(session_id)
+            # Folded turns awaiting their summary only get what the verbatim turns leave of the budget
+            pending = _recent_turns(session.pending, max(self.session_tokens - session.tokens, 0))
+            summary, messages = session.summary, list(session.messages)
+
+        context: List[BaseMessage] = []
+        if system_prompt:
+            context.append(SystemMessage(content=system_prompt))
+        if summary:
+            context.append(SystemMessage(content=f"Summary of the earlier conversation: {summary}"))
+        return context + pending + messages
+
+    def append(self, session_id: str, *messages: BaseMessage) -> None:
+        """Records a finished turn, folding the oldest turns away once the session is over budget."""
+        with self._lock:
+            session = self._touch(session_id)
+            before = session.total_tokens
+            for message in messages:
+                session.messages.append(message)
+                session.tokens += message_tokens(message)
+            session.turns += sum(isinstance(message, HumanMessage) for message in messages)
+
+            if session.tokens > self.session_tokens:
+                self._fold(session)
+                if not session.summarizing:
+                    session.summarizing = True
+                    self._executor.submit(self._summarize, session_id, session)
+
+            self._total_tokens += session.total_tokens - before
+            self._evict(keep=session_id)
+
+    def messages(self, session_id: str) -> List[BaseMessage]:
+        """The turns remembered verbatim for a session."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return list(session.pending + session.messages) if session else []
+
+    def summary(self, session_id: str) -> str:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.summary if session else ""
+
+    def turns(self, session_id: str) -> int:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.turns if session else 0
+
+    def clear(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session:
+                self._total_tokens -= session.total_tokens
+            return session is not None
+
+    def _touch(self, session_id: str) -> SessionMemory:
+        now = time.time()
+        session = self._sessions.get(session_id)
+        if session is not None and now - session.last_used > self.idle_ttl:
+            self._drop(session_id)
+            session = None
+        if session is None:
+            session = self._sessions[session_id] = SessionMemory()
+        session.last_used = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _fold(self, session: SessionMemory) -> None:
+        """Moves whole turns, oldest first, out of the verbatim window; always keeps the latest turn."""
+        while session.tokens > self.session_tokens:
+            # A turn runs from a user message up to the next one
+            end = next((i for i, message in enumerate(session.messages)
+                        if i > 0 and isinstance(message, HumanMessage)), None)
+            if end is None:
+                break
+            turn, session.messages = session.messages[:end], session.messages[end:]
+            tokens = sum(message_tokens(message) for message in turn)
+            session.tokens -= tokens
+            session.pending.extend(turn)
+            session.pending_tokens += tokens
+
+    def _summarize(self, session_id: str, session: SessionMemory) -> None:
+        while True:
+            with self._lock:
+                batch = list(session.pending)
+                summary = session.summary
+                if not batch or self._sessions.get(session_id) is not session:
+                    session.summarizing = False
+                    return
+            try:
+                new_summary = self.summarizer(summary, batch)
+            except Exception as e:
+                logger.error(f"Error summarizing session {session_id}: {str(e)}")
+                with self._lock:
+                    session.summarizing = False
+                    # Keep the session bounded even without a summary
+                    while session.pending and session.pending_tokens > self.session_tokens:
+                        dropped = session.pending.pop(0)
+                        session.pending_tokens -= message_tokens(dropped)
+                        self._total_tokens -= message_tokens(dropped)
+                return
+
+            with self._lock:
+                if self._sessions.get(session_id) is not session:
+                    session.summarizing = False
+                    return
+                before = session.total_tokens
+                session.summary = new_summary
+                session.summary_tokens = count_tokens(new_summary)
+                del session.pending[:len(batch)]
+                session.pending_tokens = sum(message_tokens(message) for message in session.pending)
+                self._total_tokens += session.total_tokens - before
+                self.summaries += 1
+
+    def _evict(self, keep: str) -> None:
+        now = time.time()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_used <= self.idle_ttl:
+                break
+            self._drop(session_id)
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions
+                                           or self._total_tokens > self.max_total_tokens):
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self._drop(session_id)
+
+    def _drop(self, session_id: str) -> None:
+        session = self._sessions.pop(session_id)
+        self._total_tokens -= session.total_tokens
+        self.evicted += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "tokens": self._total_tokens,
+                "evicted": self.evicted,
+                "summaries": self.summaries,
+                "summarizing": sum(session.summarizing for session in self._sessions.values()),
+            }
@@ -0,0 +1,137 @@
+import logging
+import re
+from typing import Iterable, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, SystemMessage
+
+from services.hybrid_retriever import LexicalReranker
+from utils.config import model_tier_config
+from utils.metrics import model_tier_calls
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+SMALL = "small"
+LARGE = "large"
+
+# Reply the small model is asked to give instead of a guess
+ESCALATE = "ESCALATE"
+ESCALATION_INSTRUCTION = (
+    "\n\nIf you cannot answer reliably, for example because the request is ambiguous or needs "
+    f"expertise or reasoning you are unsure of, reply with only the word {ESCALATE}."
+)
+
+
+def tagged(model, tier: str):
+    """The model with its tier in the run metadata, so the metrics callbacks can label its calls."""
+    return model.with_config(metadata={"model_tier": tier})
+
+
+def with_escalation_instruction(messages: List) -> List:
+    """Appends the escalation instruction to the system prompt, given as a message or a tuple."""
+    first = messages[0] if messages else None
+    if isinstance(first, SystemMessage):
+        return [SystemMessage(content=first.content + ESCALATION_INSTRUCTION), *messages[1:]]
+    if isinstance(first, tuple) and first[0] == "system":
+        return [("system", first[1] + ESCALATION_INSTRUCTION), *messages[1:]]
+    return [SystemMessage(content=ESCALATION_INSTRUCTION.strip()), *messages]
+
+
+class ModelTierPolicy:
+    """
+    Chooses between a small, fast chat model and the large one for each supervisor and expert call.
+
+    A call goes to the small model unless the query looks complex (long, several
+    questions, or a term like "compare") or, for knowledge base experts, the
+    retrieved context covers little of the query. The large model redoes the call
+    when the small one turns out unsure: it replies ESCALATE, its tokens are
+    improbable, or it calls tools that don't exist.
+    """
+
+    def __init__(self, enabled: bool = model_tier_config.enabled,
+                 max_query_tokens: int = model_tier_config.max_query_tokens,
+                 max_questions: int = model_tier_config.max_questions,
+                 complex_terms: Iterable[str] = model_tier_config.complex_terms,
+                 min_retrieval_score: float = model_tier_config.min_retrieval_score,
+                 min_logprob: float = model_tier_config.min_logprob):
+        """
+        Args:
+            enabled: Without tiering every call goes to the large model
+            max_query_tokens: Longer queries go to the large model
+            max_questions: Queries asking more questions go to the large model
+            complex_terms: Words that send a query to the large model
+            min_retrieval_score: Minimum share of the query covered by the retrieved context
+            min_logprob: Minimum mean token log probability of a small model reply, when reported
+        """
+        self.enabled = enabled
+        self.max_query_tokens = max_query_tokens
+        self.max_questions = max_questions
+        self.complex_terms = frozenset(complex_terms)
+        self.min_retrieval_score = min_retrieval_score
+        self.min_logprob = min_logprob
+        self._coverage = LexicalReranker()
+
+    def initial_tier(self, query: str, context: Optional[str] = None) -> Tuple[str, str]:
+        """The tier to try first and why."""
+        if not self.enabled:
+            return LARGE, "disabled"
+        if count_tokens(query) > self.max_query_tokens:
+            return LARGE, "long_query"
+        if query.count("?") > self.max_questions:
+            return LARGE, "several_questions"
+        if self.complex_terms & set(re.findall(r"\w+", query.lower())):
+            return LARGE, "complex_query"
+        if context is not None and self.retrieval_score(query, context) < self.min_retrieval_score:
+            return LARGE, "weak_retrieval"
+        return SMALL, "simple_query"
+
+    def retrieval_score(self, query: str, context: str) -> float:
+        """How much of the query the retrieved context covers, from 0 to 1."""
+        return min(self._coverage.score(query, [context])[0], 1.0)
+
+    def uncertainty(self, message: BaseMessage, tool_names: Optional[Iterable[str]] = None) -> Optional[str]:
+        """Why a small model reply should be redone by the large model, or None if it can stand."""
+        content = message.content if isinstance(message.content, str) else ""
+        if content.strip().rstrip(".").upper() == ESCALATE:
+            return "self_reported"
+        if tool_names is not None:
+            known = set(tool_names)
+            if getattr(message, "invalid_tool_calls", None) or any(
+                call["name"] not in known for call in getattr(message, "tool_calls", None) or []
+            ):
+                return "invalid_tool_calls"
+        # Only present when the provider returns log probabilities
+        logprobs = ((message.response_metadata or {}).get("logprobs") or {}).get("content") or []
+        if logprobs and sum(token["logprob"] for token in logprobs) / len(logprobs) < self.min_logprob:
+            return "low_confidence"
+        return None
+
+    async def ainvoke(self, role: str, query: str, messages: List, small, large, context: Optional[str] = None,
+                      tool_names: Optional[Iterable[str]] = None) -> BaseMessage:
+        """
+        Runs a chat model call on the cheapest tier that can handle it.
+
+        Args:
+            role: ``supervisor`` or the expert tool's name, for the metrics
+            query: The user query the call is about, used to judge its complexity
+            messages: The chat messages, starting with the system prompt
+            small: The small model, bound to the same tools as ``large``
+            large: The large model
+            context: Retrieved knowledge base context the answer relies on, if any
+            tool_names: Tools the models may call, to catch invalid tool calls from the small model
+
+        Returns:
+            The small model's reply, or the large model's when it was needed
+        """
+        tier, reason = self.initial_tier(query, context)
+        if tier == SMALL:
+            reply = await tagged(small, SMALL).ainvoke(with_escalation_instruction(messages))
+            model_tier_calls.inc(role=role, tier=SMALL, reason=reason)
+            doubt = self.uncertainty(reply, tool_names)
+            if doubt is None:
+                return reply
+            logger.info(f"Escalating {role} call to the large model: {doubt}")
+            reason = doubt
+        reply = await tagged(large, LARGE).ainvoke(messages)
+        model_tier_calls.inc(role=role, tier=LARGE, reason=reason)
+        return reply
@@ -0,0 +1,146 @@
+import json
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils.config import pre_router_config
+
+logger = logging.getLogger(__name__)
+
+# Labelled queries that clearly belong to one tool, embedded alongside the tool descriptions
+DEFAULT_ROUTING_EXAMPLES: Dict[str, List[str]] = {
+    "frontend_agent_tool": [
+        "How do I center a div with flexbox?",
+        "Why does my React component re-render on every keystroke?",
+        "What is the difference between CSS grid and flexbox?",
+        "How should I manage global state in a Vue app?",
+    ],
+    "backend_agent_tool": [
+        "How do I design a REST API for user accounts?",
+        "Should I use PostgreSQL or MongoDB for this service?",
+        "How can I speed up a slow SQL query with joins?",
+        "What is the best way to handle background jobs in a Python server?",
+    ],
+    "designer_agent_tool": [
+        "What color palette works for a fintech dashboard?",
+        "How can I improve the onboarding user experience of my app?",
+        "Which fonts pair well for a landing page?",
+        "How much whitespace should a mobile layout use?",
+    ],
+    "search_google": [
+        "What is the latest news about electric cars?",
+        "Who won the football match yesterday?",
+        "What is the weather in London today?",
+        "What is the current stock price of Apple?",
+    ],
+    "legal_expert": [
+        "What does the termination clause in our contract say?",
+        "Are we liable under the indemnification terms?",
+        "What are the confidentiality obligations in the agreement?",
+        "Which law governs this contract?",
+    ],
+    "finance_expert": [
+        "What was our revenue last quarter?",
+        "How is the budget allocated across departments?",
+        "What are the payment terms for invoices?",
+        "Summarize the expense policy for travel.",
+    ],
+}
+
+
+@dataclass
+class RouteDecision:
+    tool: str
+    score: float
+    margin: float
+
+
+class PreRouter:
+    """
+    Local embedding-similarity router that can skip the supervisor LLM.
+
+    Each tool is represented by its description and a few labelled example queries.
+    A query is routed straight to a tool when its best cosine similarity clears
+    ``min_score`` and beats the runner-up tool by ``min_margin``; otherwise the
+    supervisor decides as before.
+    """
+
+    def __init__(self, embeddings, tools, examples: Optional[Dict[str, List[str]]] = None,
+                 min_score: float = pre_router_config.min_score, min_margin: float = pre_router_config.min_margin):
+        """
+        Args:
+            embeddings: Embeddings used for the prototypes and the incoming queries
+            tools: The tools the supervisor can call
+            examples: Labelled example queries per tool name
+            min_score: Minimum similarity to the best matching tool
+            min_margin: Minimum lead over the second best tool
+        """
+        self.embeddings = embeddings
+        self.tool_names = [tool.name for tool in tools]
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self._prototypes: List[str] = []
+        labels: List[int] = []
+        examples = examples if examples is not None else load_routing_examples()
+        for i, tool in enumerate(tools):
+            for text in [tool.description] + examples.get(tool.name, []):
+                self._prototypes.append(text)
+                labels.append(i)
+        self._labels = np.asarray(labels)
+        self._matrix: Optional[np.ndarray] = None
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.fallbacks = 0
+
+    async def _prototype_matrix(self) -> np.ndarray:
+        # Embedded on first use; concurrent first requests may both embed, which is harmless
+        if self._matrix is None:
+            vectors = np.asarray(await self.embeddings.aembed_documents(self._prototypes), dtype=np.float32)
+            self._matrix = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return self._matrix
+
+    async def route(self, query: str) -> Optional[RouteDecision]:
+        """Returns the tool to dispatch to when confident, or None to fall back to the supervisor."""
+        matrix = await self._prototype_matrix()
+        vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+
+        similarities = matrix @ vector
+        scores = np.full(len(self.tool_names), -1.0, dtype=np.float32)
+        np.maximum.at(scores, self._labels, similarities)
+        ranked = np.argsort(scores)[::-1]
+        best = float(scores[ranked[0]])
+        margin = best - float(scores[ranked[1]]) if len(ranked) > 1 else best
+
+        if best >= self.min_score and margin >= self.min_margin:
+            with self._stats_lock:
+                self.hits += 1
+            decision = RouteDecision(tool=self.tool_names[ranked[0]], score=best, margin=margin)
+            logger.info(f"Pre-routed to {decision.tool} (score {best:.3f}, margin {margin:.3f})")
+            return decision
+
+        with self._stats_lock:
+            self.fallbacks += 1
+        return None
+
+    def stats(self) -> Dict[str, float]:
+        with self._stats_lock:
+            total = self.hits + self.fallbacks
+            return {
+                "hits": self.hits,
+                "fallbacks": self.fallbacks,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def load_routing_examples(path: str = pre_router_config.examples_path) -> Dict[str, List[str]]:
+    """Default examples, extended with a JSON file of {"tool_name": ["query", ...]} if configured."""
+    examples = {name: list(queries) for name, queries in DEFAULT_ROUTING_EXAMPLES.items()}
+    if path:
+        with open(path) as f:
+            for name, queries in json.load(f).items():
+                examples.setdefault(name, []).extend(queries)
+    return examples
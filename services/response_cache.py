@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+
+from utils.config import response_cache_config
+from utils.kb_versions import arefresh_kb_versions, kb_changed_since
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    query: str
+    response: Dict[str, Any]
+    expires_at: float
+    # When computing the answer started, and the knowledge base types it relied on
+    started_at: float
+    kb_types: Set[str] = field(default_factory=set)
+
+
+class SemanticResponseCache:
+    """
+    In-process cache of final answers looked up by query embedding similarity.
+
+    Query vectors are kept normalized in a preallocated numpy matrix, so a lookup is
+    one matrix-vector product. Entries expire after ``ttl`` seconds, the least recently
+    used entry is evicted when full, and answers that used a knowledge base tool are
+    dropped once that knowledge base type is re-ingested, by any worker sharing the
+    ingestion manifest.
+    """
+
+    def __init__(self, embeddings, kb_tool_types: Dict[str, str], threshold: float = response_cache_config.threshold,
+                 ttl: float = response_cache_config.ttl, max_entries: int = response_cache_config.max_entries):
+        """
+        Args:
+            embeddings: Embeddings used for the incoming queries
+            kb_tool_types: Knowledge base type searched by each retrieval tool
+            threshold: Minimum cosine similarity for a hit
+            ttl: Entry lifetime in seconds
+            max_entries: Maximum number of cached answers
+        """
+        self.embeddings = embeddings
+        self.kb_tool_types = kb_tool_types
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._vectors: Optional[np.ndarray] = None
+        self._expires = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._entries: List[Optional[CacheEntry]] = [None] * max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Returns a cached response for a similar enough query, marked with ``cached``, or None."""
+        vector = await self._embed(query)
+        # Read other workers' re-ingestions here, so the check under the lock stays in memory
+        await arefresh_kb_versions()
+        now = time.time()
+        with self._lock:
+            if self._vectors is None:
+                self.misses += 1
+                return None
+            scores = self._vectors @ vector
+            scores[self._expires <= now] = -np.inf
+            slot = int(np.argmax(scores))
+            entry = self._entries[slot]
+            if scores[slot] < self.threshold or entry is None:
+                self.misses += 1
+                return None
+            if not self._is_current(entry):
+                # Its knowledge base changed since; free the slot
+                self._expires[slot] = 0
+                self.misses += 1
+                return None
+            self._last_used[slot] = now
+            self.hits += 1
+
+        logger.info(f"Response cache hit ({scores[slot]:.3f}) for query: {query}")
+        return {**entry.response, 'cached': True, 'cache_similarity': float(scores[slot])}
+
+    async def store(self, query: str, response: Dict[str, Any], started_at: float) -> None:
+        """
+        Caches a response.
+
+        Args:
+            query: The query that produced the response
+            response: The ``final_answer``/``used_tools`` response
+            started_at: When processing of the query started, to catch re-ingestion that raced with it
+        """
+        vector = await self._embed(query)
+        now = time.time()
+        entry = CacheEntry(
+            query=query,
+            response=response,
+            expires_at=now + self.ttl,
+            started_at=started_at,
+            kb_types={self.kb_tool_types[name] for name in response.get('used_tools', [])
+                      if name in self.kb_tool_types},
+        )
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            # Reuse an expired slot if there is one, otherwise evict the least recently used entry
+            expired = np.flatnonzero(self._expires <= now)
+            slot = int(expired[0]) if expired.size else int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._expires[slot] = entry.expires_at
+            self._last_used[slot] = now
+            self._entries[slot] = entry
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int(np.count_nonzero(self._expires > time.time())),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    async def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    @staticmethod
+    def _is_current(entry: CacheEntry) -> bool:
+        return not any(kb_changed_since(kb_type, entry.started_at) for kb_type in entry.kb_types)
@@ -0,0 +1,96 @@
+import asyncio
+import sqlite3
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph import END, START, MessagesState, StateGraph
+
+from utils.checkpoint import DeltaCheckpointSaver
+
+TURNS = 12
+
+
+def build_graph(checkpointer):
+    """Two steps per turn; every third turn also rewrites the first answer, so a checkpoint edits history."""
+
+    def answer(state: MessagesState):
+        turn = sum(isinstance(message, HumanMessage) for message in state["messages"])
+        messages = [AIMessage(content=f"answer {turn}")]
+        if turn % 3 == 0:
+            first = next(message for message in state["messages"] if isinstance(message, AIMessage))
+            messages.append(AIMessage(content=f"revised at turn {turn}", id=first.id))
+        return {"messages": messages}
+
+    def follow_up(state: MessagesState):
+        return {"messages": [AIMessage(content=f"follow-up to {state['messages'][-1].content}")]}
+
+    graph = StateGraph(MessagesState)
+    graph.add_node("answer", answer)
+    graph.add_node("follow_up", follow_up)
+    graph.add_edge(START, "answer")
+    graph.add_edge("answer", "follow_up")
+    graph.add_edge("follow_up", END)
+    return graph.compile(checkpointer=checkpointer)
+
+
+def open_saver(path, delta: bool):
+    saver = SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+    return DeltaCheckpointSaver(saver, keyframe_interval=4) if delta else saver
+
+
+def config(thread_id: str = "session"):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def contents(messages):
+    # Message IDs are random per run, so states of two graphs are compared by content
+    return [(message.type, message.content) for message in messages]
+
+
+def history(graph, thread_id: str = "session"):
+    return [contents(snapshot.values.get("messages", [])) for snapshot in graph.get_state_history(config(thread_id))]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return tmp_path / "delta.db", tmp_path / "plain.db"
+
+
+def test_rebuilt_state_matches_plain_saver(paths):
+    delta_path, plain_path = paths
+    delta_graph = build_graph(open_saver(delta_path, delta=True))
+    plain_graph = build_graph(open_saver(plain_path, delta=False))
+    for turn in range(TURNS):
+        for graph in (delta_graph, plain_graph):
+            graph.invoke({"messages": [HumanMessage(content=f"question {turn}")]}, config())
+
+    checkpointer = delta_graph.checkpointer
+    assert checkpointer.deltas > 0 and checkpointer.keyframes > 1
+
+    # A fresh saver on the same file has nothing in memory, like a cold worker
+    cold_graph = build_graph(open_saver(delta_path, delta=True))
+    expected = contents(plain_graph.get_state(config()).values["messages"])
+    assert len(expected) == 3 * TURNS
+    assert contents(cold_graph.get_state(config()).values["messages"]) == expected
+    assert history(cold_graph) == history(plain_graph)
+
+
+def test_cold_worker_continues_session(paths):
+    delta_path, plain_path = paths
+    warm_graph = build_graph(open_saver(delta_path, delta=True))
+    plain_graph = build_graph(open_saver(plain_path, delta=False))
+    for turn in range(TURNS // 2):
+        for graph in (warm_graph, plain_graph):
+            graph.invoke({"messages": [HumanMessage(content=f"question {turn}")]}, config())
+
+    # Another worker picks the session up, asynchronously, and a later read sees both workers' turns
+    cold_graph = build_graph(open_saver(delta_path, delta=True))
+    for turn in range(TURNS // 2, TURNS):
+        asyncio.run(cold_graph.ainvoke({"messages": [HumanMessage(content=f"question {turn}")]}, config()))
+        plain_graph.invoke({"messages": [HumanMessage(content=f"question {turn}")]}, config())
+
+    reader = build_graph(open_saver(delta_path, delta=True))
+    assert contents(reader.get_state(config()).values["messages"]) == \
+        contents(plain_graph.get_state(config()).values["messages"])
+    assert history(reader) == history(plain_graph)
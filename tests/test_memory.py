@@ -0,0 +1,35 @@
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from services.memory import ConversationMemory, message_tokens
+
+SESSION_TOKENS = 200
+
+
+def test_context_stays_within_budget_while_summary_is_pending():
+    release = threading.Event()
+    summarized = threading.Event()
+
+    def stalled_summarizer(summary, messages):
+        release.wait(10)
+        summarized.set()
+        return "summary"
+
+    memory = ConversationMemory(summarizer=stalled_summarizer, session_tokens=SESSION_TOKENS)
+    try:
+        for turn in range(20):
+            memory.append("session", HumanMessage(content=f"question {turn} " + "word " * 15),
+                          AIMessage(content=f"answer {turn} " + "word " * 15))
+            context = memory.context("session")
+            assert sum(message_tokens(message) for message in context) <= SESSION_TOKENS
+
+        # Turns were folded away and are waiting for the stalled summary
+        assert memory.stats()["summarizing"] == 1
+        context = memory.context("session")
+        assert context[-1].content.startswith("answer 19")
+        assert not any(isinstance(message, SystemMessage) for message in context)
+    finally:
+        release.set()
+
+    assert summarized.wait(10)
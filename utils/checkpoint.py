@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata,
+                                       CheckpointTuple)
+
+from utils.config import checkpoint_config
+
+logger = logging.getLogger(__name__)
+
+# Marks a channel value stored as a delta against the parent checkpoint
+DELTA_KEY = "__delta_of__"
+
+
+class _Recent:
+    """The expanded messages of the latest checkpoint seen for a thread."""
+
+    def __init__(self, checkpoint_id: str, messages: List[Any], depth: int):
+        self.checkpoint_id = checkpoint_id
+        self.messages = messages
+        self.depth = depth
+
+
+class DeltaCheckpointSaver(BaseCheckpointSaver):
+    """
+    Checkpointer that stores the message list of each checkpoint as a delta.
+
+    LangGraph saves the whole state after every step, so a session's message list
+    would be written again on every step of every turn. This wrapper stores only
+    the messages appended since the parent checkpoint, plus a full copy every
+    ``keyframe_interval`` checkpoints to bound how many rows a read has to follow.
+    Any synchronous checkpointer can be wrapped (SQLite locally, Postgres for
+    several nodes); the async methods run it in a worker thread, so the wrapper
+    works from whichever event loop a request runs on.
+    """
+
+    def __init__(self, saver: BaseCheckpointSaver, channel: str = "messages",
+                 keyframe_interval: int = checkpoint_config.keyframe_interval,
+                 max_recent: int = checkpoint_config.max_recent_threads):
+        """
+        Args:
+            saver: Checkpointer that does the actual storage
+            channel: State channel holding the message list
+            keyframe_interval: Store a full copy after this many deltas
+            max_recent: Threads whose latest messages are kept in memory to compute deltas
+        """
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+        self.channel = channel
+        self.keyframe_interval = keyframe_interval
+        self.max_recent = max_recent
+        self._recent: "OrderedDict[Tuple[str, str], _Recent]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.deltas = 0
+        self.keyframes = 0
+
+    @property
+    def config_specs(self):
+        return self.saver.config_specs
+
+    def get_next_version(self, current, channel):
+        return self.saver.get_next_version(current, channel)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        checkpoint_tuple, depth = self._expand(self.saver.get_tuple(config))
+        if checkpoint_tuple is not None and not config["configurable"].get("checkpoint_id"):
+            # The latest checkpoint is the parent of the next one the graph writes
+            self._remember(checkpoint_tuple.config, checkpoint_tuple.checkpoint, depth)
+        return checkpoint_tuple
+
+    def list(self, config: Optional[RunnableConfig], **kwargs) -> Iterator[CheckpointTuple]:
+        # Expanding reads base checkpoints, which savers like SqliteSaver can't serve while still listing
+        for checkpoint_tuple in list(self.saver.list(config, **kwargs)):
+            yield self._expand(checkpoint_tuple)[0]
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        return self.saver.put(config, self._compact(config, checkpoint), metadata, new_versions)
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        self.saver.put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            for key in [key for key in self._recent if key[0] == thread_id]:
+                del self._recent[key]
+        self.saver.delete_thread(thread_id)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], **kwargs) -> AsyncIterator[CheckpointTuple]:
+        for checkpoint_tuple in await asyncio.to_thread(lambda: list(self.list(config, **kwargs))):
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def _compact(self, config: RunnableConfig, checkpoint: Checkpoint) -> Checkpoint:
+        """Replaces the message list with the messages added since the parent checkpoint."""
+        messages = checkpoint["channel_values"].get(self.channel)
+        if not isinstance(messages, list):
+            return checkpoint
+        parent_id = config["configurable"].get("checkpoint_id")
+        with self._lock:
+            recent = self._recent.get(_thread_key(config))
+        if recent is None or recent.checkpoint_id != parent_id or recent.depth + 1 >= self.keyframe_interval:
+            self._remember(config, checkpoint, 0)
+            self.keyframes += 1
+            return checkpoint
+
+        keep = 0
+        for old, new in zip(recent.messages, messages):
+            if old is not new and old != new:
+                break
+            keep += 1
+        self._remember(config, checkpoint, recent.depth + 1)
+        self.deltas += 1
+        delta = {DELTA_KEY: parent_id, "keep": keep, "tail": messages[keep:]}
+        return {**checkpoint, "channel_values": {**checkpoint["channel_values"], self.channel: delta}}
+
+    def _expand(self, checkpoint_tuple: Optional[CheckpointTuple]) -> Tuple[Optional[CheckpointTuple], int]:
+        """Rebuilds the full message list of a checkpoint stored as a delta; also returns how many deltas deep it is."""
+        if checkpoint_tuple is None:
+            return None, 0
+        values = checkpoint_tuple.checkpoint["channel_values"]
+        delta = values.get(self.channel)
+        if not (isinstance(delta, dict) and DELTA_KEY in delta):
+            return checkpoint_tuple, 0
+
+        configurable = checkpoint_tuple.config["configurable"]
+        base, depth = self._expand(self.saver.get_tuple({"configurable": {
+            "thread_id": configurable["thread_id"],
+            "checkpoint_ns": configurable.get("checkpoint_ns", ""),
+            "checkpoint_id": delta[DELTA_KEY],
+        }}))
+        if base is None:
+            logger.error(f"Missing base checkpoint {delta[DELTA_KEY]} of thread {configurable['thread_id']}")
+            messages = list(delta["tail"])
+        else:
+            messages = base.checkpoint["channel_values"].get(self.channel, [])[:delta["keep"]] + list(delta["tail"])
+        checkpoint = {**checkpoint_tuple.checkpoint, "channel_values": {**values, self.channel: messages}}
+        return checkpoint_tuple._replace(checkpoint=checkpoint), depth + 1
+
+    def _remember(self, config: RunnableConfig, checkpoint: Checkpoint, depth: int) -> None:
+        messages = checkpoint["channel_values"].get(self.channel)
+        if not isinstance(messages, list):
+            return
+        key = _thread_key(config)
+        with self._lock:
+            self._recent[key] = _Recent(checkpoint["id"], list(messages), depth)
+            self._recent.move_to_end(key)
+            while len(self._recent) > self.max_recent:
+                self._recent.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"deltas": self.deltas, "keyframes": self.keyframes, "recent_threads": len(self._recent)}
+
+
+def _thread_key(config: RunnableConfig) -> Tuple[str, str]:
+    configurable = config["configurable"]
+    return str(configurable["thread_id"]), configurable.get("checkpoint_ns", "")
+
+
+def create_checkpointer(backend: str = checkpoint_config.backend) -> DeltaCheckpointSaver:
+    """
+    Builds the session checkpointer selected by CHECKPOINT_BACKEND.
+
+    Args:
+        backend: "sqlite" (a local file, shared by the workers of one host), "postgres"
+            (CHECKPOINT_URL, shared by several nodes) or "memory" (a single process)
+
+    Returns:
+        The checkpointer, storing message lists as deltas
+    """
+    if backend == "sqlite":
+        import sqlite3
+        from langgraph.checkpoint.sqlite import SqliteSaver
+        saver = SqliteSaver(sqlite3.connect(checkpoint_config.path, check_same_thread=False))
+    elif backend == "postgres":
+        from langgraph.checkpoint.postgres import PostgresSaver
+        from psycopg.rows import dict_row
+        from psycopg_pool import ConnectionPool
+        pool = ConnectionPool(checkpoint_config.url, max_size=checkpoint_config.pool_size,
+                              kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row})
+        saver = PostgresSaver(pool)
+        saver.setup()
+    elif backend == "memory":
+        from langgraph.checkpoint.memory import MemorySaver
+        saver = MemorySaver()
+    else:
+        raise ValueError(f"Unknown checkpoint backend: {backend}")
+    return DeltaCheckpointSaver(saver)
@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from utils.config import (client_config, ingestion_config, pinecone_config, retrieval_config, transport_config,
+                          vector_config)
+
+logger = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """
+    Lazily created upstream clients shared by the tools, GraphService and the upload routes.
+
+    Each client is built by its factory on first use and reused by every caller
+    afterwards, so a worker pays for a client (and opens its connection pool) only
+    once and only if it needs it. ``override`` injects a stand-in, e.g. in benchmarks.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._clients: Dict[str, Any] = {}
+        # Re-entrant because factories may get the clients they depend on
+        self._lock = threading.RLock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        """Registers how to build a client; replaces a client that was already built."""
+        with self._lock:
+            self._factories[name] = factory
+            self._clients.pop(name, None)
+
+    def get(self, name: str) -> Any:
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._lock:
+            if name not in self._clients:
+                if name not in self._factories:
+                    raise KeyError(f"No client registered as {name}")
+                started = time.perf_counter()
+                self._clients[name] = self._factories[name]()
+                logger.info(f"Created client {name} in {time.perf_counter() - started:.3f}s")
+            return self._clients[name]
+
+    def created(self, name: str) -> bool:
+        return name in self._clients
+
+    def override(self, name: str, client: Any) -> None:
+        """Uses ``client`` for ``name`` instead of building one."""
+        with self._lock:
+            self._clients[name] = client
+
+    @contextmanager
+    def overridden(self, **clients: Any):
+        """Temporarily injects stand-ins, restoring the previous clients afterwards."""
+        with self._lock:
+            previous = {name: self._clients.get(name) for name in clients}
+            self._clients.update(clients)
+        try:
+            yield self
+        finally:
+            with self._lock:
+                for name, client in previous.items():
+                    if client is None:
+                        self._clients.pop(name, None)
+                    else:
+                        self._clients[name] = client
+
+    def warm_up(self, names: Optional[Iterable[str]] = None) -> None:
+        """Builds the given clients, or all of them, now rather than on the first request."""
+        for name in list(names or self._factories):
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.error(f"Error warming up client {name}: {str(e)}")
+
+
+def _limited_http_client(name: str, max_concurrency: int, rpm: float = 0, tpm: float = 0, **kwargs):
+    """Async HTTP client on a pooled transport that queues requests beyond the upstream's limits."""
+    import httpx
+    from utils.metrics import export_stats
+    from utils.transport import LimitedTransport, UpstreamLimiter
+    limiter = UpstreamLimiter(name, max_concurrency, rpm=rpm, tpm=tpm)
+    export_stats([("transport", name, limiter)])
+    return httpx.AsyncClient(transport=LimitedTransport(limiter), **kwargs)
+
+
+def _chat_model():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=client_config.agent_model,
+        temperature=0,
+        # Token usage is also reported when the graph is streamed
+        stream_usage=True,
+        http_async_client=clients.get("openai_http"),
+    )
+
+
+def _small_chat_model():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        model=client_config.small_agent_model,
+        temperature=0,
+        stream_usage=True,
+        # Lets the tier policy escalate replies the small model was unsure of
+        logprobs=True,
+        http_async_client=clients.get("openai_http"),
+    )
+
+
+def _model_tiers():
+    from services.model_tiers import ModelTierPolicy
+    return ModelTierPolicy()
+
+
+def _openai_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=client_config.embedding_model, http_async_client=clients.get("embeddings_http"))
+
+
+def _query_embeddings():
+    # Query embeddings are cached since experts often get the same question
+    from utils.embedding_cache import CachedEmbeddings
+    from utils.metrics import export_stats
+    embeddings = CachedEmbeddings(clients.get("openai_embeddings"), model=client_config.embedding_model)
+    export_stats([("cache", "query_embeddings", embeddings)])
+    return embeddings
+
+
+def _pinecone():
+    from pinecone import Pinecone
+    return Pinecone(api_key=pinecone_config.api_key)
+
+
+def _pinecone_kb_index():
+    from utils.metrics import export_stats
+    from utils.transport import LimitedIndex, UpstreamLimiter
+    limiter = UpstreamLimiter("pinecone", transport_config.pinecone_max_concurrency)
+    export_stats([("transport", "pinecone", limiter)])
+    return LimitedIndex(clients.get("pinecone").Index(client_config.kb_index), limiter)
+
+
+def _pinecone_kb_ids():
+    """IDs in the Pinecone index; only serverless indexes can list them, otherwise the manifest knows them."""
+    from services.chunk_manifest import ChunkManifest
+    try:
+        return {vector_id for page in clients.get("pinecone_kb_index").list() for vector_id in page}
+    except Exception as e:
+        logger.warning(f"Could not list the Pinecone index, syncing the manifest's chunks: {str(e)}")
+        return ChunkManifest(ingestion_config.manifest_path).all_chunk_ids()
+
+
+def _kb_index():
+    if vector_config.backend == "pinecone":
+        return clients.get("pinecone_kb_index")
+    if vector_config.backend != "local":
+        raise ValueError(f"Unknown vector backend: {vector_config.backend}")
+    from services.local_index import LocalVectorIndex, start_background_sync
+    from utils.metrics import export_stats
+    index = LocalVectorIndex(vector_config.path)
+    export_stats([("vector_index", "local", index)])
+    if vector_config.sync_from_pinecone:
+        start_background_sync(index, lambda: clients.get("pinecone_kb_index"), _pinecone_kb_ids)
+    return index
+
+
+def _kb_store():
+    from langchain_pinecone import PineconeVectorStore
+    return PineconeVectorStore(index=clients.get("kb_index"), embedding=clients.get("embeddings"))
+
+
+def _lexical_index():
+    import threading
+    from services.chunk_manifest import ChunkManifest
+    from services.lexical_index import LexicalIndex
+    lexical = LexicalIndex(retrieval_config.lexical_index_path)
+    if retrieval_config.backfill:
+        def backfill():
+            try:
+                lexical.backfill(clients.get("kb_index"), ChunkManifest(ingestion_config.manifest_path).all_chunk_ids())
+            except Exception as e:
+                logger.error(f"Error backfilling the lexical index: {str(e)}")
+        threading.Thread(target=backfill, name="lexical-backfill", daemon=True).start()
+    return lexical
+
+
+def _kb_retriever():
+    from services.hybrid_retriever import HybridRetriever, create_reranker
+    from utils.metrics import export_stats
+    if retrieval_config.hybrid_enabled:
+        retriever = HybridRetriever(clients.get("lexical_index"), create_reranker())
+    else:
+        retriever = HybridRetriever()
+    export_stats([("retrieval", "knowledge_base", retriever)])
+    return retriever
+
+
+def _checkpointer():
+    from utils.checkpoint import create_checkpointer
+    from utils.metrics import export_stats
+    checkpointer = create_checkpointer()
+    export_stats([("checkpoint", "sessions", checkpointer)])
+    return checkpointer
+
+
+clients = ClientRegistry()
+# One pooled, rate-limited transport per upstream, shared by every client of that upstream
+clients.register("openai_http", lambda: _limited_http_client(
+    "openai", transport_config.openai_max_concurrency, transport_config.openai_rpm, transport_config.openai_tpm))
+clients.register("embeddings_http", lambda: _limited_http_client(
+    "openai_embeddings", transport_config.embeddings_max_concurrency,
+    transport_config.embeddings_rpm, transport_config.embeddings_tpm))
+clients.register("google_http", lambda: _limited_http_client(
+    "google", transport_config.google_max_concurrency, timeout=30))
+# Supervisor and expert chat model; GraphService binds the tools to the same client
+clients.register("chat_model", _chat_model)
+# Small tier tried first, and the policy deciding when to escalate to the chat model above
+clients.register("small_chat_model", _small_chat_model)
+clients.register("model_tiers", _model_tiers)
+# Uncached embeddings used for documents, shared by the cached query embeddings below
+clients.register("openai_embeddings", _openai_embeddings)
+clients.register("embeddings", _query_embeddings)
+clients.register("pinecone", _pinecone)
+# Knowledge base index searched by the expert tools and written by uploads; Pinecone or local per VECTOR_BACKEND
+clients.register("pinecone_kb_index", _pinecone_kb_index)
+clients.register("kb_index", _kb_index)
+clients.register("kb_store", _kb_store)
+# Keyword index of the same chunks, and the retriever fusing both searches
+clients.register("lexical_index", _lexical_index)
+clients.register("kb_retriever", _kb_retriever)
+# Session state of the chat graph, shared by the workers through its store
+clients.register("checkpointer", _checkpointer)
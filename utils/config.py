@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 load_dotenv()
 
@@ -29,3 +29,272 @@ class GoogleConfig:
 azure_config = AzureConfig()
 pinecone_config = PineconeConfig()
 google_config = GoogleConfig()
+
+
+@dataclass
+class GraphConfig:
+    # Upper bound on tool calls executed concurrently within a single request
+    max_tool_concurrency: int = int(os.getenv("MAX_TOOL_CONCURRENCY", "4"))
+    # Time budget of a chat request in seconds, covering every model and tool call; 0 disables it
+    request_timeout: float = float(os.getenv("REQUEST_TIMEOUT", "30"))
+    # Longest a single tool call may run, within what is left of the request's budget; 0 disables it
+    tool_timeout: float = float(os.getenv("TOOL_TIMEOUT", "20"))
+    # Seconds of the request's budget kept back from tools for assembling the answer
+    deadline_reserve: float = float(os.getenv("DEADLINE_RESERVE", "0.5"))
+    # Maximum graph steps per request
+    recursion_limit: int = int(os.getenv("GRAPH_RECURSION_LIMIT", "10"))
+
+
+graph_config = GraphConfig()
+
+
+@dataclass
+class EmbeddingCacheConfig:
+    # Query embedding cache: LRU size, entry lifetime in seconds, optional SQLite file for a disk tier
+    max_entries: int = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+    ttl: float = float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))
+    disk_path: str = os.getenv("EMBEDDING_CACHE_PATH", "")
+
+
+embedding_cache_config = EmbeddingCacheConfig()
+
+
+@dataclass
+class ResponseCacheConfig:
+    # Semantic cache of final answers, off unless enabled
+    enabled: bool = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+    threshold: float = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+    ttl: float = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+    max_entries: int = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+
+
+response_cache_config = ResponseCacheConfig()
+
+
+def _parse_ttls(value: str) -> dict:
+    """Parses "tool=seconds,tool=seconds" into a dict."""
+    ttls = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, seconds = item.partition("=")
+        ttls[name.strip()] = float(seconds)
+    return ttls
+
+
+@dataclass
+class ToolCacheConfig:
+    # Tool results are cached per (tool, query); web results change slower than we re-ask
+    default_ttl: float = float(os.getenv("TOOL_CACHE_TTL", "300"))
+    ttls: dict = field(default_factory=lambda: _parse_ttls(os.getenv("TOOL_CACHE_TTLS", "search_google=3600")))
+    max_entries: int = int(os.getenv("TOOL_CACHE_SIZE", "2000"))
+
+
+tool_cache_config = ToolCacheConfig()
+
+
+@dataclass
+class PreRouterConfig:
+    # Local router in front of the supervisor, off unless enabled; thresholds are cosine similarities
+    enabled: bool = os.getenv("PRE_ROUTER_ENABLED", "false").lower() == "true"
+    min_score: float = float(os.getenv("PRE_ROUTER_MIN_SCORE", "0.86"))
+    min_margin: float = float(os.getenv("PRE_ROUTER_MIN_MARGIN", "0.03"))
+    examples_path: str = os.getenv("PRE_ROUTER_EXAMPLES_PATH", "")
+
+
+pre_router_config = PreRouterConfig()
+
+
+@dataclass
+class SpeculationConfig:
+    # Retrieval for the raw query started alongside the supervisor call, off unless enabled
+    enabled: bool = os.getenv("SPECULATIVE_RETRIEVAL_ENABLED", "false").lower() == "true"
+    include_google: bool = os.getenv("SPECULATIVE_GOOGLE_SEARCH", "false").lower() == "true"
+    # Cosine similarity above which a rephrased tool query still reuses the speculative result
+    match_threshold: float = float(os.getenv("SPECULATION_MATCH_THRESHOLD", "0.97"))
+
+
+speculation_config = SpeculationConfig()
+
+
+@dataclass
+class IngestionConfig:
+    chunk_size: int = int(os.getenv("INGEST_CHUNK_SIZE", "768"))
+    # Embedding requests are packed up to this many tokens / inputs
+    embed_batch_tokens: int = int(os.getenv("EMBED_BATCH_TOKENS", "50000"))
+    embed_batch_size: int = int(os.getenv("EMBED_BATCH_SIZE", "512"))
+    embed_concurrency: int = int(os.getenv("EMBED_CONCURRENCY", "4"))
+    upsert_batch_size: int = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+    upsert_concurrency: int = int(os.getenv("UPSERT_CONCURRENCY", "8"))
+    # Pages parsed per step and chunks allowed between parsing and a finished upsert; bounds memory per upload
+    page_window: int = int(os.getenv("INGEST_PAGE_WINDOW", "8"))
+    max_inflight_chunks: int = int(os.getenv("INGEST_MAX_INFLIGHT_CHUNKS", "2048"))
+    delete_batch_size: int = int(os.getenv("DELETE_BATCH_SIZE", "1000"))
+    # SQLite record of the chunks already embedded, used to skip unchanged chunks
+    manifest_path: str = os.getenv("INGEST_MANIFEST_PATH", "ingestion_manifest.db")
+    # Background ingestion: worker threads, finished jobs kept for polling, PDF parsing processes (0 = threads)
+    job_workers: int = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+    job_history: int = int(os.getenv("INGEST_JOB_HISTORY", "200"))
+    parse_processes: int = int(os.getenv("INGEST_PARSE_PROCESSES", "0"))
+
+
+ingestion_config = IngestionConfig()
+
+
+@dataclass
+class ClientConfig:
+    # Upstream clients are created on first use; warm-up creates them when the app starts instead
+    warm_up: bool = os.getenv("CLIENT_WARMUP", "false").lower() == "true"
+    agent_model: str = os.getenv("AGENT_MODEL", "gpt-4o")
+    # Small, fast tier used first when model tiering is enabled
+    small_agent_model: str = os.getenv("SMALL_AGENT_MODEL", "gpt-4o-mini")
+    embedding_model: str = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+    kb_index: str = os.getenv("PINECONE_KB_INDEX", "kb")
+
+
+client_config = ClientConfig()
+
+
+@dataclass
+class TransportConfig:
+    # Shared keep-alive connection pool per upstream
+    max_connections: int = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+    max_keepalive_connections: int = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+    keepalive_expiry: float = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+    # Requests in flight per upstream; excess requests queue
+    openai_max_concurrency: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+    embeddings_max_concurrency: int = int(os.getenv("EMBEDDINGS_MAX_CONCURRENCY", "8"))
+    pinecone_max_concurrency: int = int(os.getenv("PINECONE_MAX_CONCURRENCY", "16"))
+    google_max_concurrency: int = int(os.getenv("GOOGLE_MAX_CONCURRENCY", "8"))
+    # Quotas per minute; 0 disables the bucket
+    openai_rpm: float = float(os.getenv("OPENAI_RPM", "0"))
+    openai_tpm: float = float(os.getenv("OPENAI_TPM", "0"))
+    embeddings_rpm: float = float(os.getenv("EMBEDDINGS_RPM", "0"))
+    embeddings_tpm: float = float(os.getenv("EMBEDDINGS_TPM", "0"))
+    # Pause after a throttled response without Retry-After, and how often queued requests re-check capacity
+    throttle_pause: float = float(os.getenv("UPSTREAM_THROTTLE_PAUSE", "1.0"))
+    queue_poll_interval: float = float(os.getenv("UPSTREAM_QUEUE_POLL_INTERVAL", "0.5"))
+
+
+transport_config = TransportConfig()
+
+
+@dataclass
+class MemoryConfig:
+    # Recent turns kept verbatim per session; older turns are folded into a rolling summary
+    session_tokens: int = int(os.getenv("MEMORY_SESSION_TOKENS", "2000"))
+    summary_tokens: int = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+    # Idle sessions are evicted least recently used first beyond these bounds
+    max_sessions: int = int(os.getenv("MEMORY_MAX_SESSIONS", "10000"))
+    max_total_tokens: int = int(os.getenv("MEMORY_MAX_TOTAL_TOKENS", "5000000"))
+    idle_ttl: float = float(os.getenv("MEMORY_IDLE_TTL", "3600"))
+    summary_workers: int = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+
+
+memory_config = MemoryConfig()
+
+
+@dataclass
+class CheckpointConfig:
+    # Session state store: "sqlite" (one host), "postgres" (several nodes) or "memory" (one process)
+    backend: str = os.getenv("CHECKPOINT_BACKEND", "sqlite")
+    path: str = os.getenv("CHECKPOINT_PATH", "checkpoints.db")
+    url: str = os.getenv("CHECKPOINT_URL", "")
+    pool_size: int = int(os.getenv("CHECKPOINT_POOL_SIZE", "10"))
+    # Message lists are stored as deltas, with a full copy every this many checkpoints
+    keyframe_interval: int = int(os.getenv("CHECKPOINT_KEYFRAME_INTERVAL", "16"))
+    max_recent_threads: int = int(os.getenv("CHECKPOINT_MAX_RECENT_THREADS", "10000"))
+    # Most recent session history sent to the supervisor
+    history_tokens: int = int(os.getenv("SESSION_HISTORY_TOKENS", "4000"))
+
+
+checkpoint_config = CheckpointConfig()
+
+
+@dataclass
+class RetrievalConfig:
+    # Knowledge base search fusing vector and BM25 keyword results, then reranking them
+    hybrid_enabled: bool = os.getenv("HYBRID_RETRIEVAL_ENABLED", "true").lower() == "true"
+    lexical_index_path: str = os.getenv("LEXICAL_INDEX_PATH", "lexical_index.db")
+    # Index chunks uploaded before the keyword index existed, reading their text from the vector index
+    backfill: bool = os.getenv("LEXICAL_BACKFILL", "true").lower() == "true"
+    # Results taken from each search, and fused candidates rescored by the reranker
+    candidates: int = int(os.getenv("RETRIEVAL_CANDIDATES", "20"))
+    rerank_candidates: int = int(os.getenv("RERANK_CANDIDATES", "10"))
+    rrf_k: int = int(os.getenv("RRF_K", "60"))
+    # Optional sentence-transformers cross-encoder; the lexical reranker is used when empty
+    rerank_model: str = os.getenv("RERANK_MODEL", "")
+
+
+retrieval_config = RetrievalConfig()
+
+
+@dataclass
+class VectorConfig:
+    # Knowledge base vector index: "pinecone", or "local" for an in-process index persisted to a SQLite file
+    backend: str = os.getenv("VECTOR_BACKEND", "pinecone")
+    path: str = os.getenv("LOCAL_VECTOR_INDEX_PATH", "kb_vectors.db")
+    # How often a worker picks up vectors written by other workers
+    refresh_interval: float = float(os.getenv("LOCAL_VECTOR_REFRESH_INTERVAL", "1.0"))
+    # Copy Pinecone's vectors into the local index in the background, once (interval 0) or periodically
+    sync_from_pinecone: bool = os.getenv("VECTOR_SYNC_FROM_PINECONE", "false").lower() == "true"
+    sync_interval: float = float(os.getenv("VECTOR_SYNC_INTERVAL", "0"))
+    sync_prune: bool = os.getenv("VECTOR_SYNC_PRUNE", "false").lower() == "true"
+
+
+vector_config = VectorConfig()
+
+
+@dataclass
+class ServerConfig:
+    # ASGI serving (asgi.py): worker processes, each with one event loop shared by all its requests
+    host: str = os.getenv("HOST", "0.0.0.0")
+    port: int = int(os.getenv("PORT", "8000"))
+    workers: int = int(os.getenv("WEB_CONCURRENCY", "1"))
+    # Threads per worker for the routes still served through Flask (uploads, job status, metrics)
+    wsgi_threads: int = int(os.getenv("WSGI_THREADS", "16"))
+
+
+server_config = ServerConfig()
+
+
+@dataclass
+class BatchConfig:
+    # /api/chat/batch: largest accepted batch and how many of its distinct queries run at once
+    max_items: int = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+    concurrency: int = int(os.getenv("BATCH_CONCURRENCY", "8"))
+    # Query embeddings requested within this many seconds of each other share one embeddings call
+    embedding_window: float = float(os.getenv("BATCH_EMBEDDING_WINDOW", "0.01"))
+    embedding_batch_size: int = int(os.getenv("BATCH_EMBEDDING_SIZE", "256"))
+
+
+batch_config = BatchConfig()
+
+
+@dataclass
+class ModelTierConfig:
+    # Supervisor and expert calls start on SMALL_AGENT_MODEL and escalate to AGENT_MODEL when needed
+    enabled: bool = os.getenv("MODEL_TIERING_ENABLED", "false").lower() == "true"
+    # Queries longer than this, asking more questions than this or using a complex term go straight to the large model
+    max_query_tokens: int = int(os.getenv("MODEL_TIER_MAX_QUERY_TOKENS", "60"))
+    max_questions: int = int(os.getenv("MODEL_TIER_MAX_QUESTIONS", "1"))
+    complex_terms: frozenset = frozenset(filter(None, os.getenv(
+        "MODEL_TIER_COMPLEX_TERMS",
+        "analyze,analyse,compare,contrast,evaluate,tradeoff,tradeoffs,pros,cons,strategy,recommend,justify,derive",
+    ).lower().replace(" ", "").split(",")))
+    # Knowledge base answers go to the large model when the context covers less of the query than this (0-1)
+    min_retrieval_score: float = float(os.getenv("MODEL_TIER_MIN_RETRIEVAL_SCORE", "0.3"))
+    # Small model answers whose mean token log probability is below this are redone by the large model
+    min_logprob: float = float(os.getenv("MODEL_TIER_MIN_LOGPROB", "-1.0"))
+
+
+model_tier_config = ModelTierConfig()
+
+
+@dataclass
+class PromptBudgetConfig:
+    # Expert answers from earlier turns are compressed and cut to this many tokens in the supervisor prompt
+    tool_output_tokens: int = int(os.getenv("PROMPT_TOOL_OUTPUT_TOKENS", "400"))
+    # Retrieved knowledge base context passed to an expert, in tokens
+    context_tokens: int = int(os.getenv("PROMPT_CONTEXT_TOKENS", "1000"))
+
+
+prompt_budget_config = PromptBudgetConfig()
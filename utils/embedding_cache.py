@@ -0,0 +1,304 @@
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Set
+
+from langchain_core.embeddings import Embeddings
+
+from utils.config import batch_config, embedding_cache_config
+from utils.metrics import embedding_tokens, record_cost, track_upstream
+from utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sweeps of expired rows from the disk tier
+DISK_PRUNE_INTERVAL = 600.0
+
+
+def normalize_text(text: str) -> str:
+    """Collapses whitespace and case so trivially different phrasings share a cache entry."""
+    return " ".join(text.split()).lower()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that caches query embeddings.
+
+    Entries live in an in-process LRU bounded by size and TTL, optionally backed by a
+    SQLite file so they survive restarts and are shared by workers on the same host.
+    The async methods do their disk I/O in worker threads, and expired rows are
+    swept from the file every DISK_PRUNE_INTERVAL seconds.
+    Document embeddings pass straight through; ingestion deduplicates those itself.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, max_entries: int = embedding_cache_config.max_entries,
+                 ttl: float = embedding_cache_config.ttl, disk_path: Optional[str] = embedding_cache_config.disk_path):
+        self.underlying = underlying
+        self.model = model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_path = disk_path or None
+        self._entries: "OrderedDict[str, tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bulk_calls = 0
+        self.bulk_texts = 0
+        self._pruned_at = 0.0
+        if self.disk_path:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+                    "expires_at REAL NOT NULL)"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self.disk_path)
+
+    def _key(self, text: str) -> str:
+        # Only whitespace is collapsed: differently cased texts embed differently
+        return hashlib.sha256(f"{self.model}\x00{' '.join(text.split())}".encode("utf-8")).hexdigest()
+
+    def _get_memory(self, key: str) -> Optional[List[float]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+        return None
+
+    def _get_disk(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Reads unexpired vectors from the disk tier into memory; blocking, so async callers run it in a thread."""
+        try:
+            with closing(self._connect()) as conn:
+                now = time.time()
+                rows = [conn.execute(
+                    "SELECT key, vector, expires_at FROM embeddings WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone() for key in keys]
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache disk read failed: {str(e)}")
+            return {}
+        found = {}
+        for row in filter(None, rows):
+            found[row[0]] = array("d", row[1]).tolist()
+            self._remember(row[0], found[row[0]], row[2])
+        with self._lock:
+            self.disk_hits += len(found)
+        return found
+
+    def _count_misses(self, count: int) -> None:
+        with self._lock:
+            self.misses += count
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        vector = self._get_memory(key)
+        if vector is None and self.disk_path:
+            vector = self._get_disk([key]).get(key)
+        if vector is None:
+            self._count_misses(1)
+        return vector
+
+    async def _aget_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors for keys, None where missing; the disk tier is read off the event loop."""
+        vectors = [self._get_memory(key) for key in keys]
+        missing = [key for key, vector in zip(keys, vectors) if vector is None]
+        if missing and self.disk_path:
+            found = await asyncio.to_thread(self._get_disk, missing)
+            vectors = [vector if vector is not None else found.get(key) for key, vector in zip(keys, vectors)]
+        self._count_misses(sum(vector is None for vector in vectors))
+        return vectors
+
+    def _remember(self, key: str, vector: List[float], expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _put(self, items: Dict[str, List[float]]) -> None:
+        """Remembers vectors by key in memory; the disk tier is written separately."""
+        expires_at = time.time() + self.ttl
+        for key, vector in items.items():
+            self._remember(key, vector, expires_at)
+
+    def _write_disk(self, items: Dict[str, List[float]]) -> None:
+        """Writes vectors to the disk tier, pruning expired rows now and then; blocking."""
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, expires_at) VALUES (?, ?, ?)",
+                    [(key, array("d", vector).tobytes(), now + self.ttl) for key, vector in items.items()],
+                )
+                with self._lock:
+                    prune = now - self._pruned_at >= DISK_PRUNE_INTERVAL
+                    if prune:
+                        self._pruned_at = now
+                if prune:
+                    conn.execute("DELETE FROM embeddings WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache disk write failed: {str(e)}")
+
+    async def _aput(self, items: Dict[str, List[float]]) -> None:
+        self._put(items)
+        if self.disk_path:
+            await asyncio.to_thread(self._write_disk, items)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        async with track_upstream("openai", "embed_documents"):
+            vectors = await self.underlying.aembed_documents(texts)
+        self._record_tokens(texts)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self._put({key: vector})
+            if self.disk_path:
+                self._write_disk({key: vector})
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = (await self._aget_many([key]))[0]
+        if vector is None:
+            batcher = _query_batcher.get()
+            if batcher is not None and batcher.embeddings is self:
+                return await batcher.embed(text)
+            async with track_upstream("openai", "embed_query"):
+                vector = await self.underlying.aembed_query(text)
+            self._record_tokens([text])
+            await self._aput({key: vector})
+        return vector
+
+    async def aembed_queries(self, texts: List[str],
+                             batch_size: int = batch_config.embedding_batch_size) -> List[List[float]]:
+        """Query embeddings of many texts, fetching the uncached ones with as few calls as possible."""
+        keys = [self._key(text) for text in texts]
+        vectors = await self._aget_many(keys)
+        missing: Dict[str, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing.setdefault(key, text)
+        fetched: Dict[str, List[float]] = {}
+        uncached = list(missing.values())
+        for start in range(0, len(uncached), batch_size):
+            batch = uncached[start:start + batch_size]
+            fetched.update(zip(map(self._key, batch), await self._fetch(batch)))
+        return [vector if vector is not None else fetched[key] for key, vector in zip(keys, vectors)]
+
+    async def _fetch(self, texts: List[str]) -> List[List[float]]:
+        # OpenAI embeds a query exactly like a single document, so one documents call serves many queries
+        async with track_upstream("openai", "embed_queries"):
+            vectors = await self.underlying.aembed_documents(texts)
+        self._record_tokens(texts)
+        with self._lock:
+            self.bulk_calls += 1
+            self.bulk_texts += len(texts)
+        await self._aput(dict(zip(map(self._key, texts), vectors)))
+        return vectors
+
+    @contextmanager
+    def batching(self, window: float = batch_config.embedding_window,
+                 max_size: int = batch_config.embedding_batch_size):
+        """
+        Groups the query embedding misses of tasks created inside the block into bulk calls.
+
+        Tasks copy the context when they are created, so they keep batching after the
+        block ends.
+        """
+        token = _query_batcher.set(QueryEmbeddingBatcher(self, window, max_size))
+        try:
+            yield
+        finally:
+            _query_batcher.reset(token)
+
+    def _record_tokens(self, texts: List[str]) -> None:
+        tokens = sum(count_tokens(text) for text in texts)
+        embedding_tokens.inc(tokens, model=self.model)
+        record_cost(self.model, tokens)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters; disk hits count as hits in the hit rate."""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "bulk_calls": self.bulk_calls,
+                "bulk_texts": self.bulk_texts,
+            }
+
+
+class QueryEmbeddingBatcher:
+    """
+    Sends the query embeddings requested at about the same time in one call.
+
+    A text waits at most ``window`` seconds for others to join it, and a group is
+    sent as soon as it holds ``max_size`` distinct texts.
+    """
+
+    def __init__(self, embeddings: CachedEmbeddings, window: float, max_size: int):
+        self.embeddings = embeddings
+        self.window = window
+        self.max_size = max_size
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+
+    async def embed(self, text: str) -> List[float]:
+        future = self._pending.get(text)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[text] = loop.create_future()
+            if len(self._pending) >= self.max_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        # Shielded so a cancelled caller doesn't fail the others waiting for the same group
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        task = asyncio.ensure_future(self._send(pending))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, pending: Dict[str, asyncio.Future]) -> None:
+        try:
+            vectors = await self.embeddings._fetch(list(pending))
+        except Exception as e:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, vector in zip(pending.values(), vectors):
+            if not future.done():
+                future.set_result(vector)
+
+
+# Set by CachedEmbeddings.batching for the tasks of a batch
+_query_batcher: ContextVar[Optional[QueryEmbeddingBatcher]] = ContextVar("query_embedding_batcher", default=None)
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Dict
+
+from utils.config import ingestion_config
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reads of the shared versions, bounding how long another worker's re-ingestion goes unnoticed
+REFRESH_SECONDS = 1.0
+
+# When each knowledge base type was last re-ingested; results computed before that are stale
+_kb_updated_at: Dict[str, float] = defaultdict(float)
+_kb_lock = threading.Lock()
+_refreshed_at = 0.0
+
+
+def _connect() -> sqlite3.Connection:
+    # Kept next to the chunk manifest, which every worker on the host already shares
+    conn = sqlite3.connect(ingestion_config.manifest_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS kb_versions (kb_type TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+    return conn
+
+
+def invalidate_kb_type(kb_type: str) -> None:
+    """Marks every cached result that relied on the given knowledge base type as stale, in every worker."""
+    now = time.time()
+    with _kb_lock:
+        _kb_updated_at[kb_type] = now
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO kb_versions (kb_type, updated_at) VALUES (?, ?) "
+                    "ON CONFLICT (kb_type) DO UPDATE SET updated_at = MAX(updated_at, excluded.updated_at)",
+                    (kb_type, now),
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Error sharing the knowledge base version of {kb_type}: {str(e)}")
+    logger.info(f"Invalidated cached results for knowledge base type {kb_type}")
+
+
+def _refresh_due() -> bool:
+    with _kb_lock:
+        return time.monotonic() - _refreshed_at >= REFRESH_SECONDS
+
+
+def refresh_kb_versions() -> None:
+    """Picks up re-ingestions recorded by other workers, at most once per REFRESH_SECONDS; blocking."""
+    global _refreshed_at
+    now = time.monotonic()
+    with _kb_lock:
+        if now - _refreshed_at < REFRESH_SECONDS:
+            return
+        _refreshed_at = now
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute("SELECT kb_type, updated_at FROM kb_versions").fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.error(f"Error reading shared knowledge base versions: {str(e)}")
+        return
+    with _kb_lock:
+        for kb_type, updated_at in rows:
+            _kb_updated_at[kb_type] = max(_kb_updated_at[kb_type], updated_at)
+
+
+async def arefresh_kb_versions() -> None:
+    """``refresh_kb_versions`` off the event loop; only hops to a thread when a refresh is due."""
+    if _refresh_due():
+        await asyncio.to_thread(refresh_kb_versions)
+
+
+def kb_changed_since(kb_type: str, timestamp: float) -> bool:
+    """
+    Whether the knowledge base type was re-ingested after the given time, as far as this worker knows.
+
+    Only checks memory; call ``arefresh_kb_versions`` first to see other workers' re-ingestions.
+    """
+    with _kb_lock:
+        return _kb_updated_at[kb_type] >= timestamp
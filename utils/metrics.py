@@ -0,0 +1,375 @@
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from utils.config import graph_config
+
+logger = logging.getLogger(__name__)
+
+# How long a callback run may go without ending when requests have no time budget
+STALE_RUN_SECONDS = 600.0
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# USD per 1M tokens (input, output)
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "text-embedding-ada-002": (0.10, 0.0),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, e.g. for latencies in seconds."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label values -> (bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            return self._values[key][2] if key in self._values else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labels, key, ('le', _format_value(bound)))} {bucket_count}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds the process metrics and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        # name -> (help, label name, stats callable per label value)
+        self._collectors: Dict[str, Tuple[str, str, Dict[str, Callable[[], Dict[str, float]]]]] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def register_stats(self, prefix: str, label: str, value: str, stats: Callable[[], Dict[str, float]]) -> None:
+        """
+        Exports a component's ``stats()`` dict as gauges named ``{prefix}_{key}``.
+
+        Args:
+            prefix: Metric name prefix, e.g. ``cache``
+            label: Label distinguishing components under the prefix, e.g. ``cache``
+            value: This component's label value, e.g. ``tool_results``
+            stats: Returns the current numbers; called on every scrape
+        """
+        with self._lock:
+            self._collectors.setdefault(prefix, (f"{prefix} statistics", label, {}))[2][value] = stats
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = [(prefix, label, dict(sources)) for prefix, (_, label, sources) in self._collectors.items()]
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+
+        for prefix, label, sources in collectors:
+            gauges: Dict[str, List[str]] = {}
+            for value, stats in sources.items():
+                try:
+                    current = stats()
+                except Exception as e:
+                    logger.error(f"Error collecting {prefix} stats for {value}: {str(e)}")
+                    continue
+                for key, number in current.items():
+                    gauges.setdefault(f"{prefix}_{key}", []).append(
+                        f"{prefix}_{key}{_format_labels((label,), (value,))} {_format_value(number)}"
+                    )
+            for name, samples in gauges.items():
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+graph_node_seconds = registry.histogram(
+    "graph_node_seconds", "Time spent in each graph node", ["node"])
+tool_seconds = registry.histogram(
+    "tool_seconds", "Tool call latency", ["tool", "status"])
+llm_seconds = registry.histogram(
+    "llm_seconds", "Chat model call latency", ["model", "node", "tier"])
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Tokens used by chat model calls", ["model", "node", "tier", "kind"])
+model_tier_calls = registry.counter(
+    "model_tier_calls_total", "Supervisor and expert model calls by tier and why that tier was used",
+    ["role", "tier", "reason"])
+llm_cost = registry.counter(
+    "llm_cost_usd_total", "Estimated chat model and embedding spend in USD", ["model"])
+prompt_tokens_saved = registry.counter(
+    "prompt_tokens_saved_total", "Prompt tokens removed by the prompt budget", ["kind"])
+request_prompt_tokens_saved = registry.histogram(
+    "request_prompt_tokens_saved", "Prompt tokens removed by the prompt budget per chat request",
+    buckets=(0, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000))
+upstream_seconds = registry.histogram(
+    "upstream_seconds", "Latency of calls to upstream services", ["upstream", "operation"])
+upstream_errors = registry.counter(
+    "upstream_errors_total", "Failed calls to upstream services", ["upstream", "operation"])
+upstream_retries = registry.counter(
+    "upstream_retries_total", "Requests retried by the upstream client libraries", ["upstream"])
+upstream_queue_seconds = registry.histogram(
+    "upstream_queue_seconds", "Time requests waited for an upstream slot or rate limit budget", ["upstream"])
+embedding_tokens = registry.counter(
+    "embedding_tokens_total", "Tokens sent to the embeddings API", ["model"])
+ingestion_stage_seconds = registry.histogram(
+    "ingestion_stage_seconds", "Time spent in each upload pipeline stage", ["stage"])
+ingestion_items = registry.counter(
+    "ingestion_items_total", "Pages, chunks and vectors handled by the upload pipeline", ["kind"])
+
+
+def record_cost(model: str, input_tokens: int, output_tokens: int = 0) -> None:
+    prices = MODEL_PRICES.get(model)
+    if prices:
+        llm_cost.inc((input_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000, model=model)
+
+
+@asynccontextmanager
+async def track_upstream(upstream: str, operation: str):
+    """Times an upstream call and counts it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        upstream_errors.inc(upstream=upstream, operation=operation)
+        raise
+    finally:
+        upstream_seconds.observe(time.perf_counter() - started, upstream=upstream, operation=operation)
+
+
+class MetricsCallbackHandler(AsyncCallbackHandler):
+    """
+    Records graph node, tool and chat model latency plus token usage from LangChain callbacks.
+
+    Passed in the graph's run config, so it also sees the expert model calls made
+    inside tools. Node names come from the ``langgraph_node`` run metadata and model
+    tiers from ``model_tier``.
+    """
+
+    def __init__(self, max_run_age: float = graph_config.request_timeout or STALE_RUN_SECONDS):
+        """
+        Args:
+            max_run_age: Seconds after which a run that never reported its end is forgotten
+        """
+        self.max_run_age = max_run_age
+        # run_id -> (started, name, node, model tier)
+        self._runs: Dict[UUID, Tuple[float, str, str, str]] = {}
+        self._lock = threading.Lock()
+        self._pruned_at = time.perf_counter()
+
+    def _start(self, run_id: UUID, name: str, metadata: Optional[Dict[str, Any]]) -> None:
+        metadata = metadata or {}
+        now = time.perf_counter()
+        with self._lock:
+            self._runs[run_id] = (now, name, metadata.get("langgraph_node", ""), metadata.get("model_tier", ""))
+            if now - self._pruned_at >= self.max_run_age:
+                self._prune(now)
+
+    def _prune(self, now: float) -> None:
+        """Drops runs cancelled without an end or error callback, e.g. tools stopped at a request's deadline."""
+        self._pruned_at = now
+        for run_id in [run_id for run_id, run in self._runs.items() if now - run[0] > self.max_run_age]:
+            del self._runs[run_id]
+
+    def _finish(self, run_id: UUID) -> Optional[Tuple[float, str, str, str]]:
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        return (time.perf_counter() - run[0], *run[1:]) if run else None
+
+    async def on_chain_start(self, serialized, inputs, *, run_id: UUID, metadata=None, name=None, **kwargs) -> None:
+        # Node runs are the chains named after the node they execute
+        node = (metadata or {}).get("langgraph_node")
+        if node and not node.startswith("__") and (name or (serialized or {}).get("name")) == node:
+            self._start(run_id, node, metadata)
+
+    async def on_chain_end(self, outputs, *, run_id: UUID, **kwargs) -> None:
+        run = self._finish(run_id)
+        if run:
+            graph_node_seconds.observe(run[0], node=run[1])
+
+    async def on_chain_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        await self.on_chain_end(None, run_id=run_id)
+
+    async def on_tool_start(self, serialized, input_str, *, run_id: UUID, metadata=None, name=None, **kwargs) -> None:
+        self._start(run_id, name or (serialized or {}).get("name", ""), metadata)
+
+    async def on_tool_end(self, output, *, run_id: UUID, **kwargs) -> None:
+        run = self._finish(run_id)
+        if run:
+            tool_seconds.observe(run[0], tool=run[1], status="ok")
+
+    async def on_tool_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        run = self._finish(run_id)
+        if run:
+            tool_seconds.observe(run[0], tool=run[1], status="error")
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs) -> None:
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model_name") or params.get("model") or (metadata or {}).get("ls_model_name", "")
+        self._start(run_id, model, metadata)
+
+    async def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        run = self._finish(run_id)
+        if not run:
+            return
+        elapsed, model, node, tier = run
+        llm_seconds.observe(elapsed, model=model, node=node, tier=tier)
+        input_tokens, output_tokens = _token_usage(response)
+        llm_tokens.inc(input_tokens, model=model, node=node, tier=tier, kind="prompt")
+        llm_tokens.inc(output_tokens, model=model, node=node, tier=tier, kind="completion")
+        # Prompt tokens the provider served from its prompt cache; already included in "prompt"
+        llm_tokens.inc(_cached_tokens(response), model=model, node=node, tier=tier, kind="cached_prompt")
+        record_cost(model, input_tokens, output_tokens)
+
+    async def on_llm_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        run = self._finish(run_id)
+        if run:
+            llm_seconds.observe(run[0], model=run[1], node=run[2], tier=run[3])
+        upstream_errors.inc(upstream="openai", operation="chat")
+
+
+def _token_usage(response) -> Tuple[int, int]:
+    """Prompt and completion tokens of an LLMResult, from message usage metadata or the provider output."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+def _cached_tokens(response) -> int:
+    """Prompt tokens of an LLMResult read from the provider's prompt cache, when it reports them."""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return (usage.get("input_token_details") or {}).get("cache_read", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+
+class _RetryLogHandler(logging.Handler):
+    """Counts the retries the OpenAI client logs; it retries 429s and 5xx internally."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # The message may be any object; the client's retry message is a format string
+        if isinstance(record.msg, str) and record.msg.startswith("Retrying request"):
+            upstream_retries.inc(upstream="openai")
+
+
+logging.getLogger("openai._base_client").addHandler(_RetryLogHandler())
+
+
+def export_stats(components: Iterable[Tuple[str, str, Any]]) -> None:
+    """Registers ``(prefix, name, component)`` triples whose ``stats()`` should be scraped."""
+    for prefix, name, component in components:
+        if component is not None:
+            registry.register_stats(prefix, prefix, name, component.stats)
@@ -0,0 +1,81 @@
+import re
+from typing import List, Sequence
+
+from langchain_core.messages import BaseMessage, ToolMessage
+
+from utils.config import prompt_budget_config
+from utils.metrics import prompt_tokens_saved
+from utils.request_context import get_request_context
+from utils.tokens import count_tokens, truncate_tokens
+
+TRUNCATION_MARK = " [...]"
+
+
+def compress_text(text: str) -> str:
+    """Drops blank runs, repeated lines and padding whitespace, which cost tokens but carry nothing."""
+    lines, seen = [], set()
+    for line in text.splitlines():
+        line = re.sub(r"[ \t]+", " ", line).strip()
+        if line and line in seen and len(line) > 20:
+            continue
+        if line or (lines and lines[-1]):
+            lines.append(line)
+        seen.add(line)
+    return "\n".join(lines).strip()
+
+
+def fit_text(text: str, max_tokens: int, kind: str) -> str:
+    """
+    Compresses text and cuts it to ``max_tokens`` tokens, at a sentence or word boundary when possible.
+
+    The tokens removed are counted under ``kind`` and for the current request.
+    """
+    before = count_tokens(text)
+    fitted = compress_text(text)
+    if count_tokens(fitted) > max_tokens:
+        fitted = truncate_tokens(fitted, max(max_tokens - count_tokens(TRUNCATION_MARK), 0))
+        boundary = max(fitted.rfind(". "), fitted.rfind("\n"))
+        if boundary < len(fitted) // 2:
+            boundary = fitted.rfind(" ")
+        fitted = (fitted[:boundary + 1] if boundary > 0 else fitted).rstrip() + TRUNCATION_MARK
+    record_saved(kind, before - count_tokens(fitted))
+    return fitted
+
+
+def record_saved(kind: str, tokens: int) -> None:
+    if tokens <= 0:
+        return
+    prompt_tokens_saved.inc(tokens, kind=kind)
+    context = get_request_context()
+    if context is not None:
+        context.tokens_saved += tokens
+
+
+def budget_tool_outputs(messages: Sequence[BaseMessage],
+                        max_tokens: int = prompt_budget_config.tool_output_tokens) -> List[BaseMessage]:
+    """The messages with every tool output compressed and capped, for resending them in a prompt."""
+    budgeted = []
+    for message in messages:
+        if isinstance(message, ToolMessage) and isinstance(message.content, str):
+            content = fit_text(message.content, max_tokens, "tool_output")
+            if content != message.content:
+                message = message.model_copy(update={"content": content})
+        budgeted.append(message)
+    return budgeted
+
+
+def budget_context(documents: Sequence[str], max_tokens: int = prompt_budget_config.context_tokens) -> List[str]:
+    """
+    Retrieved documents, best first, compressed and cut to share ``max_tokens`` tokens.
+
+    Documents that no longer fit once the budget is spent are dropped.
+    """
+    fitted, remaining = [], max_tokens
+    for i, document in enumerate(documents):
+        if remaining <= 0:
+            record_saved("context", sum(count_tokens(rest) for rest in documents[i:]))
+            break
+        text = fit_text(document, remaining, "context")
+        fitted.append(text)
+        remaining -= count_tokens(text)
+    return fitted
@@ -0,0 +1,88 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, List, Optional, Tuple, TypeVar
+
+from utils.config import graph_config
+
+
+@dataclass
+class RequestContext:
+    """Per-request state shared by the graph nodes and the tools they run."""
+    tool_semaphore: asyncio.Semaphore = field(
+        default_factory=lambda: asyncio.Semaphore(graph_config.max_tool_concurrency)
+    )
+    # utils.speculation.Speculation when speculative retrieval is enabled
+    speculation: Optional[Any] = None
+    # Prompt tokens removed by the prompt budget while answering
+    tokens_saved: int = 0
+    # time.monotonic() by which the answer is due; None for no deadline
+    deadline: Optional[float] = None
+    # (tool, output) of every tool call that finished, for assembling a partial answer
+    tool_outputs: List[Tuple[str, str]] = field(default_factory=list)
+    # Tools stopped because their time ran out
+    timed_out: List[str] = field(default_factory=list)
+    # Tools whose call failed; their error text is not worth caching in an answer
+    tool_errors: List[str] = field(default_factory=list)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, or None without one."""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+
+_request_context: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+
+def get_request_context() -> Optional[RequestContext]:
+    """Returns the context of the request being processed, if any."""
+    return _request_context.get()
+
+
+def set_request_context(context: RequestContext):
+    """
+    Binds a context to the current task.
+
+    Tasks spawned afterwards (graph nodes, tool calls) inherit it. Returns the token
+    needed to restore the previous context.
+    """
+    return _request_context.set(context)
+
+
+def reset_request_context(token) -> None:
+    _request_context.reset(token)
+
+
+@asynccontextmanager
+async def tool_slot():
+    """Limits how many tool calls of the current request run at the same time."""
+    context = get_request_context()
+    if context is None:
+        yield
+        return
+    async with context.tool_semaphore:
+        yield
+
+
+def request_deadline(timeout: Optional[float] = None) -> Optional[float]:
+    """The deadline of a request starting now: ``timeout`` seconds from now, capped by REQUEST_TIMEOUT."""
+    limits = [limit for limit in (timeout, graph_config.request_timeout) if limit]
+    return time.monotonic() + min(limits) if limits else None
+
+
+T = TypeVar("T")
+
+
+async def within_deadline(awaitable: Awaitable[T], timeout: Optional[float] = None, reserve: float = 0.0) -> T:
+    """
+    Awaits for at most ``timeout`` seconds and no later than ``reserve`` seconds before the request's deadline.
+
+    Raises asyncio.TimeoutError, after cancelling the awaitable, when the time runs out.
+    """
+    context = get_request_context()
+    remaining = context.remaining() if context else None
+    limits = [limit for limit in (timeout, None if remaining is None else remaining - reserve) if limit is not None]
+    if not limits:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, max(min(limits), 0))
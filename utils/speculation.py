@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from utils.config import speculation_config
+from utils.embedding_cache import normalize_text
+from utils.request_context import get_request_context
+
+logger = logging.getLogger(__name__)
+
+SpeculationKey = Tuple[str, str]
+
+
+class Speculator:
+    """
+    Starts retrieval for the raw user query while the supervisor LLM is still deciding.
+
+    ``retrievals`` maps a query to the retrievals worth starting, keyed by
+    (kind, target), e.g. ("kb", "finance"). Counts how often speculation paid off.
+    """
+
+    def __init__(self, retrievals: Callable[[str], Dict[SpeculationKey, Callable[[], Awaitable[str]]]],
+                 embeddings=None, match_threshold: float = speculation_config.match_threshold):
+        """
+        Args:
+            retrievals: Returns the coroutine factories to run speculatively for a query
+            embeddings: Used to accept a rephrased tool query; without it only exact matches count
+            match_threshold: Minimum cosine similarity between the raw and the tool query
+        """
+        self.retrievals = retrievals
+        self.embeddings = embeddings
+        self.match_threshold = match_threshold
+        self._lock = threading.Lock()
+        self.launched = 0
+        self.used = 0
+        self.wasted = 0
+
+    def _count(self, launched: int = 0, used: int = 0, wasted: int = 0) -> None:
+        with self._lock:
+            self.launched += launched
+            self.used += used
+            self.wasted += wasted
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "launched": self.launched,
+                "used": self.used,
+                "wasted": self.wasted,
+                "hit_rate": self.used / self.launched if self.launched else 0.0,
+            }
+
+
+class Speculation:
+    """Speculative retrievals started for one request."""
+
+    def __init__(self, speculator: Speculator):
+        self.speculator = speculator
+        self.query: Optional[str] = None
+        self._tasks: Dict[SpeculationKey, asyncio.Task] = {}
+
+    def start(self, query: str) -> None:
+        """Starts every speculative retrieval for the raw query; only the first call per request counts."""
+        if self.query is not None:
+            return
+        self.query = query
+        for key, retrieval in self.speculator.retrievals(query).items():
+            self._tasks[key] = asyncio.create_task(retrieval())
+        self.speculator._count(launched=len(self._tasks))
+
+    async def take(self, key: SpeculationKey, query: str) -> Optional[str]:
+        """Returns the speculative result for key if it was computed for a matching query."""
+        if key not in self._tasks or not await self._matches(query):
+            return None
+        # Tools sharing a key can both get here while matching awaits; only one takes the task
+        task = self._tasks.pop(key, None)
+        if task is None:
+            return None
+        try:
+            result = await task
+        except Exception as e:
+            logger.warning(f"Speculative retrieval {key} failed, retrieving again: {str(e)}")
+            self.speculator._count(wasted=1)
+            return None
+        self.speculator._count(used=1)
+        return result
+
+    async def _matches(self, query: str) -> bool:
+        if normalize_text(query) == normalize_text(self.query):
+            return True
+        if self.speculator.embeddings is None or self.speculator.match_threshold >= 1:
+            return False
+        # Both embeddings are cached: the raw query was embedded by the speculative retrieval
+        vectors = np.asarray([
+            await self.speculator.embeddings.aembed_query(self.query),
+            await self.speculator.embeddings.aembed_query(query),
+        ])
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return float(vectors[0] @ vectors[1]) >= self.speculator.match_threshold
+
+    def finish(self) -> None:
+        """Cancels whatever the supervisor did not end up using."""
+        for task in self._tasks.values():
+            if task.done() and not task.cancelled():
+                task.exception()  # retrieved so a failed, unused retrieval isn't reported as unhandled
+            task.cancel()
+        self.speculator._count(wasted=len(self._tasks))
+        self._tasks.clear()
+
+
+async def take_speculative(key: SpeculationKey, query: str) -> Optional[str]:
+    """Returns a matching speculative result started for the current request, if any."""
+    context = get_request_context()
+    if context is None or context.speculation is None:
+        return None
+    return await context.speculation.take(key, query)
@@ -0,0 +1,35 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, Iterator
+
+
+def iterate_async(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """
+    Drives an async iterator from synchronous code.
+
+    Flask (WSGI) can only stream plain generators, so the async iterator is run on
+    a private event loop and every item is handed back as soon as it is produced.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        try:
+            loop.run_until_complete(agen.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            loop.close()
+
+
+def to_ndjson(event: Dict[str, Any]) -> str:
+    """Serializes an event as a single NDJSON line."""
+    return json.dumps(event, default=str) + "\n"
+
+
+def to_sse(event: Dict[str, Any]) -> str:
+    """Serializes an event as a Server-Sent Events frame."""
+    return f"event: {event.get('event', 'message')}\ndata: {json.dumps(event, default=str)}\n\n"
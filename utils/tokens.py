@@ -0,0 +1,36 @@
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Encoding shared by the ada-002 embeddings and the gpt-4 family
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def _encoding(name: str = DEFAULT_ENCODING):
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; offline we fall back to an estimate
+        logger.warning(f"Could not load tiktoken encoding {name}, estimating token counts: {str(e)}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Counts the tokens in text, or estimates ~4 characters per token if tiktoken is unavailable."""
+    encoding = _encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of text within ``max_tokens`` tokens (estimated without tiktoken)."""
+    encoding = _encoding()
+    if encoding is None:
+        return text[:max(max_tokens - 1, 0) * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
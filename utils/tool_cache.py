@@ -0,0 +1,133 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from utils.config import tool_cache_config
+from utils.embedding_cache import normalize_text
+from utils.kb_versions import arefresh_kb_versions, kb_changed_since
+
+logger = logging.getLogger(__name__)
+
+
+class _LeaderCancelled(RuntimeError):
+    """Handed to the callers waiting on a shared call whose leading request was cancelled."""
+
+
+class ToolResultCache:
+    """
+    TTL cache with single-flight coalescing for tool results.
+
+    Results are keyed by tool name and normalized query. While a result is being
+    computed, identical calls wait for that one upstream request instead of sending
+    their own. In-flight calls are tracked with thread-safe futures, so coalescing
+    also works between requests served on different event loops. Only successful
+    results are cached; errors reach every waiting caller and are not remembered.
+    When the request running a shared call is cancelled, for example by its own
+    deadline, a waiting caller takes over and runs the call itself.
+    Results built from a knowledge base are dropped when it is re-ingested.
+    """
+
+    def __init__(self, ttls: Dict[str, float] = tool_cache_config.ttls, default_ttl: float = tool_cache_config.default_ttl,
+                 max_entries: int = tool_cache_config.max_entries):
+        """
+        Args:
+            ttls: Per-tool result lifetime in seconds; 0 disables caching but keeps coalescing
+            default_ttl: Lifetime for tools without their own TTL
+            max_entries: Maximum number of cached results across all tools
+        """
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        # key -> (expires_at, result, started_at, kb_type)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, str, float, Optional[str]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_call(self, tool_name: str, query: str, call: Callable[[], Awaitable[str]],
+                          kb_type: Optional[str] = None) -> str:
+        """
+        Returns the cached result of a tool call, or runs ``call`` once for all identical callers.
+
+        Args:
+            tool_name: Name of the tool, selecting its TTL
+            query: The tool input
+            call: Coroutine factory producing the result
+            kb_type: Knowledge base type the result is built from, if any
+        """
+        key = (tool_name, normalize_text(query))
+        while True:
+            # Other workers' re-ingestions are read off the loop; under the lock the check is in memory
+            await arefresh_kb_versions()
+            started_at = time.time()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > started_at and not (entry[3] and kb_changed_since(entry[3], entry[2])):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    inflight = concurrent.futures.Future()
+                    self._inflight[key] = inflight
+                    leader = True
+                    self.misses += 1
+                else:
+                    leader = False
+                    self.coalesced += 1
+
+            if leader:
+                return await self._lead(key, tool_name, call, inflight, started_at, kb_type)
+            try:
+                # Shielded so a cancelled waiter doesn't cancel the shared call for everyone else
+                return await asyncio.shield(asyncio.wrap_future(inflight))
+            except _LeaderCancelled:
+                # The leading request gave up (deadline, disconnect); this one still wants the result
+                logger.info(f"{tool_name} call was cancelled by its leading request; retrying")
+
+    async def _lead(self, key: Tuple[str, str], tool_name: str, call: Callable[[], Awaitable[str]],
+                    inflight: concurrent.futures.Future, started_at: float, kb_type: Optional[str]) -> str:
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            inflight.set_exception(_LeaderCancelled(f"{tool_name} call was cancelled"))
+            raise
+        except Exception as e:
+            inflight.set_exception(e)
+            raise
+        else:
+            inflight.set_result(result)
+            self._store(key, tool_name, result, started_at, kb_type)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _store(self, key: Tuple[str, str], tool_name: str, result: str, started_at: float,
+               kb_type: Optional[str]) -> None:
+        ttl = self.ttls.get(tool_name, self.default_ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, result, started_at, kb_type)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
@@ -1,43 +1,148 @@
+import asyncio
+from typing import Optional
+
 from langchain_core.tools import tool
-from langchain_google_community import GoogleSearchAPIWrapper
-from langchain_pinecone import PineconeVectorStore
-from pinecone import Pinecone
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from utils.config import google_config, pinecone_config, azure_config
+from utils.clients import clients
+from utils.config import google_config, graph_config, speculation_config
+from utils.metrics import export_stats, track_upstream
+from utils.prompt_budget import budget_context
+from utils.request_context import get_request_context, tool_slot, within_deadline
+from utils.speculation import take_speculative
+from utils.tool_cache import ToolResultCache
 import logging
 
 logger = logging.getLogger(__name__)
 
-AGENT_MODEL = "gpt-4o"
-llm = ChatOpenAI(
-    model=AGENT_MODEL,
-    temperature=0,
-)
+# Google Custom Search JSON API, queried directly so searches don't block the event loop
+GOOGLE_SEARCH_URL = "https://www.googleapis.com/customsearch/v1"
+GOOGLE_SEARCH_RESULTS = 10
+
+# The chat models, embeddings and Pinecone index are created on first use by the shared client registry
+
+# Results of identical tool calls are shared across requests for a short while
+tool_cache = ToolResultCache()
+
+export_stats([("cache", "tool_results", tool_cache)])
+
+# Knowledge base type searched by each retrieval tool
+KB_TOOL_TYPES = {
+    "legal_expert": "finance",
+    "finance_expert": "finance",
+}
+
+
+async def google_search(query: str) -> str:
+    """Runs a Google search and joins the result snippets, like GoogleSearchAPIWrapper.run."""
+    params = {
+        "key": google_config.api_key,
+        "cx": google_config.cse_id,
+        "q": query,
+        "num": GOOGLE_SEARCH_RESULTS,
+    }
+    async with track_upstream("google", "search"):
+        response = await clients.get("google_http").get(GOOGLE_SEARCH_URL, params=params)
+        response.raise_for_status()
+    items = response.json().get("items", [])
+    if not items:
+        return "No good Google Search Result was found"
+    return " ".join(item["snippet"] for item in items if "snippet" in item)
+
+
+async def search_knowledge_base(query: str, kb_type: str, k: int = 2) -> str:
+    """Knowledge base context for the query, reusing a speculative retrieval when one matches."""
+    speculative = await take_speculative(("kb", kb_type), query)
+    if speculative is not None:
+        return speculative
+    return await retrieve_knowledge_base(query, kb_type, k)
+
+
+async def retrieve_knowledge_base(query: str, kb_type: str, k: int = 2) -> str:
+    """Retrieves the best knowledge base chunks of the given type, formatted as prompt context."""
+    results = await clients.get("kb_retriever").retrieve(query, kb_type, k)
+    # Bounded so long chunks can't blow up the expert prompt
+    documents = budget_context([result.text for result in results])
+
+    formatted_results = []
+    for i, text in enumerate(documents, 1):
+        formatted_results.append(f"Document {i}:\n{text}\n")
+
+    return "\n".join(formatted_results)
+
+
+async def ask_model(role: str, query: str, messages: list, context: Optional[str] = None):
+    """Answers with the small or the large chat model, as the model tier policy decides."""
+    model_tiers = clients.get("model_tiers")
+    small = clients.get("small_chat_model") if model_tiers.enabled else None
+    return await model_tiers.ainvoke(role, query, messages, small, clients.get("chat_model"), context=context)
+
+
+async def ask_expert(role: str, system_prompt: str, query: str) -> str:
+    messages = [("system", system_prompt), ("user", query)]
+    async with tool_slot():
+        response = await ask_model(role, query, messages)
+    return response.content
+
+
+async def ask_knowledge_base_expert(role: str, system_prompt: str, query: str, kb_type: str) -> str:
+    async with tool_slot():
+        context = await search_knowledge_base(query, kb_type)
+
+        messages = [("system", system_prompt), ("user", f"My question: {query}. Relevant knowledge base: {context}.")]
+        response = await ask_model(role, query, messages, context=context)
+    return response.content
+
 
-# Initialize Google Search
-search = GoogleSearchAPIWrapper(
-    google_api_key=google_config.api_key,
-    google_cse_id=google_config.cse_id
-)
+async def run_google_search(query: str) -> str:
+    speculative = await take_speculative(("google", ""), query)
+    if speculative is not None:
+        return speculative
+    async with tool_slot():
+        return await google_search(query)
 
-# Initialize Pinecone with embeddings
-embeddings = OpenAIEmbeddings(model="text-embedding-ada-002")
 
-pc = Pinecone(api_key=pinecone_config.api_key)
-index = pc.Index(pinecone_config.index_name)
+def speculative_retrievals(query: str) -> dict:
+    """Retrievals worth starting for the raw user query while the supervisor decides."""
+    retrievals = {
+        ("kb", kb_type): (lambda kb_type=kb_type: retrieve_knowledge_base(query, kb_type))
+        for kb_type in set(KB_TOOL_TYPES.values())
+    }
+    if speculation_config.include_google:
+        retrievals[("google", "")] = lambda: google_search(query)
+    return retrievals
 
-kb = pc.Index('kb')
 
-vectorstore = PineconeVectorStore(index=index, embedding=embeddings)
-store = PineconeVectorStore(index=kb, embedding=embeddings)
+async def run_tool(tool_name: str, query: str, call, kb_type: Optional[str] = None) -> str:
+    """
+    Runs a tool call through the result cache, stopping it when its time is up.
+
+    A call gets at most TOOL_TIMEOUT seconds and must end before the request's
+    deadline; a stopped call answers that it ran out of time. Results are recorded
+    in the request context so a partial answer can be assembled from them, and
+    failures so the answer isn't cached.
+    """
+    context = get_request_context()
+    try:
+        result = await within_deadline(tool_cache.get_or_call(tool_name, query, call, kb_type=kb_type),
+                                       timeout=graph_config.tool_timeout or None, reserve=graph_config.deadline_reserve)
+    except asyncio.TimeoutError:
+        logger.warning(f"{tool_name} ran out of time and was stopped")
+        if context is not None:
+            context.timed_out.append(tool_name)
+        return f"{tool_name} ran out of time and was stopped before answering."
+    except Exception:
+        if context is not None:
+            context.tool_errors.append(tool_name)
+        raise
+    if context is not None:
+        context.tool_outputs.append((tool_name, result))
+    return result
 
 
 @tool
-def search_google(query: str) -> str:
+async def search_google(query: str) -> str:
     """Performs a Google search using the provided query and returns the results."""
     try:
-        results = search.run(query)
-        return results
+        return await run_tool("search_google", query, lambda: run_google_search(query))
     except Exception as e:
         logger.error(f"Google search error: {str(e)}")
         return f"Error performing Google search: {str(e)}"
@@ -56,7 +161,7 @@ def format_search_results(results: list) -> str:
 
 
 @tool
-def frontend_agent_tool(query: str) -> str:
+async def frontend_agent_tool(query: str) -> str:
     """
     Processes frontend development queries.
     Used when the user asks about user interface design, client-side technologies, or frontend-specific implementation details.
@@ -64,13 +169,14 @@ def frontend_agent_tool(query: str) -> str:
     Returns:
        A detailed response with expert advice on frontend development.
     """
-    messages = [("system", "You are a Frontend Development expert."), ("user", query)]
-    response = llm.invoke(messages)
-    return response.content
+    return await run_tool(
+        "frontend_agent_tool", query,
+        lambda: ask_expert("frontend_agent_tool", "You are a Frontend Development expert.", query),
+    )
 
 
 @tool
-def backend_agent_tool(query: str) -> str:
+async def backend_agent_tool(query: str) -> str:
     """
     Processes backend development queries.
     Used when the user asks about server-side programming, database management, or backend architecture.
@@ -78,13 +184,14 @@ def backend_agent_tool(query: str) -> str:
     Returns:
        A detailed response with expert advice on backend development.
     """
-    messages = [("system", "You are a Backend Development expert."), ("user", query)]
-    response = llm.invoke(messages)
-    return response.content
+    return await run_tool(
+        "backend_agent_tool", query,
+        lambda: ask_expert("backend_agent_tool", "You are a Backend Development expert.", query),
+    )
 
 
 @tool
-def designer_agent_tool(query: str) -> str:
+async def designer_agent_tool(query: str) -> str:
     """
     Processes design-related queries.
     Used when the user asks about user experience, graphic design, or interface aesthetics.
@@ -92,13 +199,14 @@ def designer_agent_tool(query: str) -> str:
     Returns:
        A detailed response with expert advice on design and user experience.
     """
-    messages = [("system", "You are a Design expert."), ("user", query)]
-    response = llm.invoke(messages)
-    return response.content
+    return await run_tool(
+        "designer_agent_tool", query,
+        lambda: ask_expert("designer_agent_tool", "You are a Design expert.", query),
+    )
 
 
 @tool
-def legal_expert(query: str) -> str:
+async def legal_expert(query: str) -> str:
     """
     Processes legal-related queries and give relevant answer from knowledge base.
     Used when the user asks about legal, terms, or clauses.
@@ -107,17 +215,12 @@ def legal_expert(query: str) -> str:
        A detailed answer from knowledge base.
     """
     try:
-        results = store.similarity_search(query, k=2, filter={"type": "finance"})
-
-        formatted_results = []
-        for i, doc in enumerate(results, 1):
-            formatted_results.append(f"Document {i}:\n{doc.page_content}\n")
-
-        context = "\n".join(formatted_results)
-
-        messages = [("system", "You are a legal expert."), ("user", f"My question: {query}. Relevant knowledge base: {context}.")]
-        response = llm.invoke(messages)
-        return response.content
+        kb_type = KB_TOOL_TYPES["legal_expert"]
+        return await run_tool(
+            "legal_expert", query,
+            lambda: ask_knowledge_base_expert("legal_expert", "You are a legal expert.", query, kb_type),
+            kb_type=kb_type,
+        )
 
     except Exception as e:
         logger.error(f"Knowledge base search error: {str(e)}")
@@ -125,7 +228,7 @@ def legal_expert(query: str) -> str:
 
 
 @tool
-def finance_expert(query: str) -> str:
+async def finance_expert(query: str) -> str:
     """
     Processes finance-related queries and give relevant answer from knowledge base.
     Used when the user asks about finance.
@@ -134,17 +237,12 @@ def finance_expert(query: str) -> str:
        A detailed answer from knowledge base.
     """
     try:
-        results = store.similarity_search(query, k=2, filter={"type": "finance"})
-
-        formatted_results = []
-        for i, doc in enumerate(results, 1):
-            formatted_results.append(f"Document {i}:\n{doc.page_content}\n")
-
-        context = "\n".join(formatted_results)
-
-        messages = [("system", "You are a finance expert."), ("user", f"My question: {query}. Relevant knowledge base: {context}.")]
-        response = llm.invoke(messages)
-        return response.content
+        kb_type = KB_TOOL_TYPES["finance_expert"]
+        return await run_tool(
+            "finance_expert", query,
+            lambda: ask_knowledge_base_expert("finance_expert", "You are a finance expert.", query, kb_type),
+            kb_type=kb_type,
+        )
 
     except Exception as e:
         logger.error(f"Knowledge base search error: {str(e)}")
@@ -0,0 +1,331 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Deque, Dict, Optional
+
+import httpx
+
+from utils.config import transport_config
+from utils.metrics import upstream_queue_seconds
+
+logger = logging.getLogger(__name__)
+
+# Status codes that mean the upstream wants us to slow down
+THROTTLED_STATUSES = {429, 503}
+
+
+class _Waiter:
+    """A queued request; granted from whichever thread frees capacity."""
+
+    def __init__(self, tokens: float, loop: Optional[asyncio.AbstractEventLoop]):
+        self.tokens = tokens
+        self.loop = loop
+        self.future: Optional[asyncio.Future] = loop.create_future() if loop else None
+        self.event = None if loop else threading.Event()
+        self.granted = False
+
+    def grant(self) -> None:
+        self.granted = True
+        if self.loop:
+            try:
+                self.loop.call_soon_threadsafe(_resolve, self.future)
+            except RuntimeError:
+                # The waiter's loop is closed; its request is gone
+                pass
+        else:
+            self.event.set()
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class UpstreamLimiter:
+    """
+    Concurrency limit plus request and token buckets for one upstream API.
+
+    Requests over the limit wait in a FIFO queue instead of failing. The limiter
+    is shared by every thread and event loop in the process. Concurrency adapts:
+    it halves when the upstream throttles (429/503, honouring Retry-After) and
+    grows back by one slot per window of successful requests, up to
+    ``max_concurrency``.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, rpm: float = 0, tpm: float = 0):
+        """
+        Args:
+            name: Upstream name used in metrics
+            max_concurrency: Maximum requests in flight
+            rpm: Requests per minute quota; 0 for no limit
+            tpm: Tokens per minute quota; 0 for no limit
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._inflight = 0
+        self._queue: Deque[_Waiter] = collections.deque()
+        self._lock = threading.Lock()
+        self.granted = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def acquire(self, tokens: float = 0) -> None:
+        """Waits for a slot and ``tokens`` of the token budget."""
+        waiter = _Waiter(tokens, asyncio.get_running_loop())
+        started = time.monotonic()
+        with self._lock:
+            self._queue.append(waiter)
+            delay = self._dispatch()
+        try:
+            while not waiter.granted:
+                # Woken by a release, or after the buckets have refilled enough for the head of the queue
+                await asyncio.wait([waiter.future], timeout=delay)
+                with self._lock:
+                    delay = self._dispatch()
+        except BaseException:
+            with self._lock:
+                if waiter.granted:
+                    self._release()
+                else:
+                    self._queue.remove(waiter)
+                    self._dispatch()
+            raise
+        self._record_wait(time.monotonic() - started)
+
+    def acquire_sync(self, tokens: float = 0) -> None:
+        """Blocking variant of ``acquire`` for clients that run in worker threads."""
+        waiter = _Waiter(tokens, None)
+        started = time.monotonic()
+        with self._lock:
+            self._queue.append(waiter)
+            delay = self._dispatch()
+        while not waiter.granted:
+            waiter.event.wait(delay)
+            with self._lock:
+                delay = self._dispatch()
+        self._record_wait(time.monotonic() - started)
+
+    def release(self, status_code: Optional[int] = None, retry_after: Optional[float] = None) -> None:
+        """Frees a slot, adapting the concurrency limit to the response status."""
+        with self._lock:
+            if status_code in THROTTLED_STATUSES:
+                self.throttled += 1
+                self.limit = max(1.0, self.limit / 2)
+                pause = retry_after if retry_after is not None else transport_config.throttle_pause
+                self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+                logger.warning(f"{self.name} throttled; concurrency limit now {int(self.limit)}")
+            elif status_code is not None and status_code < 500:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._release()
+
+    def _release(self) -> None:
+        self._inflight -= 1
+        self._dispatch()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.rpm:
+            self._requests = min(float(self.rpm), self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(float(self.tpm), self._tokens + elapsed * self.tpm / 60)
+
+    def _dispatch(self) -> Optional[float]:
+        """Grants queued requests in order while capacity allows; returns how long the head has to wait."""
+        now = time.monotonic()
+        self._refill(now)
+        while self._queue:
+            if self._inflight >= int(self.limit):
+                # A release will wake the queue; poll anyway in case a granted request's loop died
+                return transport_config.queue_poll_interval
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            head = self._queue[0]
+            # A request bigger than the whole bucket only needs a full bucket
+            tokens = min(head.tokens, self.tpm) if self.tpm else 0
+            wait = 0.0
+            if self.rpm and self._requests < 1:
+                wait = (1 - self._requests) * 60 / self.rpm
+            if tokens and self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+            if wait > 0:
+                return wait
+            if self.rpm:
+                self._requests -= 1
+            if tokens:
+                self._tokens -= tokens
+            self._inflight += 1
+            self.granted += 1
+            self._queue.popleft().grant()
+        return None
+
+    def _record_wait(self, seconds: float) -> None:
+        upstream_queue_seconds.observe(seconds, upstream=self.name)
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "queue_depth": len(self._queue),
+                "inflight": self._inflight,
+                "concurrency_limit": int(self.limit),
+                "granted": self.granted,
+                "throttled": self.throttled,
+                "wait_seconds_avg": self.wait_total / self.granted if self.granted else 0.0,
+                "wait_seconds_max": self.wait_max,
+            }
+
+
+def estimate_request_tokens(request: httpx.Request) -> float:
+    """Rough token cost of an API request: about four bytes of JSON per token."""
+    return len(request.content) / 4 if request.content else 0
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Response body that gives the limiter slot back once it has been read or closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release: Callable[[], None]):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class LimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Pooled keep-alive transport that admits requests through an UpstreamLimiter.
+
+    Connection pools are bound to an event loop, so one pool is kept per running
+    loop; with a persistent loop per worker every caller shares the same pool.
+    A loop's pool and its connections are closed when the loop closes, so the
+    short-lived loops of WSGI async views don't leak them. Closing a client built
+    on this transport leaves the shared pools open.
+    """
+
+    def __init__(self, limiter: UpstreamLimiter,
+                 estimate_tokens: Callable[[httpx.Request], float] = estimate_request_tokens):
+        self.limiter = limiter
+        self.estimate_tokens = estimate_tokens
+        self._pools: Dict[asyncio.AbstractEventLoop, httpx.AsyncHTTPTransport] = {}
+        self._pools_lock = threading.Lock()
+
+    def _pool(self) -> httpx.AsyncHTTPTransport:
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            pool = self._pools.get(loop)
+            if pool is None:
+                pool = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+                    max_connections=transport_config.max_connections,
+                    max_keepalive_connections=transport_config.max_keepalive_connections,
+                    keepalive_expiry=transport_config.keepalive_expiry,
+                ))
+                self._pools[loop] = pool
+                self._close_with(loop)
+            return pool
+
+    def _close_with(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Makes closing ``loop`` close its pool first, while the loop can still run the shutdown."""
+        close = loop.close
+
+        def close_pool_then_loop():
+            with self._pools_lock:
+                pool = self._pools.pop(loop, None)
+            if pool is not None and not loop.is_closed() and not loop.is_running():
+                try:
+                    loop.run_until_complete(pool.aclose())
+                except Exception as e:
+                    logger.warning(f"Error closing {self.limiter.name} connection pool: {str(e)}")
+            close()
+
+        try:
+            loop.close = close_pool_then_loop
+        except AttributeError:
+            # Loop types without instance attributes (uvloop) are the persistent ones; keep their pool
+            pass
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.limiter.acquire(self.estimate_tokens(request))
+        try:
+            response = await self._pool().handle_async_request(request)
+        except BaseException:
+            self.limiter.release()
+            raise
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.limiter.release(response.status_code, _retry_after(response))
+
+        if response.is_closed:
+            # The body was already read into memory
+            release()
+        else:
+            response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self) -> None:
+        # Shared across clients; pools live as long as their event loop
+        pass
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class LimitedIndex:
+    """Vector index wrapper that admits upsert/query/delete/fetch calls through an UpstreamLimiter."""
+
+    def __init__(self, index, limiter: UpstreamLimiter):
+        self._index = index
+        self.limiter = limiter
+
+    def _call(self, method: str, *args, **kwargs):
+        self.limiter.acquire_sync()
+        try:
+            result = getattr(self._index, method)(*args, **kwargs)
+        except Exception as e:
+            self.limiter.release(getattr(e, "status", None))
+            raise
+        self.limiter.release(200)
+        return result
+
+    def query(self, *args, **kwargs):
+        return self._call("query", *args, **kwargs)
+
+    def upsert(self, *args, **kwargs):
+        return self._call("upsert", *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call("delete", *args, **kwargs)
+
+    def fetch(self, *args, **kwargs):
+        return self._call("fetch", *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._index, name)